@@ -0,0 +1,276 @@
+"""
+Search backends of ``NumpyVectorStore``.
+
+Vectors are L2-normalised, so every backend ranks by dot product.
+
+    - ``ExactSearch`` scores the query against the whole matrix.
+    - ``IVFIndex`` is an inverted-file index: the vectors are clustered with
+      spherical k-means and a query is only scored against the vectors of the
+      ``n_probe`` clusters whose centroids are closest to it. More lists make
+      each probe cheaper, more probes trade latency for recall.
+    - ``Int8Search`` and ``BinarySearch`` keep quantized codes in memory
+      (1/4 and 1/32 of the float32 size), rank every vector with them and
+      rescore the ``rescore * k`` best candidates with the full-precision
+      matrix, which can stay memory-mapped on disk.
+"""
+
+import os
+
+import numpy as np
+
+
+def _top_k(similarities, k):
+    k = min(k, len(similarities))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top[np.argsort(-similarities[top], kind="stable")]
+
+
+class ExactSearch:
+    name = "exact"
+
+    def __init__(self):
+        self.n_vectors = None
+
+    def fit(self, vectors):
+        self.n_vectors = len(vectors)
+        return self
+
+    def search(self, vectors, query, k):
+        """
+        Returns the indices of the ``k`` best vectors and their similarities.
+        """
+        similarities = vectors @ query
+        top = _top_k(similarities, k)
+        return top, similarities[top]
+
+    def save(self, path):
+        pass
+
+    @classmethod
+    def load(cls, path, **params):
+        return None
+
+
+class IVFIndex:
+    name = "ivf"
+
+    def __init__(self, n_lists=None, n_probe=16, n_iter=10, max_train=65536, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.max_train = max_train
+        self.seed = seed
+        self.n_vectors = None
+        self.centroids = None
+        # vector indices sorted by list, list i is order[offsets[i]:offsets[i + 1]]
+        self.order = None
+        self.offsets = None
+
+    @staticmethod
+    def _assign(vectors, centroids, batch_size=16384):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            batch = np.asarray(vectors[start : start + batch_size])
+            assignments[start : start + batch_size] = np.argmax(
+                batch @ centroids.T, axis=1
+            )
+        return assignments
+
+    def fit(self, vectors):
+        n = len(vectors)
+        n_lists = self.n_lists or max(1, int(2 * np.sqrt(n)))
+        n_lists = min(n_lists, n) if n else 1
+        rng = np.random.default_rng(self.seed)
+
+        train = np.asarray(
+            vectors[np.sort(rng.choice(n, min(n, self.max_train), replace=False))]
+            if n
+            else vectors
+        )
+        centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignments = self._assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, train)
+            counts = np.bincount(assignments, minlength=n_lists)
+            # empty clusters keep their previous centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        assignments = self._assign(vectors, centroids)
+        self.centroids = centroids.astype(np.float32)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignments, minlength=n_lists))]
+        )
+        self.n_vectors = n
+        return self
+
+    def search(self, vectors, query, k):
+        n_probe = min(self.n_probe, len(self.centroids))
+        lists = _top_k(self.centroids @ query, n_probe)
+        candidates = np.concatenate(
+            [self.order[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+        )
+        # sorted rows read a memory-mapped matrix sequentially
+        candidates.sort()
+        similarities = vectors[candidates] @ query
+        top = _top_k(similarities, k)
+        return candidates[top], similarities[top]
+
+    def save(self, path):
+        np.savez(
+            os.path.join(path, "ivf.npz"),
+            centroids=self.centroids,
+            order=self.order,
+            offsets=self.offsets,
+            n_vectors=self.n_vectors,
+        )
+
+    @classmethod
+    def load(cls, path, **params):
+        """
+        Returns the index saved in ``path``, or ``None`` if there is none.
+        """
+        file = os.path.join(path, "ivf.npz")
+        if not os.path.exists(file):
+            return None
+        index = cls(**params)
+        with np.load(file) as data:
+            index.centroids = data["centroids"]
+            index.order = data["order"]
+            index.offsets = data["offsets"]
+            index.n_vectors = int(data["n_vectors"])
+        if params.get("n_lists") not in (None, len(index.centroids)):
+            return None
+        return index
+
+
+class _QuantizedSearch:
+    """
+    Ranks with quantized codes, then rescores the best candidates with the
+    full-precision vectors. Subclasses define ``quantize`` and ``_scores``.
+    """
+
+    name = None
+    # small blocks keep the float32 copy of the codes in cache
+    block_size = 1024
+
+    def __init__(self, rescore=8):
+        self.rescore = rescore
+        self.n_vectors = None
+        self.codes = None
+
+    @property
+    def nbytes(self):
+        """Resident size of the quantized codes."""
+        return sum(array.nbytes for array in self._arrays().values())
+
+    def fit(self, vectors):
+        blocks = [
+            self.quantize(np.asarray(vectors[start : start + self.block_size]))
+            for start in range(0, len(vectors), self.block_size)
+        ]
+        self._set_arrays(
+            {
+                name: np.concatenate([block[name] for block in blocks])
+                for name in blocks[0]
+            }
+        )
+        self.n_vectors = len(vectors)
+        return self
+
+    def search(self, vectors, query, k):
+        # scored by blocks to bound the size of the temporaries
+        scores = np.concatenate(
+            [
+                self._scores(start, start + self.block_size, query)
+                for start in range(0, self.n_vectors, self.block_size)
+            ]
+        )
+        candidates = _top_k(scores, self.rescore * k)
+        candidates.sort()
+        similarities = np.asarray(vectors[candidates]) @ query
+        top = _top_k(similarities, k)
+        return candidates[top], similarities[top]
+
+    def save(self, path):
+        np.savez(os.path.join(path, f"{self.name}.npz"), **self._arrays())
+
+    @classmethod
+    def load(cls, path, **params):
+        file = os.path.join(path, f"{cls.name}.npz")
+        if not os.path.exists(file):
+            return None
+        index = cls(**params)
+        with np.load(file) as data:
+            index._set_arrays({name: data[name] for name in data.files})
+        index.n_vectors = len(index.codes)
+        return index
+
+
+class Int8Search(_QuantizedSearch):
+    """
+    Symmetric per-vector int8 quantization: ``v ~ scale * codes``.
+    """
+
+    name = "int8"
+
+    def _arrays(self):
+        return {"codes": self.codes, "scales": self.scales}
+
+    def _set_arrays(self, arrays):
+        self.codes = arrays["codes"]
+        self.scales = arrays["scales"]
+
+    @staticmethod
+    def quantize(vectors):
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+
+    def _scores(self, start, stop, query):
+        codes = self.codes[start:stop].astype(np.float32)
+        return (codes @ query) * self.scales[start:stop]
+
+
+class BinarySearch(_QuantizedSearch):
+    """
+    1-bit quantization keeping the sign of every dimension. The query is not
+    quantized: scoring it against the sign bits ranks much better than the
+    Hamming distance between sign vectors, for about the same cost in numpy.
+    """
+
+    name = "binary"
+
+    def __init__(self, rescore=64):
+        super().__init__(rescore=rescore)
+
+    def _arrays(self):
+        return {"codes": self.codes}
+
+    def _set_arrays(self, arrays):
+        self.codes = arrays["codes"]
+
+    @staticmethod
+    def quantize(vectors):
+        return {"codes": np.packbits(vectors > 0, axis=1)}
+
+    def _scores(self, start, stop, query):
+        # bits @ q ranks like signs @ q, which is 2 * bits @ q - sum(q)
+        bits = np.unpackbits(self.codes[start:stop], axis=1, count=len(query))
+        return bits.astype(np.float32) @ query
+
+
+SEARCH_BACKENDS = {
+    "exact": ExactSearch,
+    "ivf": IVFIndex,
+    "int8": Int8Search,
+    "binary": BinarySearch,
+}
@@ -2,9 +2,18 @@ import os
 
 import gradio as gr
 from llm_chatbot import MistralChatbot
+from serving import ChatServer, Overloaded
 from utils import _set_env
 
 
+# turns generated at once, and turns waiting for a slot before new ones are
+# turned away
+MAX_CONCURRENCY = int(os.environ.get("CHAT_MAX_CONCURRENCY", 8))
+MAX_QUEUE = int(os.environ.get("CHAT_MAX_QUEUE", 32))
+# port of the Prometheus metrics of the pipeline stages, unset to not serve them
+METRICS_PORT = os.environ.get("CHAT_METRICS_PORT")
+
+
 _set_env("MISTRAL_API_KEY")
 _set_env("TAVILY_API_KEY")
 _set_env("HF_TOKEN")
@@ -21,14 +30,40 @@ chatbot = MistralChatbot(
     db_patient_path="rag_dataset_patient.json",
     db_doctor_path="rag_dataset_doctor.json",
     ehr_path="ehr_context.txt",
+    grading="background",
     debug=True,
 )
-
-
-def respond(message):
+# the index and caches of the chatbot are shared, each browser session keeps
+# its own conversation state
+server = ChatServer(chatbot, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE)
+if METRICS_PORT:
+    chatbot.instrumentation.serve_prometheus(int(METRICS_PORT))
+
+
+async def respond(message, request: gr.Request):
+    """
+    Streams the answer into the response box as it is generated, then
+    appends the suggested questions, and a warning if the background grader
+    finds the answer ungrounded.
+    """
     print(message)
-    chat_response = chatbot.run_once(message)
-    return chat_response
+    answer = ""
+    try:
+        async for event in server.astream(request.session_hash, message):
+            if event.kind == "token":
+                answer += event.data
+                yield answer
+            elif event.kind == "suggestions":
+                answer = f"{answer}\n\nSuggested questions:\n{event.data}"
+                yield answer
+            elif event.kind == "metrics":
+                print("time to first token", event.data.get("time_to_first_token"))
+                print("server", server.stats)
+            elif event.kind == "grade" and event.data.binary_score != "yes":
+                yield f"{answer}\n\nThis answer may not be grounded: {event.data.explanation}"
+    except Overloaded:
+        yield "The assistant is busy right now, please try again in a moment."
+
 
 suggestion2 = "When is my next appointment with my oncologist?"
 suggestion4 = "What is hormone therapy for breast cancer?"
@@ -52,10 +87,14 @@ with gr.Blocks() as iface:
         button = gr.Button(button_value)
         # Use the button's value directly as input for the respond function
         button.click(
-            fn=respond, inputs=gr.Textbox(value=button_value, visible=False), outputs=output_textbox
+            fn=respond,
+            inputs=gr.Textbox(value=button_value, visible=False),
+            outputs=output_textbox,
         )
 
     # Initially set up the function to respond to the input box
     textbox.submit(fn=respond, inputs=textbox, outputs=output_textbox)
 
-iface.launch()
\ No newline at end of file
+# concurrency is limited by the admission control of the server, not by Gradio
+iface.queue(default_concurrency_limit=None)
+iface.launch()
@@ -0,0 +1,156 @@
+"""
+Runs a file of questions through the chatbot, for evaluating a guideline set
+or a model without typing the questions into ``main.py``.
+
+    python batch_eval.py questions.jsonl answers.jsonl --concurrency 16 --grade
+
+Every line of the questions file is a JSON object with a ``question`` and
+optionally an ``id`` (the line number by default) and a ``patient_id`` (an
+EHR of ``--ehr-dir``, the one of ``--ehr-path`` by default). Questions are run
+``--concurrency`` at a time and every result is appended to the output file
+as soon as it is ready, one JSON object per line with the answer, route,
+retrieved sources, suggestions, grade and stage timings, or the error.
+
+The output file is the checkpoint: a run that is started again skips the
+questions already answered in it, and retries the ones that failed (their
+later result is appended after the error).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from llm_chatbot import MistralChatbot, TurnContext
+
+
+def read_questions(path):
+    questions = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            questions.append(
+                {
+                    "id": str(item.get("id", line_number)),
+                    "question": item["question"],
+                    "patient_id": item.get("patient_id"),
+                }
+            )
+    return questions
+
+
+def answered_ids(output_path):
+    """
+    IDs of the questions answered in ``output_path``. A last line cut short
+    by an interruption is dropped from the file.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        complete = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            record = json.loads(line)
+            if "error" not in record:
+                done.add(record["id"])
+        f.truncate(complete)
+    return done
+
+
+def turn_record(item, turn):
+    record = {
+        **item,
+        "route": turn.route,
+        "answer": turn.answer,
+        "sources": sorted({doc.metadata.get("source") for doc in turn.docs or []}),
+        "suggestions": turn.suggestions,
+        "timings": turn.timings,
+    }
+    if turn.grade is not None:
+        record["grade"] = {
+            "binary_score": turn.grade.binary_score,
+            "explanation": turn.grade.explanation,
+        }
+    return record
+
+
+async def run_batch(chatbot, questions, output_path, max_concurrency=8):
+    """
+    Runs ``questions`` not answered yet in ``output_path``, at most
+    ``max_concurrency`` at a time, appending their results to it. Returns
+    the number of questions answered and failed.
+    """
+    done = answered_ids(output_path)
+    pending = [item for item in questions if item["id"] not in done]
+    counts = {"answered": 0, "failed": 0, "skipped": len(questions) - len(pending)}
+    items = iter(pending)
+    start = time.perf_counter()
+
+    with open(output_path, "a") as output:
+
+        async def worker():
+            for item in items:
+                try:
+                    turn = await chatbot.arun_turn(
+                        TurnContext(item["question"], item["patient_id"])
+                    )
+                    record = turn_record(item, turn)
+                    counts["answered"] += 1
+                except Exception as e:
+                    record = {**item, "error": f"{type(e).__name__}: {e}"}
+                    counts["failed"] += 1
+                output.write(json.dumps(record, default=str) + "\n")
+                output.flush()
+                finished = counts["answered"] + counts["failed"]
+                rate = finished / (time.perf_counter() - start)
+                print(
+                    f"\r{finished}/{len(pending)} questions ({rate:.2f}/s)",
+                    end="" if finished < len(pending) else "\n",
+                    file=sys.stderr,
+                    flush=True,
+                )
+
+        # the workers share one iterator, so at most max_concurrency turns run
+        await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("questions", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file of results, resumed if it exists")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--grade", action="store_true", help="grade every answer")
+    parser.add_argument("--db-patient-path", default="rag_dataset_patient.json")
+    parser.add_argument("--db-doctor-path", default="rag_dataset_doctor.json")
+    parser.add_argument("--ehr-path", default="ehr_context.txt")
+    parser.add_argument(
+        "--ehr-dir", default=None, help="one <patient_id>.txt per patient"
+    )
+    parser.add_argument("--audience", default="patient")
+    args = parser.parse_args()
+
+    chatbot = MistralChatbot(
+        db_patient_path=args.db_patient_path,
+        db_doctor_path=args.db_doctor_path,
+        ehr_path=args.ehr_path,
+        ehr_dir=args.ehr_dir,
+        audience=args.audience,
+        # every question is answered, duplicates included
+        response_cache_size=0,
+        grading="blocking" if args.grade else "off",
+        grading_workers=args.concurrency,
+    )
+    counts = asyncio.run(
+        run_batch(
+            chatbot, read_questions(args.questions), args.output, args.concurrency
+        )
+    )
+    print(json.dumps(counts))
@@ -0,0 +1,91 @@
+"""
+Recall and latency of the approximate search backends against exact search,
+on synthetic clustered corpora of increasing size.
+
+    python benchmarks/bench_ann.py --sizes 10000 50000 100000 --n-probe 4 8 16
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ann_index import ExactSearch, IVFIndex  # noqa: E402
+
+
+def synthetic_corpus(n, dim, n_topics, rng):
+    """
+    Normalised vectors drawn around ``n_topics`` random directions, which is
+    closer to real chunk embeddings than uniform noise.
+    """
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(n_topics, size=n)]
+    vectors += 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def queries_for(vectors, n_queries, rng):
+    queries = vectors[rng.integers(len(vectors), size=n_queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run(backend, vectors, queries, k):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        indices, _ = backend.search(vectors, query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(indices.tolist()))
+    latencies = np.array(latencies) * 1e3
+    return results, {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--dim", type=int, default=1024, help="mistral-embed size")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    report = []
+    for n in args.sizes:
+        vectors = synthetic_corpus(n, args.dim, n_topics=max(10, n // 500), rng=rng)
+        queries = queries_for(vectors, args.queries, rng)
+        exact, exact_latency = run(ExactSearch().fit(vectors), vectors, queries, args.k)
+        report.append({"n": n, "backend": "exact", "recall": 1.0, **exact_latency})
+
+        start = time.perf_counter()
+        ivf = IVFIndex(n_lists=args.n_lists).fit(vectors)
+        build_s = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            found, latency = run(ivf, vectors, queries, args.k)
+            recall = np.mean([len(a & b) / args.k for a, b in zip(found, exact)])
+            report.append(
+                {
+                    "n": n,
+                    "backend": "ivf",
+                    "n_lists": len(ivf.centroids),
+                    "n_probe": n_probe,
+                    "build_s": build_s,
+                    f"recall@{args.k}": float(recall),
+                    **latency,
+                }
+            )
+        for row in report[-len(args.n_probe) - 1 :]:
+            print(json.dumps(row))
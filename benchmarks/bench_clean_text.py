@@ -0,0 +1,107 @@
+"""
+Micro-benchmark of ``utils.clean_text`` against the previous replace-loop
+implementation, over the text behind ``rag_dataset_doctor.json`` cut into
+page-sized pieces. Also checks that both produce identical output.
+
+    python benchmarks/bench_clean_text.py --dataset rag_dataset_doctor.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import clean_text, to_be_removed, to_be_replaced  # noqa: E402
+
+
+def clean_text_reference(text):
+    """
+    ``clean_text`` before it was turned into a single-pass normalizer.
+    """
+    for char in to_be_removed:
+        text = text.replace(char, "")
+    for char, replacement in to_be_replaced.items():
+        text = text.replace(char, replacement)
+    text = re.sub(r"\.([^ ])", r". \1", text)
+    text = re.sub(r"([a-zà-öø-ÿ])([A-ZÀ-ÖØ-Þ])", r"\1 \2", text)
+    text = text.replace(" ,", ",")
+    text = text.replace(" .", ".")
+    text = text.replace(" -", "-")
+    text = text.replace("- ", "-")
+    while "  " in text:
+        text = text.replace("  ", " ")
+    return text
+
+
+def load_pages(dataset, page_size):
+    with open(dataset) as f:
+        data = json.load(f)
+    pages = []
+    for item in data.values():
+        text = item["text"]
+        pages.extend(text[i : i + page_size] for i in range(0, len(text), page_size))
+    return pages
+
+
+def raw_like(page, rng):
+    """
+    Puts back what extracted PDF pages contain and the corpus no longer does:
+    line breaks, bullets, special characters and long runs of spaces.
+    """
+    specials = to_be_removed + list(to_be_replaced)
+    words = page.split(" ")
+    out = []
+    for word in words:
+        r = rng.random()
+        if r < 0.05:
+            out.append(rng.choice(specials))
+        elif r < 0.08:
+            out.append(" " * rng.randint(2, 40))
+        elif r < 0.1:
+            word = word.capitalize()
+        out.append(word)
+    return " ".join(out)
+
+
+def bench(fn, pages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            fn(page)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dataset", default="rag_dataset_doctor.json")
+    parser.add_argument("--page-size", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus_pages = load_pages(args.dataset, args.page_size)
+    variants = {
+        "corpus": corpus_pages,
+        "raw-like": [raw_like(page, rng) for page in corpus_pages],
+    }
+    results = {}
+    for name, pages in variants.items():
+        for page in pages:
+            assert clean_text(page) == clean_text_reference(page), "output differs"
+        before = bench(clean_text_reference, pages, args.repeat)
+        after = bench(clean_text, pages, args.repeat)
+        results[name] = {
+            "pages": len(pages),
+            "reference_us_per_page": before * 1e6,
+            "clean_text_us_per_page": after * 1e6,
+            "speedup": before / after,
+        }
+    print(json.dumps(results, indent=2))
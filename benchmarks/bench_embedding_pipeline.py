@@ -0,0 +1,47 @@
+"""
+Throughput of ``BatchedEmbeddings`` against the fake Mistral server, which
+adds a fixed latency per request and rate limits requests per second.
+
+    python benchmarks/bench_embedding_pipeline.py --chunks 2000 --latency 0.05 --rate-limit 40
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from embedding_pipeline import BatchedEmbeddings  # noqa: E402
+from fake_mistral_server import FakeMistralServer  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-chars", type=int, default=3000, help="~1000 tokens")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit", type=float, default=40.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    texts = [f"chunk {i} " + "x" * (args.chunk_chars - 12) for i in range(args.chunks)]
+    with FakeMistralServer(
+        dim=1024, latency=args.latency, rate_limit=args.rate_limit
+    ) as server:
+        for concurrency in args.concurrency:
+            embeddings = BatchedEmbeddings(
+                base_url=server.url, api_key="fake", max_concurrency=concurrency
+            )
+            rate_limited = server.rate_limited
+            embeddings.embed_documents(texts)
+            print(
+                json.dumps(
+                    {
+                        "concurrency": concurrency,
+                        **embeddings.last_run,
+                        "rate_limited": server.rate_limited - rate_limited,
+                    }
+                )
+            )
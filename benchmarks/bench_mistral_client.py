@@ -0,0 +1,102 @@
+"""
+Latency of the chat helpers with a new connection per call (``requests.post``,
+as ``classify_question.py`` and ``suggestions.py`` used to do) against the
+pooled ``MistralClient``, on the fake Mistral server. The server delays every
+new connection by ``--connect-latency``, standing for the TCP and TLS
+handshakes with the real API.
+
+    python benchmarks/bench_mistral_client.py --calls 50 --connect-latency 0.03
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_mistral_server import FakeMistralServer  # noqa: E402
+from mistral_client import MistralClient  # noqa: E402
+
+
+def measure(server, name, run, prompts):
+    """
+    Runs ``run(prompts)``, which returns the latency of every call or
+    ``None`` when calls overlap, and reports it with the connections opened.
+    """
+    connections = server.connections
+    start = time.perf_counter()
+    latencies = run(prompts)
+    return {
+        "client": name,
+        "calls": len(prompts),
+        "connections": server.connections - connections,
+        "seconds": time.perf_counter() - start,
+        "mean_latency_s": statistics.mean(latencies) if latencies else None,
+    }
+
+
+def one_by_one(call):
+    def run(prompts):
+        latencies = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            call(prompt)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per call")
+    parser.add_argument("--connect-latency", type=float, default=0.03)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    prompts = [f"Is question {i} simple or complex?" for i in range(args.calls)]
+    with FakeMistralServer(
+        latency=args.latency, connect_latency=args.connect_latency, reply_words=1
+    ) as server:
+        url = f"{server.url}/chat/completions"
+        headers = {"Authorization": "Bearer fake"}
+
+        def post(prompt):
+            payload = {
+                "model": "mistral-small-latest",
+                "messages": [{"role": "user", "content": prompt}],
+            }
+            return requests.post(url, headers=headers, json=payload).json()
+
+        client = MistralClient(api_key="fake", base_url=server.url)
+
+        def chat_many(prompts):
+            client.chat_many(prompts, max_concurrency=args.concurrency)
+
+        def achat_many(prompts):
+            async def run():
+                try:
+                    await client.achat_many(prompts, max_concurrency=args.concurrency)
+                finally:
+                    await client.aclose()
+
+            # includes creating the async client of the event loop
+            asyncio.run(run())
+
+        runs = {
+            "requests.post": one_by_one(post),
+            "MistralClient.chat": one_by_one(client.chat),
+            "MistralClient.chat_many": chat_many,
+            "MistralClient.achat_many": achat_many,
+        }
+        for name, run in runs.items():
+            print(json.dumps(measure(server, name, run, prompts)))
+        client.close()
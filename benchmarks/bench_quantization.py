@@ -0,0 +1,70 @@
+"""
+Memory footprint, latency and recall of the quantized search backends against
+exact float32 search, on the synthetic corpora of ``bench_ann.py``.
+
+    python benchmarks/bench_quantization.py --sizes 10000 50000 --rescore 4 8 32
+
+``resident_mb`` is what a worker keeps in memory: the float32 matrix for exact
+search, only the codes for the quantized backends, whose rescoring reads a few
+rows of the memory-mapped ``embeddings.npy``.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ann_index import BinarySearch, ExactSearch, Int8Search  # noqa: E402
+from bench_ann import queries_for, run, synthetic_corpus  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--dim", type=int, default=1024, help="mistral-embed size")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[4, 8, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            vectors = synthetic_corpus(n, args.dim, n_topics=max(10, n // 500), rng=rng)
+            queries = queries_for(vectors, args.queries, rng)
+            exact, latency = run(ExactSearch().fit(vectors), vectors, queries, args.k)
+            row = {"n": n, "backend": "exact", "resident_mb": vectors.nbytes / 2**20}
+            print(json.dumps({**row, f"recall@{args.k}": 1.0, **latency}))
+
+            # rescoring reads from disk, as in a loaded index
+            path = os.path.join(tmp, f"embeddings-{n}.npy")
+            np.save(path, vectors)
+            mapped = np.load(path, mmap_mode="r")
+            for backend_class in (Int8Search, BinarySearch):
+                start = time.perf_counter()
+                backend = backend_class().fit(mapped)
+                build_s = time.perf_counter() - start
+                for rescore in args.rescore:
+                    backend.rescore = rescore
+                    found, latency = run(backend, mapped, queries, args.k)
+                    recall = np.mean(
+                        [len(a & b) / args.k for a, b in zip(found, exact)]
+                    )
+                    row = {
+                        "n": n,
+                        "backend": backend.name,
+                        "rescore": rescore,
+                        "resident_mb": backend.nbytes / 2**20,
+                        "build_s": build_s,
+                        f"recall@{args.k}": float(recall),
+                        **latency,
+                    }
+                    print(json.dumps(row))
+            del mapped
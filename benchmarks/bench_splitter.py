@@ -0,0 +1,106 @@
+"""
+Time to chunk a corpus with ``TokenOffsetSplitter`` against LangChain's
+``RecursiveCharacterTextSplitter.from_tiktoken_encoder``, and check that both
+give the same chunks.
+
+    python benchmarks/bench_splitter.py --corpus rag_dataset_doctor.json
+
+When the tiktoken encoding cannot be downloaded, a GPT-2 style encoding built
+from the words of the corpus is used instead (``--encoding words``).
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from corpus_io import iter_corpus_documents  # noqa: E402
+from token_splitter import TokenOffsetSplitter  # noqa: E402
+
+
+GPT2_PATTERN = (
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+)
+
+
+def word_encoding(texts, n_words=20000):
+    """
+    Bytes plus the prefixes of the ``n_words`` most frequent words, which
+    gives about as many tokens per character as GPT-2 on English text.
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    words = Counter(word for text in texts for word in re.findall(r" ?[A-Za-z]+", text))
+    for word, _ in words.most_common(n_words):
+        word = word.encode()
+        for end in range(2, len(word) + 1):
+            ranks.setdefault(word[:end], len(ranks))
+    return tiktoken.Encoding(
+        name="words", pat_str=GPT2_PATTERN, mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--corpus", default="rag_dataset_doctor.json")
+    parser.add_argument("--encoding", default="gpt2", help="tiktoken name or 'words'")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    documents = list(iter_corpus_documents(args.corpus))
+    encoding = None
+    if args.encoding != "words":
+        try:
+            encoding = tiktoken.get_encoding(args.encoding)
+        except Exception as e:
+            print(f"could not load {args.encoding} ({type(e).__name__}), using 'words'")
+    if encoding is None:
+        encoding = word_encoding([document.page_content for document in documents])
+
+    reference = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        length_function=lambda text: len(
+            encoding.encode(text, disallowed_special="all")
+        ),
+    )
+    expected, reference_s = timed(reference.split_documents, documents)
+    n_chars = sum(len(document.page_content) for document in documents)
+    report = {
+        "documents": len(documents),
+        "chars": n_chars,
+        "chunks": len(expected),
+        "langchain_s": reference_s,
+    }
+    for workers in args.workers:
+        splitter = TokenOffsetSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            encoding_name=None,
+            encoding=encoding,
+            workers=workers,
+            min_parallel_chars=0,
+        )
+        chunks, seconds = timed(splitter.split_documents, documents)
+        report[f"token_offsets_{workers}_workers_s"] = seconds
+        report[f"speedup_{workers}_workers"] = reference_s / seconds
+        report[f"same_chunks_{workers}_workers"] = [c.page_content for c in chunks] == [
+            c.page_content for c in expected
+        ]
+    print(json.dumps(report, indent=2))
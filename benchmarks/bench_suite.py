@@ -0,0 +1,405 @@
+"""
+End-to-end benchmarks of the project without API keys, the chat and embedding
+calls going to the fake Mistral server.
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --output new.json --compare results.json
+
+It measures
+
+    - ingestion: pages/s of ``utils.pdf2dataset``, of the ``iter_cleaned_pages``
+      pipeline and of ``clean_text`` alone, on PDFs generated from the text of
+      ``--corpus`` (no download needed),
+    - startup: ``setup_rag_db``, the whole chatbot start and the build of every
+      shard with an empty index directory (every chunk embedded), then again
+      with the index on disk,
+    - retrieval: latency of ``retrieve`` in every ``--modes`` against corpora
+      of ``--scales`` times ``--corpus`` (copies with shuffled sentences),
+    - turns: latency of ``run_once`` and of each of its stages.
+
+The results are written as JSON with the commit they were measured on;
+``--compare`` prints the metrics that moved by more than ``--threshold``
+against a previous results file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from pypdf import PdfReader
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from corpus_io import iter_corpus_records  # noqa: E402
+from fake_mistral_server import FakeMistralServer  # noqa: E402
+from load_test import offline_encoding, OfflineChatbot, percentiles  # noqa: E402
+from utils import clean_text, iter_cleaned_pages, pdf2dataset  # noqa: E402
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def write_pdf(path, pages, line_chars=90):
+    """
+    Writes a minimal PDF with one page of Helvetica text per item of
+    ``pages``, wrapped at ``line_chars`` characters.
+    """
+    # catalog, page tree (once the pages are known) and font, then the
+    # content stream and the page object of every page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        text = text.encode("ascii", "replace").decode()
+        lines = [text[i : i + line_chars] for i in range(0, len(text), line_chars)]
+        stream = ["BT /F1 9 Tf 11 TL 40 800 Td"]
+        for line in lines[:70]:
+            line = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream.append(f"({line}) Tj T*")
+        stream.append("ET")
+        stream = "\n".join(stream).encode()
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{kid} 0 R" for kid in kids).encode(),
+        len(kids),
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def corpus_texts(corpus):
+    return [record["text"] for record in iter_corpus_records(corpus)]
+
+
+def bench_ingestion(corpus, tmp, n_pdfs, page_chars):
+    text = " ".join(corpus_texts(corpus))
+    pages = [text[i : i + page_chars] for i in range(0, len(text), page_chars)]
+    pdfs = []
+    for i in range(n_pdfs):
+        path = os.path.join(tmp, f"guideline-{i}.pdf")
+        write_pdf(path, pages[i::n_pdfs])
+        pdfs.append(path)
+    n_pages = len(pages)
+
+    start = time.perf_counter()
+    for pdf in pdfs:
+        pdf2dataset(pdf, progress=lambda *args, **kwargs: None)
+    pdf2dataset_s = time.perf_counter() - start
+
+    results = {
+        "pdfs": n_pdfs,
+        "pages": n_pages,
+        "pdf2dataset_pages_per_s": n_pages / pdf2dataset_s,
+    }
+    for workers in sorted({1, os.cpu_count() or 1}):
+        start = time.perf_counter()
+        for _ in iter_cleaned_pages(pdfs, workers=workers):
+            pass
+        results[f"cleaned_pages_{workers}_workers_pages_per_s"] = n_pages / (
+            time.perf_counter() - start
+        )
+
+    raw_pages = []
+    for pdf in pdfs:
+        raw_pages.extend(page.extract_text() for page in PdfReader(pdf).pages)
+    start = time.perf_counter()
+    for page in raw_pages:
+        clean_text(page)
+    results["clean_text_pages_per_s"] = len(raw_pages) / (time.perf_counter() - start)
+    return results
+
+
+class TimedChatbot(OfflineChatbot):
+    """
+    Chatbot keeping the wall time of its last ``setup_rag_db``.
+    """
+
+    def setup_rag_db(self):
+        start = time.perf_counter()
+        super().setup_rag_db()
+        self.setup_seconds = time.perf_counter() - start
+
+
+def make_chatbot(patient_corpus, doctor_corpus, index_dir, **kwargs):
+    start = time.perf_counter()
+    chatbot = TimedChatbot(
+        db_patient_path=patient_corpus,
+        db_doctor_path=doctor_corpus,
+        ehr_path=os.path.join(ROOT, "ehr_context.txt"),
+        index_dir=index_dir,
+        router_path=os.path.join(ROOT, "router_questions.jsonl"),
+        response_cache_size=0,
+        **kwargs,
+    )
+    chatbot.count_tokens = lambda text: len(OfflineChatbot.encoding.encode(text))
+    return chatbot, time.perf_counter() - start
+
+
+def load_shards(chatbot):
+    """
+    Builds or loads every shard of the chatbot, which is otherwise done on
+    the first question that needs it. Returns the number of chunks.
+    """
+    index = chatbot.index
+    return sum(
+        len(index.shard(audience, topic))
+        for audience in index.corpora
+        for topic in index.topics(audience)
+    )
+
+
+def bench_startup(patient_corpus, doctor_corpus, tmp):
+    index_dir = os.path.join(tmp, "startup_index")
+    results = {}
+    # the index directory is empty, then holds the index built by the first run
+    for run in ("cold", "warm"):
+        chatbot, startup_s = make_chatbot(patient_corpus, doctor_corpus, index_dir)
+        start = time.perf_counter()
+        chunks = load_shards(chatbot)
+        results[run] = {
+            "setup_rag_db_s": chatbot.setup_seconds,
+            "startup_s": startup_s,
+            "load_shards_s": time.perf_counter() - start,
+            "chunks": chunks,
+        }
+    return results
+
+
+def scaled_corpus(corpus, copies, path):
+    """
+    Writes ``copies`` copies of ``corpus`` with their sentences shuffled, so
+    that their chunks and embeddings differ.
+    """
+    data = {}
+    for record in iter_corpus_records(corpus):
+        directory, name = os.path.split(record["source"])
+        sentences = re.split(r"(?<=\.) ", record["text"])
+        for i in range(copies):
+            # the shard of a document comes from the name of its source
+            url = os.path.join(directory, f"copy{i}-{name}")
+            data[url] = {"url": url, "text": " ".join(sentences)}
+            random.Random(i).shuffle(sentences)
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def bench_retrieval(corpus, tmp, scales, modes, questions, repeat):
+    results = []
+    for copies in scales:
+        path = scaled_corpus(corpus, copies, os.path.join(tmp, f"corpus-{copies}.json"))
+        chatbot, _ = make_chatbot(path, path, os.path.join(tmp, f"index-{copies}"))
+        start = time.perf_counter()
+        chunks = load_shards(chatbot)
+        build_s = time.perf_counter() - start
+        for mode in modes:
+            chatbot.retrieval_mode = mode
+            latencies = []
+            for _ in range(repeat):
+                for question in questions:
+                    start = time.perf_counter()
+                    chatbot.retrieve(question)
+                    latencies.append(time.perf_counter() - start)
+            results.append(
+                {
+                    "copies": copies,
+                    "chunks": chunks,
+                    "mode": mode,
+                    "index_build_s": build_s,
+                    "latency_ms": {
+                        key: value * 1e3
+                        for key, value in percentiles(latencies).items()
+                    },
+                }
+            )
+    return results
+
+
+def bench_turns(patient_corpus, doctor_corpus, tmp, questions, grading):
+    chatbot, _ = make_chatbot(
+        patient_corpus,
+        doctor_corpus,
+        os.path.join(tmp, "startup_index"),
+        grading=grading,
+    )
+    load_shards(chatbot)
+    latencies, first_tokens = [], []
+    for question in questions:
+        start = time.perf_counter()
+        chatbot.run_once(question)
+        latencies.append(time.perf_counter() - start)
+    for question in questions:
+        start = time.perf_counter()
+        first_token = None
+        for event in chatbot.stream_once(question):
+            if event.kind == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+        first_tokens.append(first_token)
+    return {
+        "turns": len(questions),
+        "run_once_s": percentiles(latencies),
+        "time_to_first_token_s": percentiles(first_tokens),
+        "stages": chatbot.instrumentation.summary()["stages"],
+    }
+
+
+def flatten(results, prefix=""):
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        # runs of the retrieval are named after their corpus size and mode
+        items = ((f"{run.get('copies')}x.{run.get('mode')}", run) for run in results)
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) else {}
+    flat = {}
+    for key, value in items:
+        flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """
+    Metrics that changed by more than ``threshold`` (relative) from
+    ``baseline``, as ``(name, before, after)``.
+    """
+    before = flatten(baseline["results"])
+    after = flatten(results["results"])
+    changes = []
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        if old and abs(new - old) / abs(old) > threshold:
+            changes.append((name, old, new))
+    return changes
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--corpus", default=os.path.join(ROOT, "rag_dataset_patient.json")
+    )
+    parser.add_argument(
+        "--doctor-corpus", default=os.path.join(ROOT, "rag_dataset_doctor.json")
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        default=["ingestion", "startup", "retrieval", "turns"],
+    )
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--page-chars", type=int, default=3000)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--modes", nargs="+", default=["vector", "bm25", "hybrid"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--grading", default="off")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per call")
+    parser.add_argument("--word-latency", type=float, default=0.002)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests/s")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--encoding", default="gpt2", help="'gpt2' or 'words'")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--compare", default=None, help="previous JSON results")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "router_questions.jsonl")) as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+    OfflineChatbot.encoding = offline_encoding(args.encoding, args.corpus)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, FakeMistralServer(
+        dim=args.dim,
+        latency=args.latency,
+        word_latency=args.word_latency,
+        rate_limit=args.rate_limit,
+    ) as fake:
+        os.environ["MISTRAL_BASE_URL"] = fake.url
+        os.environ["MISTRAL_API_KEY"] = "fake"
+        for name in args.benchmarks:
+            start = time.perf_counter()
+            if name == "ingestion":
+                results[name] = bench_ingestion(
+                    args.corpus, tmp, args.pdfs, args.page_chars
+                )
+            elif name == "startup":
+                results[name] = bench_startup(args.corpus, args.doctor_corpus, tmp)
+            elif name == "retrieval":
+                results[name] = bench_retrieval(
+                    args.corpus, tmp, args.scales, args.modes, questions, args.repeat
+                )
+            elif name == "turns":
+                results[name] = bench_turns(
+                    args.corpus,
+                    args.doctor_corpus,
+                    tmp,
+                    questions[: args.turns],
+                    args.grading,
+                )
+            else:
+                parser.error(f"unknown benchmark {name!r}")
+            print(f"{name} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    report = {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for name, before, after in compare(report, baseline, args.threshold):
+            print(f"{name}: {before:.4g} -> {after:.4g} ({after / before - 1:+.0%})")
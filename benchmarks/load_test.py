@@ -0,0 +1,181 @@
+"""
+Load test of ``ChatServer``: simulated patients chatting at once with the
+chatbot, whose LLM and embedding calls go to the fake Mistral server.
+
+    python benchmarks/load_test.py --patients 50 --turns 3 --concurrency 8 16
+
+Every patient has their own EHR and session and asks a few questions of
+``router_questions.jsonl`` in a row. The report has the throughput, the
+p50/p95/p99 latency of a turn and of its first token, and the rejected turns,
+then the latency and tokens of every stage of the pipeline.
+When the tiktoken encoding cannot be downloaded, chunks and contexts are
+measured with the word encoding of ``bench_splitter``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tiktoken
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_splitter import word_encoding  # noqa: E402
+from corpus_io import iter_corpus_documents  # noqa: E402
+from fake_mistral_server import FakeMistralServer  # noqa: E402
+from llm_chatbot import MistralChatbot  # noqa: E402
+from serving import ChatServer, Overloaded  # noqa: E402
+from token_splitter import TokenOffsetSplitter  # noqa: E402
+
+
+class OfflineChatbot(MistralChatbot):
+    """
+    Chatbot measuring tokens with ``encoding`` instead of GPT-2.
+    """
+
+    encoding = None
+
+    def split_documents(self, documents):
+        if self.text_splitter is None and self.encoding is not None:
+            self.text_splitter = TokenOffsetSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                encoding_name=None,
+                encoding=self.encoding,
+                add_start_index=True,
+            )
+        return super().split_documents(documents)
+
+
+def offline_encoding(name, corpus):
+    """
+    The tiktoken encoding ``name``, or the word encoding of ``corpus`` when
+    it is ``"words"`` or cannot be downloaded.
+    """
+    if name != "words":
+        try:
+            return tiktoken.get_encoding(name)
+        except Exception as e:
+            print(f"could not load {name} ({type(e).__name__}), using 'words'")
+    return word_encoding(
+        [document.page_content for document in iter_corpus_documents(corpus)]
+    )
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    return {f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)}
+
+
+async def patient(server, i, questions, turns, think_time, results):
+    for turn in range(turns):
+        question = questions[(i + turn) % len(questions)]
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async for event in server.astream(f"session-{i}", question, f"patient-{i}"):
+                if event.kind == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+        except Overloaded:
+            results["rejected"] += 1
+            continue
+        results["latency"].append(time.perf_counter() - start)
+        results["time_to_first_token"].append(first_token)
+        await asyncio.sleep(think_time)
+
+
+async def run(chatbot, args, concurrency, questions):
+    server = ChatServer(chatbot, max_concurrency=concurrency, max_queue=args.queue)
+    results = {"latency": [], "time_to_first_token": [], "rejected": 0}
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            patient(server, i, questions, args.turns, args.think_time, results)
+            for i in range(args.patients)
+        )
+    )
+    seconds = time.perf_counter() - start
+    return {
+        "patients": args.patients,
+        "concurrency": concurrency,
+        "max_queue": args.queue,
+        "turns": len(results["latency"]),
+        "rejected": results["rejected"],
+        "seconds": seconds,
+        "turns_per_s": len(results["latency"]) / seconds,
+        "latency_s": percentiles(results["latency"]),
+        "time_to_first_token_s": percentiles(results["time_to_first_token"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queue", type=int, default=1000)
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per call")
+    parser.add_argument("--word-latency", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests/s")
+    parser.add_argument("--grading", default="off")
+    parser.add_argument("--encoding", default="gpt2", help="'gpt2' or 'words'")
+    args = parser.parse_args()
+
+    root = os.path.join(os.path.dirname(__file__), "..")
+    with open(os.path.join(root, "router_questions.jsonl")) as f:
+        questions = [json.loads(line)["question"] for line in f if line.strip()]
+    with open(os.path.join(root, "ehr_context.txt")) as f:
+        ehr = f.read()
+
+    encoding = offline_encoding(
+        args.encoding, os.path.join(root, "rag_dataset_patient.json")
+    )
+    OfflineChatbot.encoding = encoding
+
+    with tempfile.TemporaryDirectory() as tmp, FakeMistralServer(
+        latency=args.latency, word_latency=args.word_latency, rate_limit=args.rate_limit
+    ) as fake:
+        os.environ["MISTRAL_BASE_URL"] = fake.url
+        os.environ["MISTRAL_API_KEY"] = "fake"
+        ehr_dir = os.path.join(tmp, "ehr")
+        os.makedirs(ehr_dir)
+        for i in range(args.patients):
+            with open(os.path.join(ehr_dir, f"patient-{i}.txt"), "w") as f:
+                f.write(f"Patient ID: patient-{i}\n{ehr}")
+
+        start = time.perf_counter()
+        chatbot = OfflineChatbot(
+            db_patient_path=os.path.join(root, "rag_dataset_patient.json"),
+            db_doctor_path=os.path.join(root, "rag_dataset_doctor.json"),
+            ehr_path=None,
+            ehr_dir=ehr_dir,
+            index_dir=os.path.join(tmp, "rag_index"),
+            router_path=os.path.join(root, "router_questions.jsonl"),
+            response_cache_size=0,
+            grading=args.grading,
+        )
+        chatbot.count_tokens = lambda text: len(encoding.encode(text))
+        # loads the shards every question needs before timing
+        for question in questions:
+            chatbot.retrieve(question, patient_id="patient-0")
+        print(json.dumps({"startup_s": time.perf_counter() - start}))
+
+        async def run_all():
+            # one event loop for all runs, the LLM client keeps its connections
+            for concurrency in args.concurrency:
+                completions = fake.completions
+                report = await run(chatbot, args, concurrency, questions)
+                report["llm_requests"] = fake.completions - completions
+                print(json.dumps(report))
+
+        asyncio.run(run_all())
+        # where the time of the turns went, over all runs
+        print(json.dumps({"stages": chatbot.instrumentation.summary()["stages"]}))
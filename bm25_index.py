@@ -0,0 +1,120 @@
+"""
+In-process BM25 inverted index over the chunks of a ``NumpyVectorStore``.
+
+Lexical search needs no query embedding, and finds the chunks naming a drug
+or a procedure (Ondansetron, lumpectomy) better than dense search. The
+postings are stored as CSR-like arrays: the chunks containing the i-th term
+are ``doc_ids[offsets[i]:offsets[i + 1]]`` with their term frequencies in
+``tfs``.
+"""
+
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+
+_TOKEN = re.compile(r"\w\w+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = None
+        self.terms = {}
+        self.offsets = None
+        self.doc_ids = None
+        self.tfs = None
+        self.doc_lengths = None
+
+    def fit(self, texts):
+        postings = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc_id, count))
+
+        terms = sorted(postings)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        lengths = [len(postings[term]) for term in terms]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        pairs = [pair for term in terms for pair in postings[term]]
+        self.doc_ids = np.array([doc_id for doc_id, _ in pairs], dtype=np.int32)
+        self.tfs = np.array([count for _, count in pairs], dtype=np.float32)
+        self.doc_lengths = np.array(doc_lengths, dtype=np.float32)
+        self.n_docs = len(doc_lengths)
+        return self
+
+    def idf(self, df):
+        # Lucene's variant, never negative
+        return np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+
+    def term_idf(self, term):
+        """
+        Returns the idf of ``term``, 0 if no chunk contains it.
+        """
+        i = self.terms.get(term)
+        if i is None:
+            return 0.0
+        return float(self.idf(self.offsets[i + 1] - self.offsets[i]))
+
+    def search(self, query, k):
+        """
+        Returns the indices of the ``k`` best chunks and their BM25 scores,
+        leaving out chunks sharing no term with the query.
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        if not self.n_docs:
+            return np.zeros(0, dtype=np.int64), scores
+        norms = self.k1 * (
+            1 - self.b + self.b * self.doc_lengths / self.doc_lengths.mean()
+        )
+        for term in set(tokenize(query)):
+            i = self.terms.get(term)
+            if i is None:
+                continue
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            doc_ids, tfs = self.doc_ids[start:stop], self.tfs[start:stop]
+            scores[doc_ids] += (
+                self.idf(stop - start) * tfs * (self.k1 + 1) / (tfs + norms[doc_ids])
+            )
+        matched = np.flatnonzero(scores)
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return top, scores[top]
+
+    def save(self, path):
+        np.savez(
+            os.path.join(path, "bm25.npz"),
+            terms=np.array(list(self.terms), dtype=str),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths,
+            params=np.array([self.k1, self.b]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the index saved in ``path``, or ``None`` if there is none.
+        """
+        file = os.path.join(path, "bm25.npz")
+        if not os.path.exists(file):
+            return None
+        with np.load(file) as data:
+            index = cls(*data["params"].tolist())
+            index.terms = {term: i for i, term in enumerate(data["terms"].tolist())}
+            index.offsets = data["offsets"]
+            index.doc_ids = data["doc_ids"]
+            index.tfs = data["tfs"]
+            index.doc_lengths = data["doc_lengths"]
+        index.n_docs = len(index.doc_lengths)
+        return index
@@ -1,16 +1,12 @@
-import os
-import requests
-from dotenv import load_dotenv
+import asyncio
 
-# Load environment variables from .env file
-#load_dotenv()
+from event_loop import run_sync
+from mistral_client import default_client, MistralAPIError
 
-# Retrieve the API key from environment variables
-API_KEY = "your api key"
-API_URL = "https://api.mistral.ai/v1/chat/completions"
 
-if not API_KEY:
-    raise ValueError("API key not found. Please set it in the .env file.")
+# The API key is read from the MISTRAL_API_KEY environment variable by the
+# shared client, which keeps its connections alive between calls
+
 
 # Function to build the prompt for classification based on question and EHR
 def generate_classification_prompt(question, ehr_context):
@@ -32,6 +28,21 @@ def generate_classification_prompt(question, ehr_context):
     """
     return prompt
 
+
+CLASSIFICATION_PARAMS = {
+    "model": "mistral-small-latest",
+    "max_tokens": 10,
+    "temperature": 0.2,  # Lower temperature for deterministic output
+}
+
+
+def parse_classification(result):
+    result = result.strip()
+    if result in ["0", "1"]:
+        return int(result)
+    return f"Unexpected response: {result}"
+
+
 # Function to classify the patient's question using the EHR context
 def classify_patient_question_with_ehr(question, ehr_context):
     """
@@ -39,29 +50,43 @@ def classify_patient_question_with_ehr(question, ehr_context):
     based on both the question and the EHR context.
     """
     prompt = generate_classification_prompt(question, ehr_context)
-    
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "model": "mistral-small-latest",
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 10,
-        "temperature": 0.2  # Lower temperature for deterministic output
-    }
-    
-    response = requests.post(API_URL, headers=headers, json=data)
-    
-    if response.status_code == 200:
-        result = response.json()['choices'][0]['message']['content'].strip()
-        if result in ['0', '1']:
-            return int(result)
-        else:
-            return f"Unexpected response: {result}"
-    else:
-        return f"Error: {response.status_code}, {response.text}"
+    try:
+        result = default_client().chat(prompt, **CLASSIFICATION_PARAMS)
+    except MistralAPIError as e:
+        return f"Error: {e.status_code}, {e.body}"
+    return parse_classification(result)
+
+
+async def aclassify_patient_question_with_ehr(question, ehr_context):
+    """
+    Async version of ``classify_patient_question_with_ehr``.
+    """
+    prompt = generate_classification_prompt(question, ehr_context)
+    try:
+        result = await default_client().achat(prompt, **CLASSIFICATION_PARAMS)
+    except MistralAPIError as e:
+        return f"Error: {e.status_code}, {e.body}"
+    return parse_classification(result)
+
+
+def classify_patient_questions_with_ehr(questions, ehr_context, max_concurrency=8):
+    """
+    Classifies several questions about the same EHR, ``max_concurrency`` at a
+    time over the shared connections.
+    """
+
+    async def classify_all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def classify(question):
+            async with semaphore:
+                return await aclassify_patient_question_with_ehr(question, ehr_context)
+
+        return await asyncio.gather(*(classify(question) for question in questions))
+
+    # the shared client keeps its pool open on the shared event loop
+    return run_sync(classify_all())
+
 
 # Function to load EHR context from a text file
 def load_ehr_context_from_file(file_path):
@@ -69,24 +94,25 @@ def load_ehr_context_from_file(file_path):
     Loads the EHR context from a .txt file.
     """
     try:
-        with open(file_path, 'r') as file:
+        with open(file_path, "r") as file:
             ehr_context = file.read()
         return ehr_context
     except FileNotFoundError:
         return "EHR context file not found."
 
+
 # Example usage
 if __name__ == "__main__":
     # Load the EHR context from a .txt file
     ehr_file_path = "ehr_context.txt"  # Update with your actual file path
     ehr_context = load_ehr_context_from_file(ehr_file_path)
-    
+
     # Example patient question
     patient_question = "why do i have diarrhea, is it related to my treatment?"
 
     # Classify the question
     classification = classify_patient_question_with_ehr(patient_question, ehr_context)
-    
+
     if classification == 0:
         print("The question is classified as Simple (0).")
     elif classification == 1:
@@ -0,0 +1,206 @@
+"""
+Assembly of the retrieved chunks into the context of the RAG prompt.
+
+Chunks are split with an overlap, so neighbouring retrieved chunks repeat
+text, and guidelines shared by several datasets are retrieved twice. The
+packer
+
+    - merges the chunks of a source that overlap or touch, found from their
+      ``start_index`` metadata, back into contiguous spans,
+    - drops spans that are near-duplicates of a more relevant one,
+    - adds the spans in relevance order until the token budget is spent; a
+      span that does not fit is replaced by as many of its best chunks as
+      fit, and the most relevant chunk is always kept, cut to the budget if
+      need be.
+"""
+
+import re
+
+
+# chunks further apart than this many characters are not merged
+ADJACENT_GAP = 2
+
+_WORD = re.compile(r"\w+")
+
+
+def tiktoken_counter(encoding_name="gpt2"):
+    """
+    Returns a function counting the tokens of a text with a tiktoken encoding,
+    by default the one ``from_tiktoken_encoder`` splitters measure chunks
+    with. The encoding is loaded on first use.
+    """
+    encoding = None
+
+    def count_tokens(text):
+        nonlocal encoding
+        if encoding is None:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(encoding_name)
+        return len(encoding.encode(text))
+
+    return count_tokens
+
+
+def truncate_tokens(text, max_tokens, count_tokens):
+    """
+    The longest prefix of ``text``, in whole words, of at most ``max_tokens``.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+
+def merge_chunks(docs):
+    """
+    Returns the spans of ``docs``, in relevance order, as ``{"rank", "source",
+    "text", "docs"}`` dicts, where the rank of a span is the one of its best
+    chunk and ``docs`` are its chunks in relevance order. Chunks without a
+    ``start_index`` are spans of their own.
+    """
+    spans, by_source = [], {}
+    for rank, doc in enumerate(docs):
+        source = doc.metadata.get("source")
+        start = doc.metadata.get("start_index")
+        # LangChain splitters record -1 when they lose track of the offset
+        if start is None or start < 0:
+            spans.append(
+                {
+                    "rank": rank,
+                    "source": source,
+                    "text": doc.page_content,
+                    "docs": [doc],
+                }
+            )
+        else:
+            by_source.setdefault(source, []).append((start, rank, doc))
+
+    for source, chunks in by_source.items():
+        span = None
+        for start, rank, doc in sorted(chunks, key=lambda chunk: chunk[:2]):
+            text = doc.page_content
+            end = start + len(text)
+            if span is not None and start <= span["end"] + ADJACENT_GAP:
+                if end > span["end"]:
+                    overlap = span["end"] - start
+                    span["text"] += text[overlap:] if overlap >= 0 else " " + text
+                    span["end"] = end
+                span["rank"] = min(span["rank"], rank)
+                span["ranked"].append((rank, doc))
+            else:
+                span = {
+                    "rank": rank,
+                    "source": source,
+                    "text": text,
+                    "end": end,
+                    "ranked": [(rank, doc)],
+                }
+                spans.append(span)
+
+    spans.sort(key=lambda span: span["rank"])
+    for span in spans:
+        span.pop("end", None)
+        if "ranked" in span:
+            ranked = sorted(span.pop("ranked"), key=lambda chunk: chunk[0])
+            span["docs"] = [doc for _, doc in ranked]
+    return spans
+
+
+def _shingles(text, size=3):
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def drop_near_duplicates(spans, threshold=0.8):
+    """
+    Drops the spans of which at least ``threshold`` of the word 3-grams are in
+    a more relevant kept span, e.g. a chunk of the same guideline from another
+    dataset. Returns the kept spans and the number of dropped ones.
+    """
+    kept, kept_shingles = [], []
+    for span in spans:
+        shingles = _shingles(span["text"])
+        if any(
+            len(shingles & other) >= threshold * len(shingles)
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(span)
+        kept_shingles.append(shingles)
+    return kept, len(spans) - len(kept)
+
+
+def fit_chunks(docs, count_tokens, budget, separator="\n\n"):
+    """
+    Returns the texts of the best of ``docs`` (in relevance order), merged
+    back into spans, that fit in ``budget`` tokens together, and their tokens.
+    """
+    chosen, texts, used = [], [], 0
+    for doc in docs:
+        candidate = [span["text"] for span in merge_chunks(chosen + [doc])]
+        tokens = count_tokens(separator.join(candidate))
+        if tokens <= budget:
+            chosen.append(doc)
+            texts, used = candidate, tokens
+    return texts, used
+
+
+def pack_context(docs, count_tokens, max_tokens=None, separator="\n\n"):
+    """
+    Returns the context built from the retrieved ``docs`` (in relevance
+    order) and a report of the tokens it saves compared to concatenating
+    every chunk. A span that does not fit in what is left of ``max_tokens``
+    is replaced by its best chunks that fit, or skipped when none does;
+    the most relevant chunk is cut to the budget rather than left out.
+    """
+    spans, duplicates = drop_near_duplicates(merge_chunks(docs))
+    separator_tokens = count_tokens(separator)
+    packed, used, over_budget, trimmed = [], 0, 0, 0
+    for span in spans:
+        # every span after the first also costs the separator before it
+        joint = separator_tokens if packed else 0
+        tokens = count_tokens(span["text"])
+        if max_tokens is None or used + joint + tokens <= max_tokens:
+            packed.append(span["text"])
+            used += joint + tokens
+            continue
+        best = span["docs"][0].page_content
+        if not packed and count_tokens(best) > max_tokens:
+            # the most relevant chunk alone is over the budget
+            texts = [truncate_tokens(best, max_tokens, count_tokens)]
+            tokens = count_tokens(texts[0])
+        else:
+            texts, tokens = fit_chunks(
+                span["docs"], count_tokens, max_tokens - used - joint, separator
+            )
+        if texts:
+            trimmed += 1
+            packed.extend(texts)
+            used += joint + tokens
+        else:
+            over_budget += 1
+
+    context = separator.join(packed)
+    tokens = count_tokens(context)
+    if max_tokens is not None and tokens > max_tokens:
+        # tokens can merge differently across the joins, cut what is left over
+        context = truncate_tokens(context, max_tokens, count_tokens)
+        tokens = count_tokens(context)
+    tokens_before = count_tokens(separator.join(doc.page_content for doc in docs))
+    return context, {
+        "chunks": len(docs),
+        "spans": len(packed),
+        "dropped_duplicates": duplicates,
+        "trimmed_over_budget": trimmed,
+        "dropped_over_budget": over_budget,
+        "context_tokens": tokens,
+        "context_tokens_saved": tokens_before - tokens,
+    }
@@ -0,0 +1,115 @@
+"""
+Bounded memory of a conversation, for the ``{history}`` of the prompts.
+
+The last ``max_turns`` turns are kept verbatim; older turns are folded into a
+running summary by a ``summarize(summary, turns)`` callable, which the chatbot
+runs in the background after the answer (see ``MistralChatbot.remember``).
+Whatever the length of the conversation, the history put in a prompt never
+exceeds ``max_tokens``: the summary first, then the most recent turns that
+still fit. Every stored turn and the summary are cut to that budget too, so
+a session holds at most about ``2 * max_turns + 1`` budgets of text.
+"""
+
+import threading
+from collections import deque
+
+from context_packer import truncate_tokens
+
+
+def format_turn(question, answer):
+    # as in conv_history.txt
+    return f"Patient: {question}\nAssistant: {answer}"
+
+
+class ConversationMemory:
+    def __init__(self, count_tokens, max_turns=4, max_tokens=800):
+        self.count_tokens = count_tokens
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary = ""
+        self.turns = deque()
+        # turns out of the window, waiting to be folded into the summary
+        self.pending = deque()
+        self.dropped = 0
+        self.summarizing = False
+        self._lock = threading.Lock()
+
+    def add(self, question, answer):
+        """
+        Adds a turn. Returns whether the caller has to start ``fold``: turns
+        left the window and no summarization is running yet.
+        """
+        turn = truncate_tokens(
+            format_turn(question, answer), self.max_tokens, self.count_tokens
+        )
+        with self._lock:
+            self.turns.append(turn)
+            while len(self.turns) > self.max_turns:
+                self.pending.append(self.turns.popleft())
+            # when the summarizer falls behind, the oldest turns are lost
+            while len(self.pending) > self.max_turns:
+                self.pending.popleft()
+                self.dropped += 1
+            if self.pending and not self.summarizing:
+                self.summarizing = True
+                return True
+            return False
+
+    def fold(self, summarize):
+        """
+        Folds the pending turns into the summary with ``summarize(summary,
+        turns)``, until none is left. Turns that fail to be summarized are
+        dropped.
+        """
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self.summarizing = False
+                    return self.summary
+                turns = list(self.pending)
+                self.pending.clear()
+                summary = self.summary
+            try:
+                summary = summarize(summary, turns)
+            except Exception as e:
+                print("summarization failed:", repr(e))
+                with self._lock:
+                    self.dropped += len(turns)
+                continue
+            summary = truncate_tokens(summary, self.max_tokens // 2, self.count_tokens)
+            with self._lock:
+                self.summary = summary
+
+    def render(self):
+        """
+        The history for a prompt, within ``max_tokens``; empty before the
+        first turn.
+        """
+        with self._lock:
+            summary, turns = self.summary, list(self.turns)
+        if not summary and not turns:
+            return ""
+        header = "Conversation so far:"
+        # every part also costs the line break before it
+        budget = self.max_tokens - self.count_tokens(header)
+        if summary:
+            summary = f"Summary of the earlier conversation: {summary}"
+            summary = truncate_tokens(summary, budget - 1, self.count_tokens)
+            budget -= self.count_tokens(summary) + 1
+        recent = []
+        for turn in reversed(turns):
+            tokens = self.count_tokens(turn) + 1
+            if tokens > budget:
+                # the most recent turn is kept, cut, rather than left out
+                if not recent and budget > 1:
+                    recent.append(truncate_tokens(turn, budget - 1, self.count_tokens))
+                break
+            recent.append(turn)
+            budget -= tokens
+        parts = [header] + ([summary] if summary else []) + recent[::-1]
+        history = "\n".join(parts)
+        # in case the tokens of the parts do not add up to the whole
+        while self.count_tokens(history) > self.max_tokens and len(parts) > 2:
+            del parts[1]
+            history = "\n".join(parts)
+        return truncate_tokens(history, self.max_tokens, self.count_tokens)
@@ -0,0 +1,132 @@
+"""
+Line-delimited corpus format.
+
+A corpus is a JSONL file, optionally gzip (``.jsonl.gz``) or zstandard
+(``.jsonl.zst``) compressed, with one record per extracted page:
+
+    {"source": <pdf path or url>, "key": <pdf file name>, "page": <n>, "text": <text>}
+
+Records of a source are consecutive, so the corpus is written while pages are
+extracted and read back one document at a time. The text of a document is its
+pages joined with spaces, as in the legacy ``{key: {"url", "text"}}`` JSON
+datasets, which are still readable and can be converted with
+
+    python corpus_io.py rag_dataset_patient.json rag_dataset_patient.jsonl.gz
+"""
+
+import argparse
+import gzip
+import io
+import itertools
+import json
+
+from langchain_core.documents import Document
+
+
+JSONL_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+
+def is_jsonl_corpus(path):
+    return str(path).endswith(JSONL_SUFFIXES)
+
+
+def open_corpus(path, mode="r"):
+    """
+    Opens a corpus file in text mode, (de)compressing it based on its suffix.
+    """
+    path = str(path)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError(
+                "Reading or writing .zst corpora requires `pip install zstandard`"
+            ) from e
+        return io.TextIOWrapper(zstandard.open(path, mode + "b"), encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class CorpusWriter:
+    """
+    Appends page records to a JSONL corpus.
+
+        with CorpusWriter("corpus.jsonl.gz") as writer:
+            writer.write("pdf_data/bone.pdf", 0, "page text")
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open_corpus(self.path, "w")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def write(self, source, page, text, key=None):
+        record = {
+            "source": source,
+            "key": key or source.split("/")[-1],
+            "page": page,
+            "text": text,
+        }
+        self._file.write(json.dumps(record) + "\n")
+
+    def write_record(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+
+def iter_corpus_records(path):
+    """
+    Yields the page records of a JSONL corpus, or one record per document of a
+    legacy JSON dataset (which has to be loaded at once).
+    """
+    if not is_jsonl_corpus(path):
+        with open(path) as f:
+            data = json.load(f)
+        for key, item in data.items():
+            yield {"source": item["url"], "key": key, "page": 0, "text": item["text"]}
+        return
+
+    with open_corpus(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_corpus_documents(path):
+    """
+    Yields one ``Document`` per source of the corpus, with the same text and
+    metadata as the documents built from the legacy JSON datasets.
+    """
+    records = iter_corpus_records(path)
+    for source, pages in itertools.groupby(
+        records, key=lambda record: record["source"]
+    ):
+        text = " ".join(page["text"] for page in pages)
+        yield Document(page_content=text, metadata={"source": source})
+
+
+def convert_json_corpus(json_path, output_path):
+    """
+    Converts a legacy JSON dataset to the JSONL format.
+    """
+    with CorpusWriter(output_path) as writer:
+        for record in iter_corpus_records(json_path):
+            writer.write_record(record)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a JSON RAG dataset to the JSONL corpus format."
+    )
+    parser.add_argument("json_path")
+    parser.add_argument("output_path", help="ends with .jsonl, .jsonl.gz or .jsonl.zst")
+    args = parser.parse_args()
+    if not is_jsonl_corpus(args.output_path):
+        parser.error(f"output_path must end with one of {JSONL_SUFFIXES}")
+    convert_json_corpus(args.json_path, args.output_path)
@@ -0,0 +1,127 @@
+"""
+Electronic health records of the patients served by one chatbot process.
+
+Records are text files, found by patient ID in ``ehr_dir`` (``<id>.txt``) or in
+an explicit ``{patient_id: path}`` table, read on first use and kept in an LRU.
+A cached record is checked against the file's mtime and size on every access
+and re-read when they changed; if its content hash is unchanged the rendered
+prompts are kept.
+
+Every registered prompt template is split before its first per-turn field,
+``{history}`` or ``{question}``: the part before it, holding the EHR, is
+rendered once per patient, so a turn only appends the rest of the template to
+a prefix that stays byte-identical across turns, which provider-side prompt
+caching relies on.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Tuple
+
+
+DEFAULT_PATIENT = "default"
+
+_PATIENT_ID = re.compile(r"^[\w-]+$")
+
+# fields of the templates that change with every turn
+TURN_FIELDS = ("{history}", "{question}")
+
+
+class EHRRecord(NamedTuple):
+    patient_id: str
+    text: str
+    sha256: str
+    # (mtime_ns, size) of the file it was read from
+    stat: Tuple[int, int]
+    # template name -> rendered part of the template before the turn fields
+    prefixes: Dict[str, str]
+
+
+class EHRStore:
+    def __init__(self, ehr_dir=None, paths=None, templates=None, max_items=128):
+        self.ehr_dir = ehr_dir
+        self.paths = dict(paths or {})
+        self.max_items = max_items
+        self.loads = 0
+        self.hits = 0
+
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        # name -> (part with the {ehr} field, part with the turn fields)
+        self._templates = {}
+        for name, template in (templates or {}).items():
+            self.register(name, template)
+
+    @property
+    def stats(self):
+        return {"loads": self.loads, "hits": self.hits, "items": len(self._records)}
+
+    def register(self, name, template):
+        """
+        Registers a prompt template with ``{ehr}``, ``{question}`` and
+        optionally ``{history}`` fields, the EHR coming first.
+        """
+        split = min(template.index(field) for field in TURN_FIELDS if field in template)
+        self._templates[name] = (template[:split], template[split:])
+        with self._lock:
+            self._records.clear()
+
+    def path(self, patient_id):
+        if patient_id in self.paths:
+            return self.paths[patient_id]
+        if self.ehr_dir is None or not _PATIENT_ID.match(patient_id):
+            raise KeyError(f"No EHR for patient {patient_id!r}")
+        return os.path.join(self.ehr_dir, f"{patient_id}.txt")
+
+    def get(self, patient_id=None):
+        """
+        Returns the ``EHRRecord`` of the patient, reading the file only when
+        it is not cached or changed on disk.
+        """
+        patient_id = patient_id or DEFAULT_PATIENT
+        path = self.path(patient_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise KeyError(f"No EHR for patient {patient_id!r}") from None
+        stat = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            record = self._records.get(patient_id)
+            if record is not None and record.stat == stat:
+                self._records.move_to_end(patient_id)
+                self.hits += 1
+                return record
+
+        with open(path, "r") as f:
+            text = f.read()
+        sha256 = hashlib.sha256(text.encode()).hexdigest()
+        if record is not None and record.sha256 == sha256:
+            # touched but unchanged, the rendered prefixes still hold
+            record = record._replace(stat=stat)
+        else:
+            prefixes = {
+                name: head.format(ehr=text)
+                for name, (head, _) in self._templates.items()
+            }
+            record = EHRRecord(patient_id, text, sha256, stat, prefixes)
+
+        with self._lock:
+            self.loads += 1
+            self._records[patient_id] = record
+            self._records.move_to_end(patient_id)
+            while len(self._records) > self.max_items:
+                self._records.popitem(last=False)
+        return record
+
+    def render(self, name, question, patient_id=None, history=""):
+        """
+        Returns the template ``name`` formatted with the patient's EHR,
+        ``question`` and the conversation ``history``.
+        """
+        record = self.get(patient_id)
+        tail = self._templates[name][1]
+        return record.prefixes[name] + tail.format(question=question, history=history)
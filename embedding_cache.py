@@ -0,0 +1,264 @@
+"""
+Content-addressed cache in front of an embedding model.
+
+Vectors are keyed by ``sha256(model, text)`` and kept in two tiers:
+    - an in-process LRU of recently used vectors,
+    - an on-disk sqlite store bounded in bytes, evicting the least recently
+      used rows first.
+
+The same cache instance is shared by the index build and the retriever, so a
+corpus rebuild only embeds chunks it has not seen and a repeated question
+skips the embedding round-trip. Concurrent misses of the same query, e.g.
+from the router and the retriever of a turn, share one embedding call. In
+front of ``BatchedEmbeddings`` every completed batch is stored as soon as it
+arrives, which makes the cache the checkpoint of an interrupted build.
+"""
+
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps ``embeddings`` with a memory and an optional disk cache.
+
+    ``model`` namespaces the keys; it defaults to the ``model`` attribute of
+    the wrapped embeddings (e.g. ``MistralAIEmbeddings.model``).
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: Optional[str] = None,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        max_memory_items: int = 4096,
+        on_lookup=None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        # embeddings reporting their completed batches, e.g. BatchedEmbeddings
+        self._checkpoints = (
+            "on_batch" in inspect.signature(embeddings.embed_documents).parameters
+        )
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_items = max_memory_items
+        # called with "hit", "miss" or "coalesced" and the number of texts
+        # after every lookup
+        self.on_lookup = on_lookup
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._memory = OrderedDict()
+        # queries being embedded, by key, for callers that miss meanwhile
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(cache_dir, "embeddings.sqlite"), check_same_thread=False
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB, last_used REAL)"
+            )
+            self._disk_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()[0]
+
+    @property
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _looked_up(self, result, count=1):
+        if self.on_lookup is not None and count:
+            self.on_lookup(result, count)
+
+    def _lookup(self, keys):
+        """
+        Returns ``{key: vector}`` for the cached keys and updates the counters.
+        """
+        found = {}
+        on_disk = []
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                found[key] = vector
+                self.memory_hits += 1
+            else:
+                on_disk.append(key)
+
+        if self._db is not None and on_disk:
+            now = time.time()
+            # sqlite limits the number of bound parameters per statement
+            for start in range(0, len(on_disk), 500):
+                batch = on_disk[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                self._db.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows],
+                )
+            self._db.commit()
+
+        self.misses += sum(1 for key in on_disk if key not in found)
+        return found
+
+    def _store(self, items):
+        """
+        Caches ``(key, vector)`` pairs. Vectors are stored as float32 in both
+        tiers so a hit returns the same values whichever tier served it.
+        Returns the stored ``(key, vector)`` pairs.
+        """
+        arrays = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in items]
+        stored = [(key, array.tolist()) for key, array in arrays]
+        for key, vector in stored:
+            self._remember(key, vector)
+        if self._db is None or not items:
+            return stored
+
+        now = time.time()
+        rows = [(key, array.tobytes(), now) for key, array in arrays]
+        existing = set()
+        for start in range(0, len(rows), 500):
+            batch = [row[0] for row in rows[start : start + 500]]
+            placeholders = ",".join("?" * len(batch))
+            existing.update(
+                key
+                for (key,) in self._db.execute(
+                    f"SELECT key FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+            )
+        self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+        self._disk_bytes += sum(
+            len(blob) for key, blob, _ in rows if key not in existing
+        )
+        self._evict()
+        self._db.commit()
+        return stored
+
+    def _evict(self):
+        while self._disk_bytes > self.max_disk_bytes:
+            victims = self._db.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not victims:
+                self._disk_bytes = 0
+                return
+            freed = 0
+            evicted = []
+            for key, size in victims:
+                if self._disk_bytes - freed <= self.max_disk_bytes:
+                    break
+                evicted.append((key,))
+                freed += size
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self._disk_bytes -= freed
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.model, text) for text in texts]
+        unique = dict.fromkeys(keys)
+        with self._lock:
+            found = self._lookup(unique)
+        self._looked_up("hit", len(found))
+        self._looked_up("miss", len(unique) - len(found))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing and self._checkpoints:
+            missing_keys = list(missing)
+
+            def checkpoint(indices, vectors):
+                items = [
+                    (missing_keys[i], vector) for i, vector in zip(indices, vectors)
+                ]
+                with self._lock:
+                    found.update(self._store(items))
+
+            self.embeddings.embed_documents(list(missing.values()), on_batch=checkpoint)
+        elif missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            with self._lock:
+                found.update(self._store(list(zip(missing.keys(), vectors))))
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.model, text)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                # the same query is being embedded, wait for its vector
+                self.coalesced += 1
+                owner = False
+            else:
+                found = self._lookup([key])
+                owner = key not in found
+                if owner:
+                    future = self._pending[key] = Future()
+        if future is None:
+            self._looked_up("hit")
+            return found[key]
+        self._looked_up("miss" if owner else "coalesced")
+        if not owner:
+            return future.result()
+
+        try:
+            vector = self.embeddings.embed_query(text)
+            with self._lock:
+                vector = self._store([(key, vector)])[0][1]
+                del self._pending[key]
+        except BaseException as error:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(error)
+            raise
+        future.set_result(vector)
+        return vector
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,167 @@
+"""
+Batched, concurrent client of the Mistral embeddings endpoint for index builds.
+
+Texts are packed into batches bounded in tokens and in size, which are sent
+with at most ``max_concurrency`` requests in flight through a
+``MistralClient``, which retries rate limits (429) and server errors with
+exponential backoff and full jitter. Every completed batch is handed to ``on_batch`` as
+soon as it arrives, which ``CachedEmbeddings`` uses to checkpoint it, so an
+interrupted build only re-embeds the batches that had not completed.
+
+The endpoint defaults to ``$MISTRAL_BASE_URL`` or the public API, and can be
+pointed at ``fake_mistral_server.py``.
+"""
+
+import asyncio
+import time
+from typing import List, Optional
+
+from event_loop import run_sync
+from langchain_core.embeddings import Embeddings
+from mistral_client import MistralAPIError, MistralClient
+
+
+def approx_tokens(text):
+    """
+    Upper estimate of the number of tokens of ``text``, without a tokenizer.
+    """
+    return len(text) // 3 + 1
+
+
+def pack_batches(texts, count_tokens, max_tokens, max_size):
+    """
+    Returns lists of indices of ``texts``, in order, each with at most
+    ``max_size`` texts and ``max_tokens`` tokens (a longer text is alone).
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (len(batch) == max_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# raised when a batch fails for good
+EmbeddingRequestError = MistralAPIError
+
+
+class BatchedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        model: str = "mistral-embed",
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_batch_tokens: int = 16000,
+        max_batch_size: int = 128,
+        max_concurrency: int = 4,
+        max_retries: int = 8,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 60.0,
+        count_tokens=approx_tokens,
+    ) -> None:
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.count_tokens = count_tokens
+        self.chunks = 0
+        self.batches = 0
+        self.seconds = 0.0
+        # report of the last embed_documents call
+        self.last_run = {}
+
+        self.client = MistralClient(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            backoff=backoff,
+            max_backoff=max_backoff,
+            max_connections=max_concurrency,
+            max_batch_size=max_batch_size,
+        )
+
+    @property
+    def retries(self):
+        return self.client.retries
+
+    @property
+    def stats(self):
+        return {
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "retries": self.retries,
+            "chunks_per_s": self.chunks / self.seconds if self.seconds else None,
+        }
+
+    async def aembed_documents(
+        self, texts: List[str], on_batch=None
+    ) -> List[List[float]]:
+        """
+        Embeds ``texts`` batch by batch. ``on_batch(indices, vectors)`` is
+        called with the indices in ``texts`` and the vectors of every
+        completed batch.
+        """
+        start = time.perf_counter()
+        batches = pack_batches(
+            texts, self.count_tokens, self.max_batch_tokens, self.max_batch_size
+        )
+        vectors = [None] * len(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        retries = self.retries
+
+        async def embed(indices):
+            async with semaphore:
+                batch_vectors = await self.client.aembed(
+                    [texts[i] for i in indices], self.model
+                )
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+            if on_batch is not None:
+                on_batch(indices, batch_vectors)
+
+        tasks = [asyncio.ensure_future(embed(batch)) for batch in batches]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        seconds = time.perf_counter() - start
+        self.chunks += len(texts)
+        self.batches += len(batches)
+        self.seconds += seconds
+        self.last_run = {
+            "chunks": len(texts),
+            "batches": len(batches),
+            "retries": self.retries - retries,
+            "seconds": seconds,
+            "chunks_per_s": len(texts) / seconds if seconds else None,
+        }
+        return vectors
+
+    def embed_documents(self, texts: List[str], on_batch=None) -> List[List[float]]:
+        """
+        Synchronous version of ``aembed_documents``. It runs on the shared
+        background event loop, so it can also be called from a thread that
+        runs an event loop, and the async pool is kept between calls.
+        """
+        if not texts:
+            return []
+        return run_sync(self.aembed_documents(texts, on_batch=on_batch))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.embed([text], self.model)[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+    def close(self):
+        self.client.close()
+        run_sync(self.client.aclose())
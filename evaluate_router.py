@@ -0,0 +1,117 @@
+"""
+Offline evaluation of the local embedding router against the LLM router.
+
+Every labelled question is routed by an ``EmbeddingRouter`` fitted on the other
+folds and by the structured-output LLM router used in ``MistralChatbot``. The
+script reports how often the two agree, how often the local router escalates,
+and the latency saved per turn.
+
+    python evaluate_router.py --questions router_questions.jsonl --folds 5
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from embedding_cache import CachedEmbeddings
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
+from llm_chatbot import MistralChatbot, RouteQuery
+from query_router import EmbeddingRouter, load_labelled_questions
+from utils import _set_env
+
+
+def evaluate(questions, labels, embeddings, llm_router, threshold, folds):
+    rows = []
+    for fold in range(folds):
+        train = [i for i in range(len(questions)) if i % folds != fold]
+        test = [i for i in range(len(questions)) if i % folds == fold]
+        router = EmbeddingRouter(embeddings, threshold=threshold).fit(
+            [questions[i] for i in train], [labels[i] for i in train]
+        )
+        for i in test:
+            start = time.perf_counter()
+            local_label, confidence = router.predict(questions[i])
+            local_latency = time.perf_counter() - start
+
+            start = time.perf_counter()
+            llm_label = llm_router.invoke(
+                [SystemMessage(content=MistralChatbot.router_prompt)]
+                + [HumanMessage(content=questions[i])]
+            ).datasource
+            llm_latency = time.perf_counter() - start
+
+            rows.append(
+                {
+                    "question": questions[i],
+                    "label": labels[i],
+                    "local": local_label,
+                    "confidence": confidence,
+                    "escalated": confidence < threshold,
+                    "llm": llm_label,
+                    "local_latency": local_latency,
+                    "llm_latency": llm_latency,
+                }
+            )
+    return rows
+
+
+def summarize(rows):
+    confident = [row for row in rows if not row["escalated"]]
+    # the served route is the local one when confident, the LLM one otherwise
+    served = [row["local"] if not row["escalated"] else row["llm"] for row in rows]
+    llm_latency = statistics.mean(row["llm_latency"] for row in rows)
+    local_latency = statistics.mean(row["local_latency"] for row in rows)
+    escalation_rate = 1 - len(confident) / len(rows)
+    turn_latency = local_latency + escalation_rate * llm_latency
+    return {
+        "n_questions": len(rows),
+        "escalation_rate": escalation_rate,
+        "agreement_with_llm_when_confident": (
+            sum(row["local"] == row["llm"] for row in confident) / len(confident)
+            if confident
+            else None
+        ),
+        "served_agreement_with_llm": sum(
+            route == row["llm"] for route, row in zip(served, rows)
+        )
+        / len(rows),
+        "served_accuracy": sum(
+            route == row["label"] for route, row in zip(served, rows)
+        )
+        / len(rows),
+        "llm_accuracy": sum(row["llm"] == row["label"] for row in rows) / len(rows),
+        "mean_llm_router_latency_s": llm_latency,
+        "mean_local_router_latency_s": local_latency,
+        "mean_latency_saved_per_turn_s": llm_latency - turn_latency,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--questions", default="router_questions.jsonl")
+    parser.add_argument("--threshold", type=float, default=0.02)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--cache-dir", default="rag_index/embedding_cache")
+    parser.add_argument("--output", default=None, help="per-question JSONL output")
+    args = parser.parse_args()
+
+    _set_env("MISTRAL_API_KEY")
+
+    questions, labels = load_labelled_questions(args.questions)
+    embeddings = CachedEmbeddings(
+        MistralAIEmbeddings(model="mistral-embed"), cache_dir=args.cache_dir
+    )
+    llm_router = ChatMistralAI(
+        model="mistral-small-2409", temperature=0.0
+    ).with_structured_output(RouteQuery)
+
+    rows = evaluate(
+        questions, labels, embeddings, llm_router, args.threshold, args.folds
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+    print(json.dumps(summarize(rows), indent=2))
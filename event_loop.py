@@ -0,0 +1,83 @@
+"""
+Bridge from synchronous code to the async pipeline.
+
+Every synchronous wrapper (``run_once``, ``stream_once``, the batched
+embeddings) runs its coroutine on one event loop, run forever on a daemon
+thread. It is shared by all their calls because the async HTTP clients of the
+LLM are bound to the loop they were first used on: a loop per call makes
+every call after the first fail with "Event loop is closed".
+"""
+
+import asyncio
+import queue
+import threading
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def background_loop():
+    """
+    Returns the shared event loop, started on first use.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
+
+
+def _check_caller(loop):
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if running is loop:
+        raise RuntimeError(
+            "cannot wait for the background event loop from a coroutine running on it"
+        )
+
+
+def run_sync(coroutine):
+    """
+    Runs ``coroutine`` to completion from synchronous code on the background
+    event loop, which also works when the caller already runs an event loop
+    (e.g. a notebook).
+    """
+    loop = background_loop()
+    _check_caller(loop)
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def iterate_sync(async_iterator):
+    """
+    Iterates over ``async_iterator`` from synchronous code. The iterator is
+    driven by the background event loop and its items are handed over
+    through a queue as soon as they are produced. Closing the generator
+    early cancels the iteration.
+    """
+    loop = background_loop()
+    _check_caller(loop)
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in async_iterator:
+                items.put(item)
+        except BaseException as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), loop)
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # a no-op once the pump is over
+        future.cancel()
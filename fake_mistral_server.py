@@ -0,0 +1,369 @@
+"""
+Local stand-in for the Mistral API, to test and benchmark without network.
+
+    POST /v1/embeddings         {"model", "input": [texts]}
+    POST /v1/chat/completions   {"model", "messages", "tools"?, "stream"?}
+
+Embeddings are deterministic unit vectors derived from the text hash, so a
+text always gets the same vector. Chat replies are canned sentences, streamed
+as server-sent events when asked; when tools are given the first one is
+called with arguments made up from its JSON schema (enum values picked from
+the prompt hash), which is what ``with_structured_output`` needs. The server
+can add latency, per generated word and per new connection too, rate limit
+requests (429 with a ``Retry-After`` header) and start failing after a number
+of requests, to exercise retries and checkpoints.
+
+    python fake_mistral_server.py --port 8765 --latency 0.05 --rate-limit 20
+
+and ``MISTRAL_BASE_URL=http://127.0.0.1:8765/v1`` for ``ChatMistralAI`` and
+``MistralClient``,
+
+or, in-process:
+
+    with FakeMistralServer(rate_limit=20) as server:
+        embeddings = BatchedEmbeddings(base_url=server.url)
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def _text_seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+
+
+def fake_embedding(text, dim=1024):
+    vector = (
+        np.random.default_rng(_text_seed(text)).standard_normal(dim).astype(np.float32)
+    )
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_reply(prompt, words=40):
+    """
+    Canned answer of ``words`` words, the same for the same prompt.
+    """
+    rng = np.random.default_rng(_text_seed(prompt))
+    vocabulary = (
+        "the treatment your doctor may discuss options side effects care plan "
+        "cancer therapy team follow up questions appointment symptoms"
+    ).split()
+    return " ".join(rng.choice(vocabulary, words)).capitalize() + "."
+
+
+def fake_arguments(schema, prompt):
+    """
+    Arguments matching the JSON ``schema`` of a tool, enum values being picked
+    from the hash of ``prompt``.
+    """
+    seed = _text_seed(prompt)
+    arguments = {}
+    for name, field in schema.get("properties", {}).items():
+        if "enum" in field:
+            arguments[name] = field["enum"][seed % len(field["enum"])]
+        elif field.get("type") in ("integer", "number"):
+            arguments[name] = seed % 2
+        elif field.get("type") == "boolean":
+            arguments[name] = bool(seed % 2)
+        else:
+            arguments[name] = "yes" if "score" in name else f"fake {name}"
+    return arguments
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops bursts of new connections, which are
+    # then retried a second later
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # clients closing their keep-alive connections are not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeMistralServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        dim=1024,
+        latency=0.0,
+        rate_limit=None,
+        fail_after=None,
+        word_latency=0.0,
+        reply_words=40,
+        connect_latency=0.0,
+    ):
+        self.dim = dim
+        self.latency = latency
+        # seconds per generated word of chat replies, after ``latency``
+        self.word_latency = word_latency
+        self.reply_words = reply_words
+        # seconds to accept a new connection, standing for the TCP and TLS
+        # handshakes with the real API
+        self.connect_latency = connect_latency
+        # requests per second, beyond which requests get a 429
+        self.rate_limit = rate_limit
+        # number of successful requests after which every request gets a 503
+        self.fail_after = fail_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.embedded = 0
+        self.completions = 0
+        self.connections = 0
+
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._refilled = time.monotonic()
+        self._server = _HTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self):
+        """
+        Returns ``None`` if the request is served, otherwise its error status.
+        """
+        with self._lock:
+            self.requests += 1
+            if self.fail_after is not None and self.requests > self.fail_after:
+                return 503
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate_limit,
+                    self._tokens + (now - self._refilled) * self.rate_limit,
+                )
+                self._refilled = now
+                if self._tokens < 1:
+                    self.rate_limited += 1
+                    return 429
+                self._tokens -= 1
+            return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, without TCP_NODELAY
+            # kept-alive connections wait for delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+                if server.connect_latency:
+                    time.sleep(server.connect_latency)
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_event(self, payload):
+                data = f"data: {payload}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    self._send_event(json.dumps(chunk))
+                self._send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_POST(self):
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                route = self.path.rstrip("/")
+                if route not in ("/v1/embeddings", "/v1/chat/completions"):
+                    self._reply(404, {"message": f"unknown route {self.path}"})
+                    return
+                status = server._admit()
+                if status == 429:
+                    retry_after = f"{1 / server.rate_limit:.3f}"
+                    self._reply(
+                        429, {"message": "rate limited"}, {"Retry-After": retry_after}
+                    )
+                    return
+                if status is not None:
+                    self._reply(status, {"message": "unavailable"})
+                    return
+
+                if server.latency:
+                    time.sleep(server.latency)
+                if route == "/v1/chat/completions":
+                    self._chat(request)
+                    return
+                texts = request["input"]
+                with server._lock:
+                    server.embedded += len(texts)
+                self._reply(
+                    200,
+                    {
+                        "object": "list",
+                        "model": request.get("model"),
+                        "data": [
+                            {
+                                "object": "embedding",
+                                "index": i,
+                                "embedding": fake_embedding(text, server.dim),
+                            }
+                            for i, text in enumerate(texts)
+                        ],
+                        "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts)},
+                    },
+                )
+
+            def _chat(self, request):
+                prompt = "\n".join(
+                    str(message.get("content") or "") for message in request["messages"]
+                )
+                prompt_tokens = len(prompt) // 4
+                message = {"role": "assistant", "content": ""}
+                if request.get("tools"):
+                    function = request["tools"][0]["function"]
+                    arguments = fake_arguments(function.get("parameters", {}), prompt)
+                    message["tool_calls"] = [
+                        {
+                            "id": hashlib.sha256(prompt.encode()).hexdigest()[:9],
+                            "function": {
+                                "name": function["name"],
+                                "arguments": json.dumps(arguments),
+                            },
+                        }
+                    ]
+                    words = []
+                else:
+                    words = fake_reply(prompt, server.reply_words).split(" ")
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                }
+                with server._lock:
+                    server.completions += 1
+                base = {"id": "fake", "model": request.get("model")}
+
+                if not request.get("stream"):
+                    time.sleep(server.word_latency * len(words))
+                    message["content"] = " ".join(words)
+                    self._reply(
+                        200,
+                        {
+                            **base,
+                            "object": "chat.completion",
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": message,
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                            "usage": usage,
+                        },
+                    )
+                    return
+
+                def chunks():
+                    if message.get("tool_calls"):
+                        yield {**base, "choices": [{"index": 0, "delta": message}]}
+                    for i, word in enumerate(words):
+                        time.sleep(server.word_latency)
+                        content = word if i == 0 else " " + word
+                        delta = {"role": "assistant", "content": content}
+                        yield {**base, "choices": [{"index": 0, "delta": delta}]}
+                    yield {
+                        **base,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": ""},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    }
+
+                self._stream(chunks())
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests/s")
+    parser.add_argument(
+        "--word-latency", type=float, default=0.0, help="seconds per generated word"
+    )
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument(
+        "--connect-latency", type=float, default=0.0, help="seconds per new connection"
+    )
+    args = parser.parse_args()
+
+    server = FakeMistralServer(
+        args.host,
+        args.port,
+        dim=args.dim,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        word_latency=args.word_latency,
+        reply_words=args.reply_words,
+        connect_latency=args.connect_latency,
+    )
+    print(f"serving on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
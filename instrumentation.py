@@ -0,0 +1,320 @@
+"""
+Local metrics of the chatbot pipeline, without sending anything off the box.
+
+The stages of ``MistralChatbot`` are wrapped with ``instrumented(stage)``;
+every call records an event with its wall time and, when the result tells,
+its prompt/completion tokens (LangChain ``usage_metadata``, also of the raw
+message of a structured output) or the number of retrieved chunks. Cache
+lookups record whether they hit. Events are
+
+    - aggregated in memory, in a latency histogram per stage (Prometheus
+      buckets, so bounded memory) and token, chunk and cache counters,
+      see ``summary()``,
+    - exported as Prometheus text (``prometheus_text()``, or over HTTP with
+      ``serve_prometheus(port)``),
+    - appended to a JSON-lines file when ``jsonl_path`` is set,
+    - handed to the ``hooks``, callables taking the event dict.
+"""
+
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate of the ``q`` quantile, interpolated in its bucket as
+        Prometheus' ``histogram_quantile`` does.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def is_structured_output(result):
+    """
+    Whether ``result`` is the output of a ``with_structured_output(...,
+    include_raw=True)`` model: a dict with the raw message and what was parsed.
+    """
+    return isinstance(result, dict) and {"raw", "parsed"} <= result.keys()
+
+
+def parsed_output(result):
+    """
+    The parsed object of a structured output (see ``is_structured_output``),
+    raising its parsing error; any other result is returned as it is.
+    """
+    if not is_structured_output(result):
+        return result
+    if result.get("parsing_error") is not None:
+        raise result["parsing_error"]
+    return result["parsed"]
+
+
+def result_fields(result):
+    """
+    What the result of a stage tells about it: the token usage of a chat
+    model message, also the raw one of a structured output, or the number of
+    documents of a retrieval.
+    """
+    fields = {}
+    if is_structured_output(result):
+        result = result["raw"]
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        fields["prompt_tokens"] = usage.get("input_tokens", 0)
+        fields["completion_tokens"] = usage.get("output_tokens", 0)
+    if isinstance(result, list):
+        fields["chunks"] = len(result)
+    return fields
+
+
+class Instrumentation:
+    def __init__(self, jsonl_path=None, buckets=DEFAULT_BUCKETS, hooks=None):
+        self.jsonl_path = jsonl_path
+        self.buckets = buckets
+        self.hooks = list(hooks or [])
+
+        self._latency = defaultdict(lambda: Histogram(self.buckets))
+        # (stage, field) -> total, for tokens, chunks and errors
+        self._totals = defaultdict(int)
+        # (cache, "hit", "miss" or "coalesced") -> count
+        self._cache = defaultdict(int)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        """
+        Records an event dict, with a ``stage`` and a ``seconds`` key or a
+        ``cache`` and a ``result`` key (and a ``count`` of lookups, 1 by
+        default), and any other fields.
+        """
+        event = {"time": time.time(), **event}
+        with self._lock:
+            if "cache" in event:
+                self._cache[event["cache"], event["result"]] += event.get("count", 1)
+            else:
+                self._latency[event["stage"]].observe(event["seconds"])
+                for field in ("prompt_tokens", "completion_tokens", "chunks"):
+                    if field in event:
+                        self._totals[event["stage"], field] += event[field]
+                if "error" in event:
+                    self._totals[event["stage"], "errors"] += 1
+            if self.jsonl_path is not None:
+                if self._file is None:
+                    self._file = open(self.jsonl_path, "a")
+                self._file.write(json.dumps(event) + "\n")
+                self._file.flush()
+        for hook in self.hooks:
+            hook(event)
+
+    def observe(self, stage, seconds, result=None, **fields):
+        event = {"stage": stage, "seconds": seconds, **result_fields(result)}
+        self.record({**event, **fields})
+
+    def cache(self, name, result, count=1):
+        """
+        Records ``count`` lookups of the cache ``name``, ``result`` being
+        ``"hit"``, ``"miss"`` or ``"coalesced"`` (it waited for the same
+        computation).
+        """
+        event = {"cache": name, "result": result}
+        if count != 1:
+            event["count"] = count
+        self.record(event)
+
+    def summary(self):
+        """
+        Per stage latency count, mean and p50/p95/p99 (in seconds) with the
+        token and chunk totals, and the lookups of every cache with the share
+        that did not compute anything.
+        """
+        with self._lock:
+            stages = {}
+            for stage, histogram in self._latency.items():
+                mean = histogram.sum / histogram.count
+                stages[stage] = {"count": histogram.count, "mean": mean}
+                for q in (50, 95, 99):
+                    stages[stage][f"p{q}"] = histogram.quantile(q / 100)
+            for (stage, field), total in self._totals.items():
+                stages[stage][field] = total
+            caches = {}
+            for (name, result), count in self._cache.items():
+                counts = caches.setdefault(name, {"hit": 0, "miss": 0, "coalesced": 0})
+                counts[result] = count
+            for counts in caches.values():
+                counts["hit_rate"] = 1 - counts["miss"] / sum(counts.values())
+        return {"stages": stages, "caches": caches}
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP chatbot_stage_seconds Wall time of the chatbot pipeline stages.",
+            "# TYPE chatbot_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._latency.items()):
+                cumulative = 0
+                labels = f'stage="{stage}"'
+                bounds = histogram.buckets + ("+Inf",)
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'chatbot_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f"chatbot_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(
+                    f"chatbot_stage_seconds_count{{{labels}}} {histogram.count}"
+                )
+            for field, help in [
+                ("prompt_tokens", "Prompt tokens sent by the stages."),
+                ("completion_tokens", "Completion tokens generated by the stages."),
+                ("chunks", "Chunks retrieved by the stages."),
+                ("errors", "Failed calls of the stages."),
+            ]:
+                lines.append(f"# HELP chatbot_{field}_total {help}")
+                lines.append(f"# TYPE chatbot_{field}_total counter")
+                for (stage, total_field), total in sorted(self._totals.items()):
+                    if total_field == field:
+                        lines.append(
+                            f'chatbot_{field}_total{{stage="{stage}"}} {total}'
+                        )
+            lines.append("# HELP chatbot_cache_lookups_total Cache lookups by result.")
+            lines.append("# TYPE chatbot_cache_lookups_total counter")
+            for (name, result), count in sorted(self._cache.items()):
+                lines.append(
+                    f'chatbot_cache_lookups_total{{cache="{name}",result="{result}"}} {count}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port=9100, host="127.0.0.1"):
+        """
+        Serves ``prometheus_text()`` at ``http://host:port/metrics`` from a
+        background thread. Returns the server, to ``shutdown()`` it.
+        """
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def instrumented(stage):
+    """
+    Decorator of the methods of an object with an ``instrumentation``
+    attribute, recording every call as ``stage``. Failed calls are recorded
+    with their error. A method returning a structured output with its raw
+    message (``with_structured_output(..., include_raw=True)``) has the tokens
+    of the message recorded and returns the parsed object.
+    """
+
+    def observe(self, start, result=None, error=None):
+        fields = {} if error is None else {"error": type(error).__name__}
+        seconds = time.perf_counter() - start
+        self.instrumentation.observe(stage, seconds, result, **fields)
+
+    def finish(self, start, result):
+        try:
+            parsed = parsed_output(result)
+        except Exception as e:
+            observe(self, start, result, error=e)
+            raise
+        observe(self, start, result)
+        return parsed
+
+    def decorate(method):
+        if asyncio.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await method(self, *args, **kwargs)
+                except Exception as e:
+                    observe(self, start, error=e)
+                    raise
+                return finish(self, start, result)
+
+        else:
+
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = method(self, *args, **kwargs)
+                except Exception as e:
+                    observe(self, start, error=e)
+                    raise
+                return finish(self, start, result)
+
+        return wrapper
+
+    return decorate
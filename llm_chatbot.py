@@ -1,12 +1,26 @@
-import json
-from typing import Literal
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import SKLearnVectorStore
-from langchain_core.documents import Document
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Literal, NamedTuple, Optional
+
+from context_packer import pack_context, tiktoken_counter
+from conversation_memory import ConversationMemory
+from corpus_io import iter_corpus_documents
+from ehr_store import DEFAULT_PATIENT, EHRStore
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import BatchedEmbeddings
+from event_loop import iterate_sync, run_sync
+from instrumentation import Instrumentation, instrumented, parsed_output
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
+from langchain_mistralai import ChatMistralAI
 from pydantic import BaseModel, Field
+from query_router import EmbeddingRouter
+from response_cache import response_key, ResponseCache
+from sharded_index import detect_topics, ShardedIndex
+from token_splitter import TokenOffsetSplitter
+from vector_index import index_key
 
 
 # Data model
@@ -30,12 +44,46 @@ class RouteQuery(BaseModel):
     )
 
 
+GRADING_MODES = ("off", "background", "blocking")
+
+
+class StreamEvent(NamedTuple):
+    """Event yielded by ``MistralChatbot.astream_once``."""
+
+    kind: Literal["token", "suggestions", "metrics", "grade"]
+    data: Any
+
+
+@dataclass
+class TurnContext:
+    """
+    State of one question through the pipeline. Later stages read the route,
+    the retrieved documents and the answer from it instead of computing them
+    again.
+    """
+
+    question: str
+    patient_id: Optional[str] = None
+    # the conversation before the question, as put in the prompts
+    history: str = ""
+    route: Optional[Literal["simple", "complex"]] = None
+    docs: Optional[list] = None
+    answer: Optional[str] = None
+    suggestions: Optional[str] = None
+    timings: dict = field(default_factory=dict)
+    grade: Optional[GradeHallucinations] = None
+    grade_future: Optional[Future] = None
+
+
 class MistralChatbot:
 
     """ """
 
     rag_prompt = """
-    You are an assistant helping a cancer patient. Based on the conversation, please answer the following questions:
+    You are an assistant helping a cancer patient.
+    {history}
+
+    Based on the conversation, please answer the following questions:
     {questions}
 
     Context (if available):
@@ -53,6 +101,8 @@ class MistralChatbot:
     
     The patient's Electronic Health Record : {ehr} 
     
+    {history}
+
     His question: {question}
 
     Please answer his question given his personal health information.
@@ -90,6 +140,8 @@ class MistralChatbot:
 
     The patient's Electronic Health Record : {ehr} 
 
+    {history}
+
     His question: {question}
 
     Please answer his question given his personal health information.
@@ -102,10 +154,24 @@ class MistralChatbot:
 
     The patient's Electronic Health Record : {ehr} 
 
+    {history}
+
     His question: {question}
 
     Based on the conversation, suggest 4 relevant and helpful questions. Please provide only the questions nothing else.
     """
+
+    summary_prompt = """You are summarizing a conversation between a cancer patient and their assistant.
+
+    Summary so far:
+    {summary}
+
+    New turns:
+    {turns}
+
+    Update the summary with the new turns in at most {max_words} words. Keep the symptoms, treatments, concerns and facts the patient mentioned and what they were told. Provide only the summary.
+    """
+
     def __init__(
         self,
         db_patient_path,
@@ -113,139 +179,693 @@ class MistralChatbot:
         ehr_path,
         mistral_model="mistral-large-latest",
         temperature=0.0,
+        index_dir="rag_index",
+        embedding_model="mistral-embed",
+        chunk_size=1000,
+        chunk_overlap=200,
+        search_backend="exact",
+        search_params=None,
+        audience="patient",
+        retrieval_mode="auto",
+        context_max_tokens=3000,
+        ehr_dir=None,
+        ehr_cache_size=128,
+        router_path="router_questions.jsonl",
+        router_threshold=0.02,
+        response_cache_size=256,
+        response_cache_ttl=3600.0,
+        grading="off",
+        on_grade=None,
+        grading_workers=4,
+        history_turns=4,
+        history_max_tokens=800,
+        instrumentation=None,
         debug=False,
     ) -> None:
         # QUESTION CAN YOU CHANGE THE TEMPERATURE DEPENDING ON THE FLOW ?
         self.llm = ChatMistralAI(model="mistral-small-2409", temperature=temperature)
         # self.llm_small = ChatMistralAI(model="mistral-small", temperature=0.0)
-        self.structured_llm_router = self.llm.with_structured_output(RouteQuery)
+        # the raw messages are kept for their token usage, the instrumented
+        # stages return the parsed objects
+        self.structured_llm_router = self.llm.with_structured_output(
+            RouteQuery, include_raw=True
+        )
         self.structured_llm_hallucination_grader = self.llm.with_structured_output(
-            GradeHallucinations
+            GradeHallucinations, include_raw=True
         )
 
         self.db_patient_path = db_patient_path
         self.db_doctor_path = db_doctor_path
         self.ehr_path = ehr_path
+        # EHRs by patient ID, ``ehr_path`` is the one of the default patient
+        self.ehr_store = EHRStore(
+            ehr_dir=ehr_dir,
+            paths={DEFAULT_PATIENT: ehr_path} if ehr_path else None,
+            templates={
+                "simple": self.simple_question_prompt,
+                "suggest": self.suggest_questions_prompt,
+            },
+            max_items=ehr_cache_size,
+        )
+        self.index_dir = index_dir
+        self.embedding_model = embedding_model
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = None
+        self.search_backend = search_backend
+        self.search_params = search_params
+        self.audience = audience
+        self.retrieval_mode = retrieval_mode
+        self.context_max_tokens = context_max_tokens
+        self.count_tokens = tiktoken_counter()
         self.debug = debug
+        # per-stage latency, tokens, chunks and cache hits, kept locally
+        self.instrumentation = instrumentation or Instrumentation()
         self.counter = 0
+        self.last_timings = {}
+        self.last_turn = None
+        # hallucination grading of the answers: "off", "background" (the
+        # verdict is delivered to on_grade after the answer) or "blocking"
+        if grading not in GRADING_MODES:
+            raise ValueError(f"grading must be one of {GRADING_MODES}, got {grading!r}")
+        self.grading = grading
+        self.on_grade = on_grade
+        self.grading_workers = grading_workers
+        self._grader = None
+        # conversation memories keep history_turns turns verbatim and fold the
+        # older ones into a summary, within history_max_tokens per prompt
+        self.history_turns = history_turns
+        self.history_max_tokens = history_max_tokens
+        self._summarizer = None
+        self.response_cache = None
+        if response_cache_size:
+            self.response_cache = ResponseCache(
+                max_items=response_cache_size,
+                ttl=response_cache_ttl,
+                on_lookup=lambda result: self.instrumentation.cache("response", result),
+            )
+
+        # embeddings are shared by the index build and every retrieval, index
+        # builds send concurrent batches and checkpoint them in the cache
+        self.embeddings = CachedEmbeddings(
+            BatchedEmbeddings(model=embedding_model),
+            model=embedding_model,
+            cache_dir=os.path.join(index_dir, "embedding_cache"),
+            on_lookup=lambda result, count: self.instrumentation.cache(
+                "embedding", result, count
+            ),
+        )
 
         # setting up database
         self.setup_rag_db()
 
+        # local router, the LLM router is only used for ambiguous questions
+        self.local_router = None
+        if router_path is not None:
+            self.local_router = EmbeddingRouter.from_file(
+                router_path, self.embeddings, threshold=router_threshold
+            )
+
     def setup_rag_db(self):
         """
         This initializes the RAG database with the doctor and patient dataset.
+        Each dataset is indexed in shards per guideline topic (see
+        ``sharded_index``), persisted under ``self.index_dir`` and searched
+        with ``self.search_backend`` ("exact", "ivf", or the quantized "int8"
+        and "binary", which keep the float32 matrix memory-mapped on disk,
+        see ``ann_index``).
+        A shard is only loaded when a question needs it, and is searched in
+        ``self.retrieval_mode`` ("vector", "bm25", "hybrid" or "auto", see
+        ``sharded_index``). Only the documents
+        of the dataset that changed since the last start are split and
+        embedded again, and everything is rebuilt when the splitter settings
+        or the embedding model change.
         """
+        key = index_key(
+            self.chunk_size,
+            self.chunk_overlap,
+            self.embedding_model,
+            splitter="token_offsets+start_index",
+        )
+        self.index = ShardedIndex(
+            self.index_dir,
+            key,
+            embedding=self.embeddings,
+            corpora={"patient": self.db_patient_path, "doctor": self.db_doctor_path},
+            load_documents=self.load_documents,
+            split_documents=self.split_documents,
+            search_backend=self.search_backend,
+            search_params=self.search_params,
+            info={
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "embedding_model": self.embedding_model,
+            },
+            debug=self.debug,
+        )
+        self.index_version = self.index.version
+        if self.debug:
+            print("index", key, {a: self.index.topics(a) for a in self.index.corpora})
+            print("embedding cache", self.embeddings.stats)
 
-        # Load data from JSON file
-        with open(self.db_patient_path, "r") as file:
-            data = json.load(file)
+    def load_documents(self, corpus_path):
+        """
+        Yields the documents of a dataset, one per guideline.
+        """
+        return iter_corpus_documents(corpus_path)
 
-        # Create documents from JSON data
-        docs_list = [
-            Document(page_content=item["text"], metadata={"source": item["url"]})
-            for item in data.values()
+    def split_documents(self, documents):
+        """
+        Splits documents into the chunks that get embedded. Chunks keep their
+        ``start_index`` so overlapping ones can be merged back into the context.
+        """
+        if self.text_splitter is None:
+            # same chunks as RecursiveCharacterTextSplitter.from_tiktoken_encoder
+            self.text_splitter = TokenOffsetSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                add_start_index=True,
+            )
+        return self.text_splitter.split_documents(documents)
+
+    def router_messages(self, query):
+        return [SystemMessage(content=self.router_prompt)] + [
+            HumanMessage(content=query)
         ]
 
-        # Split documents
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=1000, chunk_overlap=200
+    def complex_question_messages(self, question, docs, metrics=None, history=""):
+        """
+        The context is packed within ``self.context_max_tokens`` (see
+        ``context_packer``); its token counts are added to ``metrics``.
+        """
+        docs_txt, report = pack_context(
+            docs, self.count_tokens, max_tokens=self.context_max_tokens
         )
-        doc_splits = text_splitter.split_documents(docs_list)
+        if metrics is not None:
+            metrics.update(report)
+        if self.debug:
+            print("context", report)
+        rag_prompt_formatted = self.rag_prompt.format(
+            context=docs_txt, questions=question, history=history
+        )
+        if self.debug:
+            print("rag_prompt_formatted,", rag_prompt_formatted)
+        return [HumanMessage(content=rag_prompt_formatted)]
 
-        # Add to vectorDB
-        vectorstore = SKLearnVectorStore.from_documents(
-            documents=doc_splits,
-            embedding=MistralAIEmbeddings(),
+    def simple_question_messages(self, question, patient_id=None, history=""):
+        simple_prompt_formatted = self.ehr_store.render(
+            "simple", question, patient_id, history
         )
+        return [HumanMessage(content=simple_prompt_formatted)]
 
-        # Create retriever
-        self.retriever_patient = vectorstore.as_retriever()
+    def suggest_questions_messages(self, question, patient_id=None, history=""):
+        suggest_questions_prompt_formatted = self.ehr_store.render(
+            "suggest", question, patient_id, history
+        )
+        return [HumanMessage(content=suggest_questions_prompt_formatted)]
 
+    def local_route(self, query):
+        """
+        Routes the query with the local embedding router. Returns ``None`` if
+        there is no local router or it is not confident enough.
+        """
+        if self.local_router is None:
+            return None
+        label = self.local_router.route(query)
+        if label is None:
+            return None
+        return RouteQuery(datasource=label)
+
+    @instrumented("route")
     def route_query(self, query: str) -> str:
         """
         This is the first step in our solution. We route the patient's question depending on the complexity of the question (query).
+        The local router answers first and the LLM router is only called when it is unsure.
         """
-        routed = self.structured_llm_router.invoke(
-            [SystemMessage(content=self.router_prompt)] + [HumanMessage(content=query)]
-        )
+        routed = self.local_route(query)
+        if routed is None:
+            routed = self.structured_llm_router.invoke(self.router_messages(query))
+        if self.debug:
+            print("routed", parsed_output(routed))
+        return routed
+
+    @instrumented("route")
+    async def aroute_query(self, query: str) -> str:
+        routed = await asyncio.to_thread(self.local_route, query)
+        if routed is None:
+            routed = await self.structured_llm_router.ainvoke(
+                self.router_messages(query)
+            )
         if self.debug:
-            print("routed", routed)
+            print("routed", parsed_output(routed))
         return routed
 
-    def answer_complex_question(self, question):
+    def question_topics(self, question, patient_id=None):
+        """
+        The cancer types the question is about, or the ones of the patient's
+        EHR when the question names none.
+        """
+        topics = detect_topics(question)
+        if not topics:
+            topics = detect_topics(self.ehr_store.get(patient_id).text)
+        return topics
+
+    @instrumented("retrieve")
+    def retrieve(self, question, audience=None, patient_id=None):
+        """
+        Searches the shards of ``audience`` (``self.audience`` by default)
+        that match the cancer types of the question.
+        """
+        docs = self.index.search(
+            question,
+            audience or self.audience,
+            self.question_topics(question, patient_id),
+            mode=self.retrieval_mode,
+        )
+        if self.debug:
+            print(
+                "retrieval", self.retrieval_mode, self.index.stats[self.retrieval_mode]
+            )
+        return docs
+
+    async def aretrieve(self, question, audience=None, patient_id=None):
+        return await asyncio.to_thread(self.retrieve, question, audience, patient_id)
+
+    @instrumented("answer_complex")
+    def answer_complex_question(
+        self, question, docs=None, metrics=None, patient_id=None, history=""
+    ):
         """
         If the question is deemed hard the RAG will help to provide the answer.
+        ``docs`` can be passed when the retrieval has already been done.
         """
-        docs = self.retriever_patient.invoke(question)
-        docs_txt = self.format_docs(docs)
-        rag_prompt_formatted = self.rag_prompt.format(
-            context=docs_txt, questions=question
+        if docs is None:
+            docs = self.retrieve(question, patient_id=patient_id)
+        generation = self.llm.invoke(
+            self.complex_question_messages(question, docs, metrics, history)
         )
-        generation = self.llm.invoke([HumanMessage(content=rag_prompt_formatted)])
         if self.debug:
-            print("rag_prompt_formatted,", rag_prompt_formatted)
             print("\n generation: ", generation)
 
         return generation
 
-    def suggest_questions(self, question):
-        ehr = open(self.ehr_path, "r").read()
-        simple_prompt_formatted = self.suggest_questions_prompt.format(
-            ehr=ehr, question=question
+    @instrumented("answer_complex")
+    async def aanswer_complex_question(
+        self, question, docs=None, metrics=None, patient_id=None, history=""
+    ):
+        if docs is None:
+            docs = await self.aretrieve(question, patient_id=patient_id)
+        generation = await self.llm.ainvoke(
+            self.complex_question_messages(question, docs, metrics, history)
+        )
+        if self.debug:
+            print("\n generation: ", generation)
+        return generation
+
+    @instrumented("suggest")
+    def suggest_questions(self, question, patient_id=None, history=""):
+        generation = self.llm.invoke(
+            self.suggest_questions_messages(question, patient_id, history)
         )
-        generation = self.llm.invoke([HumanMessage(content=simple_prompt_formatted)])
         if self.debug:
             print("\n suggest_questions: ", generation)
         return generation
 
+    @instrumented("suggest")
+    async def asuggest_questions(self, question, patient_id=None, history=""):
+        generation = await self.llm.ainvoke(
+            self.suggest_questions_messages(question, patient_id, history)
+        )
+        if self.debug:
+            print("\n suggest_questions: ", generation)
+        return generation
 
-    def answer_simple_question(self, question):
+    @instrumented("answer_simple")
+    def answer_simple_question(self, question, patient_id=None, history=""):
         """
         If the question is deemed easy just the patient's EHR will help provide context.
         """
-        ehr = open(self.ehr_path, "r").read()
-        suggest_questions_prompt_formatted = self.simple_question_prompt.format(
-            ehr=ehr, question=question
+        generation = self.llm.invoke(
+            self.simple_question_messages(question, patient_id, history)
         )
-        generation = self.llm.invoke([HumanMessage(content=suggest_questions_prompt_formatted)])
         if self.debug:
             print("\n answer simple question: ", generation)
         return generation
 
-    def grade_hallucinations(self, question, generation):
-        """
-        This function grades the hallucinations in the generation answer.
-        """
-        docs = self.retriever_patient.invoke(question)
+    @instrumented("answer_simple")
+    async def aanswer_simple_question(self, question, patient_id=None, history=""):
+        generation = await self.llm.ainvoke(
+            self.simple_question_messages(question, patient_id, history)
+        )
+        if self.debug:
+            print("\n answer simple question: ", generation)
+        return generation
+
+    @instrumented("grade")
+    def _grade(self, facts, generation):
         hallucination_grader_prompt_formatted = self.hallucination_grader_prompt.format(
-            documents=docs, generation=generation
+            documents=facts, generation=generation
         )
         hallucinated = self.structured_llm_hallucination_grader.invoke(
             [SystemMessage(content=self.hallucination_grader_instructions)]
             + [HumanMessage(content=hallucination_grader_prompt_formatted)]
         )
         if self.debug:
-            print("hallucinated,", hallucinated)
+            print("hallucinated,", parsed_output(hallucinated))
         return hallucinated
 
+    def grade_hallucinations(self, question, generation, docs=None, patient_id=None):
+        """
+        This function grades the hallucinations in the generation answer.
+        ``docs`` are the documents the answer was generated from, they are
+        retrieved again when not given.
+        """
+        if docs is None:
+            docs = self.retrieve(question, patient_id=patient_id)
+        return self._grade(self.format_docs(docs), generation)
+
+    def grade_turn(self, turn):
+        """
+        Grades the answer of ``turn`` against what it was generated from: the
+        retrieved documents, or the patient's EHR for simple questions.
+        """
+        start = time.perf_counter()
+        if turn.docs is not None:
+            facts = self.format_docs(turn.docs)
+        else:
+            facts = self.ehr_store.get(turn.patient_id).text
+        turn.grade = self._grade(facts, turn.answer)
+        turn.timings["grade"] = time.perf_counter() - start
+        return turn.grade
+
+    def start_grading(self, turn):
+        """
+        Grades ``turn`` on the grader threads, so that it does not hold the
+        event loop of the turn. ``self.on_grade(turn)`` is called with the
+        verdict in ``turn.grade``; the future is kept in ``turn.grade_future``.
+        """
+        if self._grader is None:
+            self._grader = ThreadPoolExecutor(
+                max_workers=self.grading_workers, thread_name_prefix="grader"
+            )
+        turn.grade_future = self._grader.submit(self.grade_turn, turn)
+
+        def deliver(future):
+            if future.exception() is not None:
+                print("grading failed:", repr(future.exception()))
+            elif self.on_grade is not None:
+                self.on_grade(turn)
+
+        turn.grade_future.add_done_callback(deliver)
+        return turn.grade_future
+
     @staticmethod
     def format_docs(docs):
         return "\n\n".join(doc.page_content for doc in docs)
 
-    def run_once(self, question):
+    @staticmethod
+    async def _timed(timings, stage, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    def _start_turn(self, turn):
+        """
+        Starts routing, question suggestion and a speculative retrieval together.
+        """
+        question, timings, patient_id = turn.question, turn.timings, turn.patient_id
+        route_task = asyncio.ensure_future(
+            self._timed(timings, "route", self.aroute_query(question))
+        )
+        suggest_task = asyncio.ensure_future(
+            self._timed(
+                timings,
+                "suggest",
+                self.asuggest_questions(question, patient_id, turn.history),
+            )
+        )
+        retrieve_task = asyncio.ensure_future(
+            self._timed(
+                timings, "retrieve", self.aretrieve(question, patient_id=patient_id)
+            )
+        )
+        return route_task, suggest_task, retrieve_task
+
+    async def _finish_turn(self, turn, start):
+        """
+        Grades the turn in the background, or waits for the verdict in
+        ``"blocking"`` grading mode, and records its timings.
+        """
+        if self.grading != "off":
+            grading = self.start_grading(turn)
+            if self.grading == "blocking":
+                try:
+                    await asyncio.wrap_future(grading)
+                except Exception:
+                    # reported by start_grading, the answer is still returned
+                    pass
+        turn.timings["total"] = time.perf_counter() - start
+        self.last_timings = turn.timings
+        self.last_turn = turn
+        if self.debug:
+            print("timings", turn.timings)
+
+    def response_key(self, question, patient_id=None, history=""):
+        """
+        Key of the cached response to ``question``. It changes with the
+        patient's EHR content, the conversation history, the index, the
+        audience and the model settings.
+        """
+        model_settings = {
+            "model": self.llm.model,
+            "temperature": self.llm.temperature,
+            "audience": self.audience,
+            "retrieval_mode": self.retrieval_mode,
+        }
+        return response_key(
+            question,
+            self.ehr_store.get(patient_id).sha256,
+            self.index_version,
+            model_settings,
+            history,
+        )
+
+    def new_memory(self):
+        """
+        Memory of a new conversation, to pass to ``run_once`` and co.
+        """
+        return ConversationMemory(
+            self.count_tokens,
+            max_turns=self.history_turns,
+            max_tokens=self.history_max_tokens,
+        )
+
+    @instrumented("summarize")
+    def summarize_history(self, summary, turns):
+        """
+        The running summary of a conversation updated with ``turns``.
+        """
+        summary_prompt_formatted = self.summary_prompt.format(
+            summary=summary or "(none)",
+            turns="\n".join(turns),
+            max_words=self.history_max_tokens // 3,
+        )
+        generation = self.llm.invoke([HumanMessage(content=summary_prompt_formatted)])
+        if self.debug:
+            print("\n summary: ", generation)
+        return generation.content
+
+    def remember(self, memory, question, answer):
         """
-        This function runs the chatbot once.
+        Adds a turn to ``memory``. Turns leaving its window are summarized on
+        a background thread, so the next turn does not wait for it.
         """
-        route = self.route_query(question)
-        suggested_question = self.suggest_questions(question)
-        if route.datasource == "simple":
-            generation = self.answer_simple_question(question)
+        if memory is None or not memory.add(question, answer):
+            return
+        if self._summarizer is None:
+            self._summarizer = ThreadPoolExecutor(
+                max_workers=self.grading_workers, thread_name_prefix="summarizer"
+            )
+        self._summarizer.submit(memory.fold, self.summarize_history)
+
+    async def arun_once(self, question, patient_id=None, memory=None):
+        """
+        Runs the chatbot once. Routing, question suggestion and a speculative
+        retrieval are started together; only the answer branch picked by the
+        router is then generated. Per-stage wall times (in seconds) and the
+        context token counts of RAG answers are kept in ``self.last_timings``,
+        the whole ``TurnContext`` in ``self.last_turn``.
+
+        ``patient_id`` picks the EHR in ``self.ehr_store``, by default the one
+        at ``ehr_path``. Responses are cached, and concurrent identical
+        questions of a patient share a single pipeline run; cached responses
+        are not graded again.
+
+        ``memory`` (see ``new_memory``) holds the conversation so far; its
+        history is put in the prompts and the turn is added to it.
+        """
+        history = memory.render() if memory is not None else ""
+        if self.response_cache is None:
+            response = await self._arun_once(question, patient_id, history)
         else:
-            generation = self.answer_complex_question(question)
-        return generation.content, suggested_question.content
-        # hallicunated = self.grade_hallucinations(question, generation)
-        # if not hallicunated.binary_score == "yes":
-        #     return generation.content
-        # else:
-        #     return hallicunated.explanation
+            response = await self.response_cache.aget_or_compute(
+                self.response_key(question, patient_id, history),
+                lambda: self._arun_once(question, patient_id, history),
+            )
+        self.remember(memory, question, response[0])
+        return response
+
+    async def _arun_once(self, question, patient_id=None, history=""):
+        turn = await self.arun_turn(TurnContext(question, patient_id, history))
+        return turn.answer, turn.suggestions
+
+    async def arun_turn(self, turn):
+        """
+        Runs the pipeline for ``turn``, without the response cache, and
+        returns it with its route, documents, answer and suggestions filled.
+        """
+        start = time.perf_counter()
+        tasks = self._start_turn(turn)
+        route_task, suggest_task, retrieve_task = tasks
+        try:
+            turn.route = (await route_task).datasource
+            if turn.route == "simple":
+                retrieve_task.cancel()
+                generation = await self._timed(
+                    turn.timings,
+                    "answer_simple",
+                    self.aanswer_simple_question(
+                        turn.question, turn.patient_id, turn.history
+                    ),
+                )
+            else:
+                turn.docs = await retrieve_task
+                generation = await self._timed(
+                    turn.timings,
+                    "answer_complex",
+                    self.aanswer_complex_question(
+                        turn.question,
+                        docs=turn.docs,
+                        metrics=turn.timings,
+                        history=turn.history,
+                    ),
+                )
+            turn.answer = generation.content
+            turn.suggestions = (await suggest_task).content
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        await self._finish_turn(turn, start)
+        return turn
+
+    async def astream_once(self, question, patient_id=None, memory=None):
+        """
+        Streaming version of ``arun_once``. Yields ``StreamEvent``s:
+            - ``("token", str)`` for each piece of the answer as it is generated,
+            - ``("suggestions", str)`` once the suggested questions are ready,
+            - ``("metrics", dict)`` with the stage timings, the time to first
+              token and, for RAG answers, the context tokens saved,
+            - ``("grade", GradeHallucinations)`` last when grading is on, after
+              the metrics in ``"background"`` mode, before them in
+              ``"blocking"`` mode; there is none when grading fails.
+        A cached response is replayed as a single token event, and so is the
+        response of an identical question already being streamed, once it is
+        complete.
+        """
+        history = memory.render() if memory is not None else ""
+        key = claimed = None
+        if self.response_cache is not None:
+            key = self.response_key(question, patient_id, history)
+            cached, future, owner = self.response_cache.claim(key)
+            if owner:
+                claimed = future
+            elif future is not None:
+                cached = await asyncio.wrap_future(future)
+            if cached is not None:
+                answer, suggested_questions = cached
+                self.remember(memory, question, answer)
+                yield StreamEvent("token", answer)
+                yield StreamEvent("suggestions", suggested_questions)
+                yield StreamEvent("metrics", {"cache_hit": True})
+                return
+
+        turn = TurnContext(question, patient_id, history)
+        start = time.perf_counter()
+        tasks = self._start_turn(turn)
+        route_task, suggest_task, retrieve_task = tasks
+        try:
+            turn.route = (await route_task).datasource
+            if turn.route == "simple":
+                retrieve_task.cancel()
+                stage = "answer_simple"
+                messages = self.simple_question_messages(
+                    question, patient_id, turn.history
+                )
+            else:
+                stage = "answer_complex"
+                turn.docs = await retrieve_task
+                messages = self.complex_question_messages(
+                    question, turn.docs, turn.timings, turn.history
+                )
+
+            answer_start = time.perf_counter()
+            # the chunks add up to the whole message, with its token usage
+            generation = None
+            async for chunk in self.llm.astream(messages):
+                generation = chunk if generation is None else generation + chunk
+                if not chunk.content:
+                    continue
+                if "time_to_first_token" not in turn.timings:
+                    turn.timings["time_to_first_token"] = time.perf_counter() - start
+                yield StreamEvent("token", chunk.content)
+            turn.timings[stage] = time.perf_counter() - answer_start
+            self.instrumentation.observe(stage, turn.timings[stage], generation)
+            turn.answer = generation.content if generation is not None else ""
+
+            turn.suggestions = (await suggest_task).content
+            if claimed is not None:
+                self.response_cache.settle(
+                    key, claimed, value=(turn.answer, turn.suggestions)
+                )
+                claimed = None
+            self.remember(memory, question, turn.answer)
+            yield StreamEvent("suggestions", turn.suggestions)
+        except BaseException as e:
+            # the questions waiting for this response fail with it, also when
+            # the stream is closed or cancelled before the end
+            if claimed is not None:
+                error = e
+                if not isinstance(e, Exception):
+                    error = RuntimeError(f"streaming of the response stopped: {e!r}")
+                self.response_cache.settle(key, claimed, error=error)
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        await self._finish_turn(turn, start)
+        if self.grading == "blocking" and turn.grade is not None:
+            yield StreamEvent("grade", turn.grade)
+        yield StreamEvent("metrics", turn.timings)
+        if self.grading == "background":
+            try:
+                grade = await asyncio.wrap_future(turn.grade_future)
+            except Exception:
+                # reported by start_grading
+                return
+            yield StreamEvent("grade", grade)
+
+    def stream_once(self, question, patient_id=None, memory=None):
+        """
+        Synchronous generator over the events of ``astream_once``.
+        """
+        return iterate_sync(self.astream_once(question, patient_id, memory))
+
+    def run_once(self, question, patient_id=None, memory=None):
+        """
+        This function runs the chatbot once (synchronous wrapper of ``arun_once``).
+        """
+        return run_sync(self.arun_once(question, patient_id, memory))
@@ -21,7 +21,23 @@ if __name__ == "__main__":
         db_patient_path="rag_dataset_patient.json",
         db_doctor_path="rag_dataset_doctor.json",
         ehr_path="ehr_context.txt",
+        grading="background",
     )
+    # the conversation goes on until an empty question
+    memory = chatbot.new_memory()
     val = input("Im your oncology specialist how may I help you ? : ")
-    out = chatbot.run_once(val)
-    print(out)
+    while val.strip():
+        for event in chatbot.stream_once(val, memory=memory):
+            if event.kind == "token":
+                print(event.data, end="", flush=True)
+            elif event.kind == "suggestions":
+                print("\n\nSuggested questions:\n" + event.data)
+            elif event.kind == "metrics":
+                print("time to first token:", event.data.get("time_to_first_token"))
+                if "context_tokens_saved" in event.data:
+                    print("context tokens saved:", event.data["context_tokens_saved"])
+            elif event.kind == "grade":
+                if event.data.binary_score != "yes":
+                    print("\nThis answer may not be grounded:", event.data.explanation)
+        val = input("\nAnything else ? : ")
+    print("stages:", chatbot.instrumentation.summary()["stages"])
@@ -0,0 +1,288 @@
+"""
+Shared HTTP client of the Mistral API for the helpers that call it directly.
+
+Connections are pooled and kept alive: one ``httpx.Client`` for synchronous
+calls and one ``httpx.AsyncClient`` per event loop, so a helper called in a
+loop pays the TCP and TLS handshakes once. Every request has a timeout, and
+rate limits (429) and server errors are retried with exponential backoff and
+full jitter, honouring ``Retry-After``.
+
+The chat endpoint takes one conversation per request, so ``chat_many`` and
+``achat_many`` send a list of them concurrently over the pool; embeddings are
+sent in batches of ``max_batch_size`` inputs.
+
+The endpoint defaults to ``$MISTRAL_BASE_URL`` or the public API, and the key
+to ``$MISTRAL_API_KEY``.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+DEFAULT_BASE_URL = "https://api.mistral.ai/v1"
+
+DEFAULT_CHAT_MODEL = "mistral-small-latest"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class MistralAPIError(RuntimeError):
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def _messages(messages):
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return messages
+
+
+class MistralClient:
+    def __init__(
+        self,
+        api_key=None,
+        base_url=None,
+        timeout=60.0,
+        max_retries=8,
+        backoff=0.5,
+        max_backoff=30.0,
+        max_connections=64,
+        max_batch_size=128,
+    ):
+        self.api_key = api_key or os.environ.get("MISTRAL_API_KEY", "")
+        self.base_url = base_url or os.environ.get("MISTRAL_BASE_URL", DEFAULT_BASE_URL)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self.max_batch_size = max_batch_size
+        self.requests = 0
+        self.retries = 0
+
+        self._client = None
+        # event loop -> its pooled async client
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries}
+
+    def _client_kwargs(self):
+        if not self.api_key:
+            raise MistralAPIError("no API key, set MISTRAL_API_KEY")
+        return {
+            "base_url": self.base_url,
+            "headers": {"Authorization": f"Bearer {self.api_key}"},
+            "timeout": self.timeout,
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        }
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_kwargs())
+            return self._client
+
+    @property
+    def async_client(self):
+        """
+        Pooled client of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    **self._client_kwargs()
+                )
+            return client
+
+    def _delay(self, attempt, response):
+        """
+        Seconds to wait before retrying: the ``Retry-After`` of the response if
+        any, otherwise an exponential backoff with full jitter.
+        """
+        retry_after = (
+            response.headers.get("Retry-After") if response is not None else None
+        )
+        if retry_after is not None:
+            try:
+                return float(retry_after) * (1 + random.random() / 2)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _should_retry(self, attempt, response=None):
+        if attempt >= self.max_retries:
+            return False
+        return response is None or response.status_code in RETRY_STATUSES
+
+    @staticmethod
+    def _result(response):
+        if response.status_code != 200:
+            raise MistralAPIError(
+                f"request failed with {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code,
+                body=response.text,
+            )
+        return response.json()
+
+    def post(self, path, payload):
+        """
+        POSTs ``payload`` to ``path`` (e.g. ``"/chat/completions"``) and
+        returns the JSON response, retrying rate limits and server errors.
+        """
+        for attempt in range(self.max_retries + 1):
+            response = None
+            self.requests += 1
+            try:
+                response = self.client.post(path, json=payload)
+            except httpx.TransportError:
+                if not self._should_retry(attempt):
+                    raise
+            else:
+                if (
+                    not self._should_retry(attempt, response)
+                    or response.status_code == 200
+                ):
+                    return self._result(response)
+            self.retries += 1
+            time.sleep(self._delay(attempt, response))
+
+    async def apost(self, path, payload):
+        for attempt in range(self.max_retries + 1):
+            response = None
+            self.requests += 1
+            try:
+                response = await self.async_client.post(path, json=payload)
+            except httpx.TransportError:
+                if not self._should_retry(attempt):
+                    raise
+            else:
+                if (
+                    not self._should_retry(attempt, response)
+                    or response.status_code == 200
+                ):
+                    return self._result(response)
+            self.retries += 1
+            await asyncio.sleep(self._delay(attempt, response))
+
+    @staticmethod
+    def _chat_payload(messages, model, params):
+        return {"model": model, "messages": _messages(messages), **params}
+
+    @staticmethod
+    def _content(result):
+        return result["choices"][0]["message"]["content"]
+
+    def chat(self, messages, model=DEFAULT_CHAT_MODEL, **params):
+        """
+        Returns the reply to ``messages``, a prompt or a list of ``{"role",
+        "content"}`` dicts. ``params`` are the other request fields, e.g.
+        ``max_tokens`` or ``temperature``.
+        """
+        result = self.post(
+            "/chat/completions", self._chat_payload(messages, model, params)
+        )
+        return self._content(result)
+
+    async def achat(self, messages, model=DEFAULT_CHAT_MODEL, **params):
+        result = await self.apost(
+            "/chat/completions", self._chat_payload(messages, model, params)
+        )
+        return self._content(result)
+
+    def chat_many(
+        self, conversations, max_concurrency=8, model=DEFAULT_CHAT_MODEL, **params
+    ):
+        """
+        Returns the replies to ``conversations``, sent ``max_concurrency`` at
+        a time over the pooled connections.
+        """
+        with ThreadPoolExecutor(max_concurrency) as executor:
+            return list(
+                executor.map(
+                    lambda messages: self.chat(messages, model, **params), conversations
+                )
+            )
+
+    async def achat_many(
+        self, conversations, max_concurrency=8, model=DEFAULT_CHAT_MODEL, **params
+    ):
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def achat(messages):
+            async with semaphore:
+                return await self.achat(messages, model, **params)
+
+        return await asyncio.gather(*(achat(messages) for messages in conversations))
+
+    def _embeddings(self, result, texts):
+        data = sorted(result["data"], key=lambda item: item["index"])
+        if len(data) != len(texts):
+            raise MistralAPIError(f"got {len(data)} embeddings for {len(texts)} texts")
+        return [item["embedding"] for item in data]
+
+    def embed(self, texts, model="mistral-embed"):
+        """
+        Returns the embeddings of ``texts``, requested ``max_batch_size`` at a
+        time.
+        """
+        vectors = []
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = texts[i : i + self.max_batch_size]
+            result = self.post("/embeddings", {"model": model, "input": batch})
+            vectors.extend(self._embeddings(result, batch))
+        return vectors
+
+    async def aembed(self, texts, model="mistral-embed"):
+        vectors = []
+        for i in range(0, len(texts), self.max_batch_size):
+            batch = texts[i : i + self.max_batch_size]
+            result = await self.apost("/embeddings", {"model": model, "input": batch})
+            vectors.extend(self._embeddings(result, batch))
+        return vectors
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """
+    Client shared by the modules of the project, configured from the
+    environment.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = MistralClient()
+        return _default_client
@@ -0,0 +1,92 @@
+"""
+In-process query router.
+
+Questions are routed to the "simple" (EHR only) or "complex" (RAG) branch by a
+nearest-centroid classifier over their embeddings, trained from a labelled
+JSONL file of ``{"question": ..., "label": "simple" | "complex"}`` records.
+The query embedding is the one the retriever needs anyway, so with a cached
+embedding model routing costs no extra round-trip.
+"""
+
+import json
+
+import numpy as np
+
+
+LABELS = ("simple", "complex")
+
+
+def load_labelled_questions(path):
+    """
+    Reads ``(question, label)`` pairs from a JSONL file.
+    """
+    questions, labels = [], []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["label"] not in LABELS:
+                raise ValueError(f"Unknown label {record['label']!r} in {path}")
+            questions.append(record["question"])
+            labels.append(record["label"])
+    return questions, labels
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingRouter:
+    """
+    Nearest-centroid classifier over normalised query embeddings.
+
+    The confidence of a prediction is the cosine-similarity margin between the
+    closest and the second closest centroid; callers escalate to the LLM router
+    when it is below ``threshold``.
+    """
+
+    def __init__(self, embeddings, threshold=0.02):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.labels = []
+        self.centroids = None
+
+    def fit(self, questions, labels):
+        vectors = _normalize(self.embeddings.embed_documents(list(questions)))
+        labels = np.asarray(labels)
+        self.labels = [label for label in LABELS if (labels == label).any()]
+        if len(self.labels) < 2:
+            raise ValueError("The router needs examples of both routes")
+        self.centroids = _normalize(
+            np.stack([vectors[labels == label].mean(axis=0) for label in self.labels])
+        )
+        return self
+
+    @classmethod
+    def from_file(cls, path, embeddings, threshold=0.02):
+        questions, labels = load_labelled_questions(path)
+        return cls(embeddings, threshold=threshold).fit(questions, labels)
+
+    def predict_vector(self, vector):
+        """
+        Returns ``(label, confidence)`` for an already embedded query.
+        """
+        similarities = self.centroids @ _normalize(vector)
+        order = np.argsort(-similarities)
+        confidence = float(similarities[order[0]] - similarities[order[1]])
+        return self.labels[order[0]], confidence
+
+    def predict(self, question):
+        return self.predict_vector(self.embeddings.embed_query(question))
+
+    def route(self, question):
+        """
+        Returns the predicted label, or ``None`` when the prediction is not
+        confident enough and the LLM router should decide.
+        """
+        label, confidence = self.predict(question)
+        return label if confidence >= self.threshold else None
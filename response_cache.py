@@ -0,0 +1,184 @@
+"""
+Cache of complete chatbot responses.
+
+Entries expire after ``ttl`` seconds and the least recently used ones are
+evicted beyond ``max_items``. Concurrent requests for a key that is being
+computed wait for that computation instead of starting their own
+(single-flight), from threads as well as from coroutines.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_question(question):
+    """
+    Lower-cases the question, collapses whitespace and drops trailing
+    punctuation so trivially different spellings share an entry.
+    """
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+def response_key(question, ehr_hash, index_version, model_settings, history=""):
+    payload = json.dumps(
+        {
+            "question": normalize_question(question),
+            "history": history,
+            "ehr": ehr_hash,
+            "index": index_version,
+            "model": model_settings,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_items=256, ttl=3600.0, on_lookup=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        # called with "hit", "miss" or "coalesced" after every lookup
+        self.on_lookup = on_lookup
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        # computations of aget_or_compute, referenced until they are done
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "items": len(self._entries),
+        }
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def _looked_up(self, result):
+        if self.on_lookup is not None:
+            self.on_lookup(result)
+
+    def get(self, key):
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._looked_up("miss" if value is None else "hit")
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def claim(self, key):
+        """
+        Returns ``(value, future, owner)``: the cached value if any, otherwise
+        the future of the computation for ``key`` and whether the caller owns
+        it. The owner has to compute the value and ``settle`` the future,
+        whatever happens; the others wait for the future.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                future, owner = None, False
+            elif key in self._in_flight:
+                self.coalesced += 1
+                future, owner = self._in_flight[key], False
+            else:
+                self.misses += 1
+                future, owner = Future(), True
+                self._in_flight[key] = future
+        self._looked_up("hit" if future is None else "miss" if owner else "coalesced")
+        return value, future, owner
+
+    def settle(self, key, future, value=None, error=None):
+        """
+        Ends the computation claimed for ``key``, caching ``value`` unless it
+        failed with ``error``.
+        """
+        with self._lock:
+            if error is None:
+                self._put(key, value)
+            del self._in_flight[key]
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for ``key``, computing it with ``compute()``
+        unless another thread already is.
+        """
+        value, future, owner = self.claim(key)
+        if future is None:
+            return value
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            self.settle(key, future, error=e)
+            raise
+        self.settle(key, future, value=value)
+        return value
+
+    async def aget_or_compute(self, key, acompute):
+        """
+        Async version of ``get_or_compute``, ``acompute()`` returns an awaitable.
+        The computation runs in its own task, so a cancelled owner (e.g. a
+        client that went away) does not cancel it for the callers waiting on
+        the same key.
+        """
+        value, future, owner = self.claim(key)
+        if future is None:
+            return value
+        if not owner:
+            return await asyncio.wrap_future(future)
+
+        task = asyncio.ensure_future(acompute())
+        self._tasks.add(task)
+
+        def settle(task):
+            self._tasks.discard(task)
+            if task.cancelled():
+                error = RuntimeError(f"computation of {key} was cancelled")
+                self.settle(key, future, error=error)
+            elif task.exception() is not None:
+                self.settle(key, future, error=task.exception())
+            else:
+                self.settle(key, future, value=task.result())
+
+        task.add_done_callback(settle)
+        return await asyncio.shield(task)
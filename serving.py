@@ -0,0 +1,160 @@
+"""
+Concurrent serving of one ``MistralChatbot`` to many patients.
+
+The chatbot, with its index, caches and LLM clients, is shared by every
+session and only read by turns; what belongs to one conversation is kept in a
+``ChatSession``. Turns run on the server's event loop through the async
+chatbot methods, behind an admission control: at most ``max_concurrency``
+turns run at once, up to ``max_queue`` more wait for a slot, and any further
+turn is rejected right away with ``Overloaded`` rather than queueing behind
+the others.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+class AdmissionControl:
+    def __init__(self, max_concurrency=8, max_queue=32, queue_timeout=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # seconds a turn may wait for a slot before it is rejected
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    async def acquire(self):
+        """
+        Waits for a slot, or raises ``Overloaded`` when the queue is full or
+        the slot does not come within ``queue_timeout``.
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.active} turns running and {self.waiting} waiting")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(f"no slot within {self.queue_timeout}s") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class ChatSession:
+    """
+    State of one conversation, the shared chatbot keeps none. Its memory of
+    the conversation is bounded (see ``conversation_memory``).
+    """
+
+    def __init__(self, session_id, patient_id=None, memory=None):
+        self.session_id = session_id
+        self.patient_id = patient_id
+        self.memory = memory
+        self.turns = 0
+        self.last_timings = {}
+        self.last_used = time.monotonic()
+
+
+class ChatServer:
+    def __init__(
+        self,
+        chatbot,
+        max_concurrency=8,
+        max_queue=32,
+        queue_timeout=None,
+        max_sessions=10000,
+    ):
+        self.chatbot = chatbot
+        self.admission = AdmissionControl(max_concurrency, max_queue, queue_timeout)
+        # least recently used sessions are dropped beyond max_sessions
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+    @property
+    def stats(self):
+        return {**self.admission.stats, "sessions": len(self.sessions)}
+
+    def session(self, session_id, patient_id=None):
+        """
+        Returns the session ``session_id``, created on first use. Passing a
+        ``patient_id`` binds the session to that patient's EHR.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = ChatSession(
+                session_id, patient_id, self.chatbot.new_memory()
+            )
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        elif patient_id is not None:
+            session.patient_id = patient_id
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def astream(self, session_id, question, patient_id=None):
+        """
+        Yields the ``StreamEvent``s of a turn of the session. The slot is
+        released with the metrics event, a background grade that follows
+        does not hold it.
+        """
+        session = self.session(session_id, patient_id)
+        await self.admission.acquire()
+        admitted = True
+        try:
+            async for event in self.chatbot.astream_once(
+                question, session.patient_id, session.memory
+            ):
+                if event.kind == "metrics":
+                    session.turns += 1
+                    session.last_timings = event.data
+                    self.admission.release()
+                    admitted = False
+                yield event
+        finally:
+            if admitted:
+                self.admission.release()
+
+    async def arun(self, session_id, question, patient_id=None):
+        """
+        Returns the answer and suggested questions of a turn of the session.
+        """
+        session = self.session(session_id, patient_id)
+        async with self.admission:
+            response = await self.chatbot.arun_once(
+                question, session.patient_id, session.memory
+            )
+        session.turns += 1
+        return response
@@ -0,0 +1,337 @@
+"""
+Vector index split into shards per audience and guideline topic.
+
+Every corpus (one per audience, e.g. "patient" and "doctor") is split by the
+topic of its source documents, found from their file names (``bone.pdf``,
+``colon-patient.pdf``, ...), and every ``(audience, topic)`` pair is its own
+``vector_index`` index named ``<audience>-<topic>``. A small catalog per
+audience, ``<audience>.shards.json``, records the topics of the corpus so a
+start only hashes the corpus files; shards are synced and loaded on first
+use, and a query only searches the shards of its audience and topics.
+
+Shards are searched in one of the ``RETRIEVAL_MODES``:
+
+    - "vector": dense search, which needs the embedding of the query,
+    - "bm25": lexical search with the BM25 index of every shard,
+    - "hybrid": both, fused by reciprocal rank,
+    - "auto": BM25 alone when its best chunk contains a rare term of the
+      query (a drug or procedure name), "hybrid" otherwise.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from bm25_index import tokenize
+from vector_index import file_sha256, sync_index
+
+
+# keywords of every topic, matched against source file names and questions
+TOPICS = {
+    "bone": ("bone", "osteosarcoma", "ewing", "chondrosarcoma"),
+    "breast": ("breast", "mastectomy", "lumpectomy"),
+    "colon": ("colon", "colorectal", "rectal", "rectum", "bowel"),
+}
+
+# topic of the documents matching none of ``TOPICS``
+GENERAL_TOPIC = "general"
+
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid", "auto")
+
+_TOPIC_PATTERNS = {
+    topic: re.compile(r"\b(?:" + "|".join(keywords) + r")", re.IGNORECASE)
+    for topic, keywords in TOPICS.items()
+}
+
+
+def detect_topics(text):
+    """
+    Returns the topics mentioned in ``text``, in ``TOPICS`` order.
+    """
+    return [topic for topic, pattern in _TOPIC_PATTERNS.items() if pattern.search(text)]
+
+
+def source_topic(source):
+    """
+    Returns the topic of a source document from its file name.
+    """
+    name = re.sub(r"[_\-.]", " ", os.path.basename(source))
+    topics = detect_topics(name)
+    return topics[0] if topics else GENERAL_TOPIC
+
+
+def reciprocal_rank_fusion(rankings, k, offset=60):
+    """
+    Fuses ranked lists of documents by the sum of ``1 / (offset + rank)`` over
+    the lists containing them, documents being identified by their chunk id.
+    """
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            id_ = document.metadata["id"]
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (offset + rank + 1)
+            documents[id_] = document
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[id_] for id_ in best]
+
+
+class ShardedIndex:
+    """
+    Lazily synced shards of the corpora ``{audience: corpus_path}``.
+
+    ``load_documents(corpus_path)`` yields the documents of a corpus and
+    ``split_documents(documents)`` chunks them, as in ``sync_index``.
+    """
+
+    def __init__(
+        self,
+        index_root,
+        key,
+        embedding,
+        corpora,
+        load_documents,
+        split_documents,
+        info=None,
+        search_backend="exact",
+        search_params=None,
+        bm25_min_idf=4.0,
+        debug=False,
+    ):
+        self.index_root = index_root
+        self.key = key
+        self.embedding = embedding
+        self.corpora = corpora
+        self.load_documents = load_documents
+        self.split_documents = split_documents
+        self.info = info or {}
+        self.search_backend = search_backend
+        self.search_params = search_params
+        # idf of a term in ~2% of the chunks, rarer terms make BM25 confident
+        self.bm25_min_idf = bm25_min_idf
+        self.debug = debug
+
+        self._shards = {}
+        # futures of the shards being built, by (audience, topic)
+        self._building = {}
+        self._lock = threading.Lock()
+        self._stats = {mode: [0, 0, 0.0] for mode in RETRIEVAL_MODES}
+
+        os.makedirs(index_root, exist_ok=True)
+        self.catalogs = {
+            audience: self._sync_catalog(audience, corpus_path)
+            for audience, corpus_path in corpora.items()
+        }
+
+    @property
+    def version(self):
+        """
+        Identifies the indexed content: the key and the hash of every corpus.
+        """
+        corpus_hashes = json.dumps(
+            {
+                audience: catalog["corpus_hash"]
+                for audience, catalog in self.catalogs.items()
+            },
+            sort_keys=True,
+        )
+        return f"{self.key}-{hashlib.sha256(corpus_hashes.encode()).hexdigest()[:16]}"
+
+    @property
+    def loaded_shards(self):
+        return sorted(self._shards)
+
+    @property
+    def stats(self):
+        """
+        Number of queries, hit rate and mean latency of every retrieval mode.
+        A hit is a query with results, or for "auto" one answered by BM25
+        alone.
+        """
+        with self._lock:
+            return {
+                mode: {
+                    "queries": queries,
+                    "hit_rate": hits / queries if queries else None,
+                    "mean_latency_ms": 1e3 * seconds / queries if queries else None,
+                }
+                for mode, (queries, hits, seconds) in self._stats.items()
+            }
+
+    def _sync_catalog(self, audience, corpus_path):
+        """
+        Returns the catalog of the corpus of ``audience``, scanning the corpus
+        for the topics of its documents only when it changed.
+        """
+        path = os.path.join(self.index_root, f"{audience}.shards.json")
+        corpus_hash = file_sha256(corpus_path)
+        keywords = {topic: list(words) for topic, words in TOPICS.items()}
+        if os.path.exists(path):
+            with open(path) as f:
+                catalog = json.load(f)
+            if (
+                catalog["corpus_hash"] == corpus_hash
+                and catalog["keywords"] == keywords
+            ):
+                return catalog
+
+        topics = {}
+        for document in self.load_documents(corpus_path):
+            topic = source_topic(document.metadata["source"])
+            topics[topic] = topics.get(topic, 0) + 1
+        catalog = {
+            "corpus": corpus_path,
+            "corpus_hash": corpus_hash,
+            "keywords": keywords,
+            "topics": topics,
+        }
+        with open(path, "w") as f:
+            json.dump(catalog, f, indent=2)
+        if self.debug:
+            print("shard catalog", audience, topics)
+        return catalog
+
+    def topics(self, audience):
+        return list(self.catalogs[audience]["topics"])
+
+    def shard(self, audience, topic):
+        """
+        Returns the vector store of a shard, synced with its corpus on first
+        use. Only the callers of a shard being built wait for it.
+        """
+        key = (audience, topic)
+        with self._lock:
+            vectorstore = self._shards.get(key)
+            if vectorstore is not None:
+                return vectorstore
+            future = self._building.get(key)
+            owner = future is None
+            if owner:
+                future = self._building[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            vectorstore = self._build_shard(audience, topic)
+        except BaseException as error:
+            with self._lock:
+                del self._building[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            self._shards[key] = vectorstore
+            del self._building[key]
+        future.set_result(vectorstore)
+        return vectorstore
+
+    def _build_shard(self, audience, topic):
+        corpus_path = self.corpora[audience]
+
+        def load_documents():
+            for document in self.load_documents(corpus_path):
+                if source_topic(document.metadata["source"]) == topic:
+                    yield document
+
+        vectorstore, status = sync_index(
+            self.index_root,
+            f"{audience}-{topic}",
+            self.key,
+            embedding=self.embedding,
+            corpus_path=corpus_path,
+            load_documents=load_documents,
+            split_documents=self.split_documents,
+            search_backend=self.search_backend,
+            search_params=self.search_params,
+            info={
+                **self.info,
+                "corpus": corpus_path,
+                "audience": audience,
+                "topic": topic,
+            },
+        )
+        if self.debug:
+            print("shard", audience, topic, status, len(vectorstore), "chunks")
+        return vectorstore
+
+    def select(self, audience, topics=None):
+        """
+        Returns the topics of ``audience`` to search: the indexed ones among
+        ``topics`` plus the general shard, or every shard when none of
+        ``topics`` is indexed.
+        """
+        indexed = self.topics(audience)
+        selected = [topic for topic in topics or () if topic in indexed]
+        if not selected:
+            return indexed
+        if GENERAL_TOPIC in indexed:
+            selected.append(GENERAL_TOPIC)
+        return selected
+
+    def vector_search(self, query, shards, k):
+        query_vector = self.embedding.embed_query(query)
+        results = [
+            result
+            for shard in shards
+            for result in shard.similarity_search_by_vector_with_score(
+                query_vector, k=k
+            )
+        ]
+        # cosine distances, lower is better
+        results.sort(key=lambda result: result[1])
+        return [document for document, _ in results[:k]]
+
+    def keyword_search(self, query, shards, k):
+        """
+        Returns the ``k`` best BM25 chunks and whether the search is
+        confident: the best chunk of a shard contains a rare query term.
+        """
+        results, confident = [], False
+        query_terms = set(tokenize(query))
+        for shard in shards:
+            shard_results = shard.keyword_search_with_score(query, k=k)
+            if shard_results:
+                best_terms = query_terms & set(
+                    tokenize(shard_results[0][0].page_content)
+                )
+                confident |= any(
+                    shard.bm25.term_idf(term) >= self.bm25_min_idf
+                    for term in best_terms
+                )
+            results.extend(shard_results)
+        results.sort(key=lambda result: result[1], reverse=True)
+        return [document for document, _ in results[:k]], confident
+
+    def search(self, query, audience, topics=None, k=4, mode="vector"):
+        """
+        Returns the ``k`` chunks closest to ``query`` in the selected shards,
+        searched in ``mode`` (one of ``RETRIEVAL_MODES``).
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(
+                f"Unknown retrieval mode {mode!r}, use one of {RETRIEVAL_MODES}"
+            )
+        start = time.perf_counter()
+        shards = [
+            self.shard(audience, topic) for topic in self.select(audience, topics)
+        ]
+        if mode == "vector":
+            docs = self.vector_search(query, shards, k)
+            hit = bool(docs)
+        else:
+            docs, hit = self.keyword_search(query, shards, k)
+            if mode == "bm25":
+                hit = bool(docs)
+            elif mode == "hybrid" or not hit:
+                vector_docs = self.vector_search(query, shards, k)
+                docs = reciprocal_rank_fusion([docs, vector_docs], k)
+                hit = bool(docs) if mode == "hybrid" else False
+
+        with self._lock:
+            stats = self._stats[mode]
+            stats[0] += 1
+            stats[1] += hit
+            stats[2] += time.perf_counter() - start
+        return docs
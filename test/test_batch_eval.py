@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from batch_eval import read_questions, run_batch
+from langchain_core.documents import Document
+
+
+class StubChatbot:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.asked = []
+        self.running = 0
+        self.max_running = 0
+
+    async def arun_turn(self, turn):
+        self.asked.append(turn.question)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        if turn.question in self.fail:
+            raise RuntimeError("rate limited")
+        turn.route = "complex"
+        turn.docs = [Document(page_content="text", metadata={"source": "bone.pdf"})]
+        turn.answer = f"answer to {turn.question}"
+        turn.timings["total"] = 0.01
+        return turn
+
+
+def write_questions(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(json.dumps({"question": f"q{i}", "patient_id": "p1"}) + "\n")
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_questions_run_with_bounded_concurrency(tmp_path):
+    write_questions(tmp_path / "questions.jsonl", 20)
+    questions = read_questions(tmp_path / "questions.jsonl")
+    chatbot = StubChatbot()
+    counts = asyncio.run(run_batch(chatbot, questions, tmp_path / "out.jsonl", 4))
+
+    assert counts == {"answered": 20, "failed": 0, "skipped": 0}
+    assert chatbot.max_running == 4
+    records = read_records(tmp_path / "out.jsonl")
+    assert sorted(record["id"] for record in records) == sorted(
+        str(i) for i in range(1, 21)
+    )
+    assert records[0]["sources"] == ["bone.pdf"]
+    assert records[0]["patient_id"] == "p1"
+    assert records[0]["answer"] == f"answer to {records[0]['question']}"
+
+
+def test_runs_resume_and_retry_failures(tmp_path):
+    write_questions(tmp_path / "questions.jsonl", 6)
+    questions = read_questions(tmp_path / "questions.jsonl")
+    output = tmp_path / "out.jsonl"
+    counts = asyncio.run(run_batch(StubChatbot(fail={"q2"}), questions[:4], output, 2))
+    assert counts == {"answered": 3, "failed": 1, "skipped": 0}
+    # an interrupted write leaves half a line
+    with open(output, "a") as f:
+        f.write('{"id": "5", "answ')
+
+    chatbot = StubChatbot()
+    counts = asyncio.run(run_batch(chatbot, questions, output, 2))
+    assert counts == {"answered": 3, "failed": 0, "skipped": 3}
+    assert sorted(chatbot.asked) == ["q2", "q4", "q5"]
+    records = read_records(output)
+    assert len(records) == 7
+    assert {record["id"] for record in records if "error" not in record} == {
+        str(i) for i in range(1, 7)
+    }
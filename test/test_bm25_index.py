@@ -0,0 +1,25 @@
+import numpy as np
+from bm25_index import BM25Index
+
+
+def test_bm25_ranks_and_roundtrips(tmp_path):
+    texts = [
+        "Ondansetron prevents nausea during chemotherapy",
+        "Chemotherapy can cause nausea and fatigue",
+        "Lisinopril treats hypertension",
+        "Exercise helps with fatigue",
+    ]
+    index = BM25Index().fit(texts)
+    indices, scores = index.search("Is ondansetron good for nausea?", k=3)
+    assert indices.tolist() == [0, 1]
+    assert scores[0] > scores[1] > 0
+    assert index.term_idf("ondansetron") > index.term_idf("nausea") > 0
+    assert index.term_idf("unknown") == 0
+
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    loaded_indices, loaded_scores = loaded.search(
+        "Is ondansetron good for nausea?", k=3
+    )
+    assert loaded_indices.tolist() == [0, 1]
+    np.testing.assert_allclose(loaded_scores, scores)
@@ -0,0 +1,43 @@
+import mistral_client
+import pytest
+from classify_question import (
+    classify_patient_question_with_ehr,
+    classify_patient_questions_with_ehr,
+    parse_classification,
+)
+from fake_mistral_server import FakeMistralServer
+from mistral_client import MistralClient
+from suggestions import get_suggested_questions
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    with FakeMistralServer(reply_words=1) as server:
+        client = MistralClient(api_key="fake", base_url=server.url, max_retries=0)
+        monkeypatch.setattr(mistral_client, "_default_client", client)
+        yield server
+
+
+def test_parse_classification():
+    assert parse_classification(" 1\n") == 1
+    assert parse_classification("0") == 0
+    assert parse_classification("maybe") == "Unexpected response: maybe"
+
+
+def test_batches_keep_the_shared_pool_open(fake_server):
+    questions = [f"question {i}" for i in range(6)]
+    first = classify_patient_questions_with_ehr(questions, "EHR", max_concurrency=3)
+    connections = fake_server.connections
+    second = classify_patient_questions_with_ehr(questions, "EHR", max_concurrency=3)
+    assert len(first) == len(second) == 6
+    assert all(str(result).startswith("Unexpected response") for result in first)
+    # the second batch reuses the connections of the first one
+    assert fake_server.connections == connections
+
+
+def test_api_errors_are_returned_as_strings(fake_server):
+    fake_server.fail_after = 0
+    assert classify_patient_question_with_ehr("question", "EHR").startswith(
+        "Error: 503, "
+    )
+    assert get_suggested_questions("history", "context").startswith("Error: 503, ")
@@ -0,0 +1,76 @@
+from context_packer import pack_context
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_overlapping_chunks_are_merged_and_duplicates_dropped():
+    text = " ".join(f"word{i}" for i in range(60))
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=120, chunk_overlap=40, add_start_index=True
+    )
+    chunks = splitter.split_documents(
+        [Document(page_content=text, metadata={"source": "a"})]
+    )
+    copy = Document(page_content=chunks[0].page_content, metadata={"source": "b"})
+    other = Document(page_content="an unrelated chunk", metadata={"source": "c"})
+
+    # the first three chunks are contiguous, in any retrieval order
+    docs = [chunks[2], other, chunks[0], copy, chunks[1]]
+    context, report = pack_context(docs, count_words)
+    spans = context.split("\n\n")
+    assert spans[0] == " ".join(text.split()[: len(spans[0].split())])
+    assert spans[1] == "an unrelated chunk"
+    assert len(spans) == 2
+    assert report["dropped_duplicates"] == 1
+    assert report["context_tokens_saved"] > 0
+
+    # the best chunk is cut to the budget, nothing else fits
+    context, report = pack_context(docs, count_words, max_tokens=10)
+    assert context == " ".join(chunks[2].page_content.split()[:10])
+    assert report["dropped_over_budget"] == 1
+
+
+def test_over_budget_span_falls_back_to_its_best_chunks():
+    # four adjacent 1000 word chunks with 200 words of overlap, as the
+    # default splitter settings give, merge into a span of 3400 words
+    words = [f"w{i}" for i in range(3400)]
+    chunks = []
+    for n in range(4):
+        text = " ".join(words[800 * n : 800 * n + 1000])
+        start = len(" ".join(words[: 800 * n])) + (1 if n else 0)
+        metadata = {"source": "a", "start_index": start}
+        chunks.append(Document(page_content=text, metadata=metadata))
+    docs = [chunks[2], chunks[1], chunks[3], chunks[0]]
+
+    context, report = pack_context(docs, count_words, max_tokens=3000)
+    assert count_words(context) <= 3000
+    assert chunks[2].page_content in context
+    assert chunks[1].page_content in context
+    assert report["trimmed_over_budget"] == 1
+    assert report["context_tokens"] > 0
+
+    # the best chunk is kept, cut, when it does not fit on its own
+    context, report = pack_context(docs, count_words, max_tokens=500)
+    assert context == " ".join(chunks[2].page_content.split()[:500])
+
+
+def test_separators_count_in_the_budget():
+    def count_tokens(text):
+        # the separator is a token of its own
+        return len(text.split()) + text.count("\n\n")
+
+    docs = [
+        Document(
+            page_content=" ".join(f"{source}{i}" for i in range(10)),
+            metadata={"source": source},
+        )
+        for source in "abc"
+    ]
+    context, report = pack_context(docs, count_tokens, max_tokens=30)
+    assert report["context_tokens"] == count_tokens(context) <= 30
+    assert report["spans"] == 2
+    assert report["dropped_over_budget"] == 1
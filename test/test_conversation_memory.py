@@ -0,0 +1,80 @@
+import threading
+
+from conversation_memory import ConversationMemory, truncate_tokens
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_truncate_tokens():
+    assert truncate_tokens("a b c d e", 3, count_words) == "a b c"
+    assert truncate_tokens("a b", 3, count_words) == "a b"
+
+
+def test_old_turns_are_folded_into_the_summary():
+    memory = ConversationMemory(count_words, max_turns=2, max_tokens=100)
+    assert memory.render() == ""
+    calls = []
+
+    def summarize(summary, turns):
+        calls.append(turns)
+        return " ".join([summary] + [turn.split("\n")[0] for turn in turns]).strip()
+
+    assert not memory.add("q1", "a1")
+    assert not memory.add("q2", "a2")
+    assert memory.add("q3", "a3")
+    memory.fold(summarize)
+    assert memory.add("q4", "a4")
+    memory.fold(summarize)
+
+    assert calls == [["Patient: q1\nAssistant: a1"], ["Patient: q2\nAssistant: a2"]]
+    assert memory.summary == "Patient: q1 Patient: q2"
+    assert memory.render() == (
+        "Conversation so far:\n"
+        "Summary of the earlier conversation: Patient: q1 Patient: q2\n"
+        "Patient: q3\nAssistant: a3\n"
+        "Patient: q4\nAssistant: a4"
+    )
+
+
+def test_history_stays_within_budget():
+    memory = ConversationMemory(count_words, max_turns=4, max_tokens=30)
+    for i in range(4):
+        memory.add(f"question {i}", " ".join(["word"] * 12))
+    memory.summary = " ".join(["summary"] * 10)
+    history = memory.render()
+    assert count_words(history) <= 30
+    # the summary and the most recent turn come first, older turns are left out
+    assert "summary" in history
+    assert "question 3" in history
+    assert "question 0" not in history
+
+    memory.add("long", " ".join(["word"] * 100))
+    assert count_words(memory.turns[-1]) == 30
+    assert count_words(memory.render()) <= 30
+
+
+def test_pending_turns_are_bounded_while_summarizing():
+    memory = ConversationMemory(count_words, max_turns=2, max_tokens=50)
+    release = threading.Event()
+
+    def summarize(summary, turns):
+        release.wait()
+        return "summary"
+
+    memory.add("q0", "a")
+    memory.add("q1", "a")
+    assert memory.add("q2", "a")
+    folding = threading.Thread(target=memory.fold, args=(summarize,))
+    folding.start()
+    # the summarizer lags behind, new turns do not start another one
+    for i in range(3, 10):
+        assert not memory.add(f"q{i}", "a")
+    assert len(memory.turns) == 2
+    assert len(memory.pending) == 2
+    release.set()
+    folding.join()
+    assert not memory.summarizing
+    assert not memory.pending
+    assert memory.dropped == 5
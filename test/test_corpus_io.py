@@ -0,0 +1,29 @@
+import json
+
+from corpus_io import convert_json_corpus, CorpusWriter, iter_corpus_documents
+
+
+def test_jsonl_documents_match_legacy_json(tmp_path):
+    legacy = tmp_path / "dataset.json"
+    data = {
+        "bone.pdf": {"url": "pdf_data/bone.pdf", "text": "page one page two"},
+        "colon.pdf": {"url": "pdf_data/colon.pdf", "text": "only page"},
+    }
+    legacy.write_text(json.dumps(data, indent=2))
+
+    corpus = tmp_path / "corpus.jsonl.gz"
+    with CorpusWriter(str(corpus)) as writer:
+        writer.write("pdf_data/bone.pdf", 0, "page one")
+        writer.write("pdf_data/bone.pdf", 1, "page two")
+        writer.write("pdf_data/colon.pdf", 0, "only page")
+
+    expected = list(iter_corpus_documents(str(legacy)))
+    assert [doc.metadata["source"] for doc in expected] == [
+        "pdf_data/bone.pdf",
+        "pdf_data/colon.pdf",
+    ]
+    assert list(iter_corpus_documents(str(corpus))) == expected
+
+    converted = tmp_path / "converted.jsonl"
+    convert_json_corpus(str(legacy), str(converted))
+    assert list(iter_corpus_documents(str(converted))) == expected
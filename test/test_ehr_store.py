@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from ehr_store import EHRStore
+
+
+TEMPLATE = """EHR: {ehr}
+
+Question: {question}
+
+Answer in {{3}} sentences:"""
+
+
+def write(path, text, mtime_ns=None):
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_render_matches_template(tmp_path):
+    write(tmp_path / "p1.txt", "breast cancer, stage II")
+    store = EHRStore(ehr_dir=str(tmp_path), templates={"simple": TEMPLATE})
+
+    rendered = store.render("simple", "Is it curable?", "p1")
+    assert rendered == TEMPLATE.format(
+        ehr="breast cancer, stage II", question="Is it curable?"
+    )
+    assert (
+        store.get("p1").prefixes["simple"]
+        == "EHR: breast cancer, stage II\n\nQuestion: "
+    )
+
+
+def test_cache_invalidation(tmp_path):
+    path = tmp_path / "p1.txt"
+    write(path, "first record", mtime_ns=1_000_000_000)
+    store = EHRStore(ehr_dir=str(tmp_path), templates={"simple": TEMPLATE})
+
+    first = store.get("p1")
+    assert store.get("p1") is first
+    assert store.stats == {"loads": 1, "hits": 1, "items": 1}
+
+    # touched with the same content: re-read, same hash and prefixes
+    write(path, "first record", mtime_ns=2_000_000_000)
+    touched = store.get("p1")
+    assert touched.sha256 == first.sha256
+    assert touched.prefixes is first.prefixes
+
+    write(path, "second record", mtime_ns=3_000_000_000)
+    changed = store.get("p1")
+    assert changed.sha256 != first.sha256
+    assert "second record" in store.render("simple", "?", "p1")
+    assert store.stats["loads"] == 3
+
+
+def test_lru_and_unknown_patients(tmp_path):
+    for patient_id in ["a", "b", "c"]:
+        write(tmp_path / f"{patient_id}.txt", patient_id)
+    default = tmp_path / "ehr_context.txt"
+    write(default, "default record")
+    store = EHRStore(
+        ehr_dir=str(tmp_path), paths={"default": str(default)}, max_items=2
+    )
+
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert list(store._records) == ["a", "c"]
+    assert store.get().text == "default record"
+
+    for patient_id in ["missing", "../a"]:
+        with pytest.raises(KeyError):
+            store.get(patient_id)
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import CachedEmbeddings
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    n_embedded: int = 0
+
+    def embed_documents(self, texts):
+        self.n_embedded += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.n_embedded += 1
+        return super().embed_query(text)
+
+
+def test_only_new_texts_are_embedded(tmp_path):
+    inner = CountingEmbeddings(size=8)
+    cache = CachedEmbeddings(inner, model="fake", cache_dir=str(tmp_path))
+    first = cache.embed_documents(["a", "b", "a"])
+    assert inner.n_embedded == 2
+    assert first[0] == first[2]
+
+    cache.embed_documents(["a", "b", "c"])
+    assert inner.n_embedded == 3
+    cache.embed_query("c")
+    assert inner.n_embedded == 3
+    assert cache.stats["misses"] == 3
+
+    # a new process only has the disk tier
+    cache.close()
+    reopened = CachedEmbeddings(inner, model="fake", cache_dir=str(tmp_path))
+    assert reopened.embed_query("b") == cache.embed_documents(["b"])[0]
+    assert reopened.stats["disk_hits"] == 1
+    assert inner.n_embedded == 3
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    inner = CountingEmbeddings(size=8)
+    # room for two float32 vectors of size 8
+    cache = CachedEmbeddings(
+        inner,
+        model="fake",
+        cache_dir=str(tmp_path),
+        max_disk_bytes=64,
+        max_memory_items=1,
+    )
+    cache.embed_documents(["a", "b", "c"])
+    assert cache.stats["disk_bytes"] <= 64
+    cache.embed_query("a")
+    assert inner.n_embedded == 4
+
+
+def test_concurrent_misses_of_a_query_share_one_call():
+    class SlowEmbeddings(CountingEmbeddings):
+        def embed_query(self, text):
+            time.sleep(0.05)
+            return super().embed_query(text)
+
+    inner = SlowEmbeddings(size=8)
+    lookups = []
+    cache = CachedEmbeddings(
+        inner, model="fake", on_lookup=lambda result, count: lookups.append(result)
+    )
+    with ThreadPoolExecutor(4) as pool:
+        vectors = list(pool.map(cache.embed_query, ["q"] * 4))
+    assert inner.n_embedded == 1
+    assert all(vector == vectors[0] for vector in vectors)
+    assert (
+        cache.stats["misses"] + cache.stats["coalesced"] + cache.stats["memory_hits"]
+        == 4
+    )
+    assert cache.stats["misses"] == 1
+    assert lookups.count("miss") == 1
+    assert len(lookups) == 4
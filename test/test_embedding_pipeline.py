@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import BatchedEmbeddings, EmbeddingRequestError, pack_batches
+from fake_mistral_server import fake_embedding, FakeMistralServer
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+
+def test_pack_batches():
+    texts = ["a" * 30, "b" * 30, "c" * 90, "d" * 3, "e" * 3, "f" * 3]
+    batches = pack_batches(texts, len, max_tokens=60, max_size=2)
+    assert batches == [[0, 1], [2], [3, 4], [5]]
+
+
+def test_rate_limited_requests_are_retried():
+    texts = [f"chunk {i}" for i in range(40)]
+    with FakeMistralServer(dim=8, rate_limit=10) as server:
+        embeddings = BatchedEmbeddings(
+            base_url=server.url, api_key="fake", max_batch_size=2, max_concurrency=8
+        )
+        vectors = embeddings.embed_documents(texts)
+        rate_limited = server.rate_limited
+        assert embeddings.embed_query("question") == pytest.approx(
+            fake_embedding("question", 8)
+        )
+    assert rate_limited > 0
+    assert embeddings.last_run["retries"] == rate_limited
+    assert embeddings.last_run["batches"] == 20
+    assert vectors == [pytest.approx(fake_embedding(text, 8)) for text in texts]
+
+
+def test_interrupted_build_resumes_from_the_cache(tmp_path):
+    texts = [f"chunk {i}" for i in range(20)]
+    with FakeMistralServer(dim=8, fail_after=3) as server:
+        embeddings = BatchedEmbeddings(
+            base_url=server.url,
+            api_key="fake",
+            max_batch_size=2,
+            max_concurrency=1,
+            max_retries=1,
+            backoff=0.001,
+        )
+        cache = CachedEmbeddings(embeddings, cache_dir=str(tmp_path))
+        with pytest.raises(EmbeddingRequestError):
+            cache.embed_documents(texts)
+        cache.close()
+
+        server.fail_after = None
+        server.requests = 0
+        cache = CachedEmbeddings(embeddings, cache_dir=str(tmp_path))
+        vectors = cache.embed_documents(texts)
+    # the 3 batches completed before the failure are not requested again
+    assert server.requests == 7
+    assert vectors == [pytest.approx(fake_embedding(text, 8)) for text in texts]
+
+
+def test_documents_are_embedded_from_a_running_event_loop():
+    async def build(embeddings, texts):
+        # e.g. an index build started from the async pipeline
+        return embeddings.embed_documents(texts)
+
+    with FakeMistralServer(dim=8) as server:
+        embeddings = BatchedEmbeddings(base_url=server.url, api_key="fake")
+        for texts in (["first build"], ["second build"]):
+            vectors = asyncio.run(build(embeddings, texts))
+            assert vectors == [pytest.approx(fake_embedding(texts[0], 8))]
+        embeddings.close()
+
+
+def test_any_embeddings_reporting_batches_are_checkpointed(tmp_path):
+    class Reporting(DeterministicFakeEmbedding):
+        def embed_documents(self, texts, on_batch=None):
+            vectors = super().embed_documents(texts)
+            on_batch(list(range(len(texts) - 1)), vectors[:-1])
+            raise RuntimeError("interrupted")
+
+    cache = CachedEmbeddings(Reporting(size=8), cache_dir=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        cache.embed_documents(["a", "b", "c"])
+    assert cache.stats["disk_bytes"] == 2 * 8 * 4
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import urllib.request
+
+import pytest
+from instrumentation import Histogram, Instrumentation, instrumented
+from langchain_core.messages import AIMessage
+from response_cache import ResponseCache
+
+
+class Pipeline:
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    @instrumented("answer")
+    def answer(self, question):
+        return AIMessage(
+            content="answer",
+            usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15},
+        )
+
+    @instrumented("retrieve")
+    async def aretrieve(self, question):
+        await asyncio.sleep(0)
+        return ["chunk"] * 4
+
+    @instrumented("route")
+    def route(self, question):
+        raise ValueError(question)
+
+    @instrumented("grade")
+    def grade(self, parsing_error=None):
+        # as returned by with_structured_output(..., include_raw=True)
+        raw = AIMessage(
+            content="",
+            usage_metadata={"input_tokens": 20, "output_tokens": 5, "total_tokens": 25},
+        )
+        parsed = None if parsing_error else {"binary_score": "yes"}
+        return {"raw": raw, "parsed": parsed, "parsing_error": parsing_error}
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.1, 0.2, 0.4))
+    for value in [0.05] * 50 + [0.15] * 40 + [0.3] * 10:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(0.1)
+    assert histogram.quantile(0.95) == pytest.approx(0.3)
+    histogram.observe(10)
+    assert histogram.quantile(1.0) == 0.4
+
+
+def test_stages_are_recorded(tmp_path):
+    events = []
+    instrumentation = Instrumentation(
+        jsonl_path=tmp_path / "events.jsonl", hooks=[events.append]
+    )
+    pipeline = Pipeline(instrumentation)
+    pipeline.answer("q")
+    pipeline.answer("q")
+    assert asyncio.run(pipeline.aretrieve("q")) == ["chunk"] * 4
+    with pytest.raises(ValueError):
+        pipeline.route("q")
+    instrumentation.close()
+
+    stages = instrumentation.summary()["stages"]
+    assert stages["answer"]["count"] == 2
+    assert stages["answer"]["prompt_tokens"] == 24
+    assert stages["answer"]["completion_tokens"] == 6
+    assert stages["retrieve"]["chunks"] == 4
+    assert stages["route"]["errors"] == 1
+    lines = (tmp_path / "events.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == events
+    assert events[-1]["error"] == "ValueError"
+
+
+def test_cache_lookups_and_prometheus_export():
+    instrumentation = Instrumentation()
+    cache = ResponseCache(
+        on_lookup=lambda result: instrumentation.cache("response", result)
+    )
+    cache.get_or_compute("q", lambda: "answer")
+    cache.get_or_compute("q", lambda: "answer")
+    cache.get("other")
+    Pipeline(instrumentation).answer("q")
+
+    caches = instrumentation.summary()["caches"]
+    assert caches["response"]["hit"] == 1
+    assert caches["response"]["miss"] == 2
+    assert caches["response"]["hit_rate"] == pytest.approx(1 / 3)
+
+    server = instrumentation.serve_prometheus(port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        text = urllib.request.urlopen(url).read().decode()
+    finally:
+        server.shutdown()
+    assert 'chatbot_stage_seconds_bucket{stage="answer",le="+Inf"} 1' in text
+    assert 'chatbot_stage_seconds_count{stage="answer"} 1' in text
+    assert 'chatbot_prompt_tokens_total{stage="answer"} 12' in text
+    assert 'chatbot_cache_lookups_total{cache="response",result="hit"} 1' in text
+
+
+def test_structured_outputs_record_the_tokens_of_the_raw_message():
+    instrumentation = Instrumentation()
+    pipeline = Pipeline(instrumentation)
+    assert pipeline.grade() == {"binary_score": "yes"}
+    with pytest.raises(ValueError):
+        pipeline.grade(parsing_error=ValueError("not json"))
+    grade = instrumentation.summary()["stages"]["grade"]
+    assert grade["count"] == 2
+    assert grade["prompt_tokens"] == 40
+    assert grade["completion_tokens"] == 10
+    assert grade["errors"] == 1
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fake_mistral_server import FakeMistralServer
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from llm_chatbot import GradeHallucinations, MistralChatbot
+
+
+GUIDELINE = " ".join(
+    f"Bone cancer guideline section {i}. Surgery, radiation therapy and chemotherapy "
+    f"are discussed with the care team, and side effects are followed up."
+    for i in range(40)
+)
+
+
+class WordChatbot(MistralChatbot):
+    """
+    Chatbot splitting and measuring by words, the GPT-2 encoding needs a
+    download.
+    """
+
+    def split_documents(self, documents):
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=400, chunk_overlap=50, add_start_index=True
+        )
+        return splitter.split_documents(documents)
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    with FakeMistralServer(dim=16, latency=0.05, reply_words=8) as server:
+        monkeypatch.setenv("MISTRAL_BASE_URL", server.url)
+        monkeypatch.setenv("MISTRAL_API_KEY", "fake")
+        yield server
+
+
+def make_chatbot(tmp_path, **kwargs):
+    corpus = tmp_path / "corpus.json"
+    url = "/guidelines/bone-patient.pdf"
+    corpus.write_text(json.dumps({url: {"url": url, "text": GUIDELINE}}))
+    ehr = tmp_path / "ehr.txt"
+    ehr.write_text("Patient ID: p1. Osteosarcoma of the left femur, on chemotherapy.")
+    chatbot = WordChatbot(
+        db_patient_path=str(corpus),
+        db_doctor_path=str(corpus),
+        ehr_path=str(ehr),
+        index_dir=str(tmp_path / "rag_index"),
+        router_path=None,
+        **kwargs,
+    )
+    chatbot.count_tokens = lambda text: len(text.split())
+    return chatbot
+
+
+class SlowGrader:
+    """
+    Stands in for the structured grader LLM, grades once released.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def invoke(self, messages):
+        assert self.release.wait(timeout=30)
+        return GradeHallucinations(binary_score="yes", explanation="grounded")
+
+
+class FailingGrader:
+    def invoke(self, messages):
+        raise RuntimeError("the grader is down")
+
+
+def answer_of(events):
+    return "".join(event.data for event in events if event.kind == "token")
+
+
+def test_identical_streams_share_one_pipeline(fake_server, tmp_path):
+    chatbot = make_chatbot(tmp_path)
+
+    async def stream(question):
+        return [event async for event in chatbot.astream_once(question)]
+
+    async def main():
+        before = fake_server.completions
+        await stream("How is bone cancer treated?")
+        per_turn = fake_server.completions - before
+        before = fake_server.completions
+        streams = await asyncio.gather(
+            *(stream("Which tests find bone cancer?") for _ in range(4))
+        )
+        return per_turn, fake_server.completions - before, streams
+
+    per_turn, calls, streams = asyncio.run(main())
+    assert calls == per_turn
+    assert len({answer_of(events) for events in streams}) == 1
+    assert chatbot.response_cache.stats["misses"] == 2
+    assert chatbot.response_cache.stats["coalesced"] == 3
+
+
+def test_sync_wrappers_can_be_called_again(fake_server, tmp_path):
+    chatbot = make_chatbot(tmp_path)
+    # the LLM clients stay bound to the loop of the first call
+    for question in ["How is bone cancer treated?", "What are the side effects?"]:
+        answer, suggestions = chatbot.run_once(question)
+        assert answer and suggestions
+
+    stream = chatbot.stream_once("Which tests find bone cancer?")
+    assert next(stream).kind == "token"
+    stream.close()
+    events = list(chatbot.stream_once("Is surgery always needed?"))
+    assert answer_of(events)
+
+
+def test_concurrent_turns_and_event_order(fake_server, tmp_path):
+    chatbot = make_chatbot(tmp_path)
+    questions = [f"What about bone cancer question {i}?" for i in range(3)]
+
+    async def main():
+        responses = await asyncio.gather(*(chatbot.arun_once(q) for q in questions))
+        events = [event async for event in chatbot.astream_once("What is a biopsy?")]
+        return responses, events
+
+    responses, events = asyncio.run(main())
+    assert all(answer and suggestions for answer, suggestions in responses)
+    kinds = [event.kind for event in events]
+    n_tokens = kinds.count("token")
+    assert n_tokens > 1
+    assert kinds == ["token"] * n_tokens + ["suggestions", "metrics"]
+    assert "time_to_first_token" in events[-1].data
+
+
+def test_stopped_stream_releases_its_question(fake_server, tmp_path):
+    chatbot = make_chatbot(tmp_path)
+    question = "How is bone cancer treated?"
+
+    async def first_token():
+        async for event in chatbot.astream_once(question):
+            return event
+
+    async def main():
+        # a stream closed after its first token, then one cancelled
+        stream = chatbot.astream_once(question)
+        assert (await stream.__anext__()).kind == "token"
+        await stream.aclose()
+        task = asyncio.ensure_future(first_token())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the question is not left claimed by the stopped streams
+        return await asyncio.wait_for(chatbot.arun_once(question), timeout=30)
+
+    answer, suggestions = asyncio.run(main())
+    assert answer and suggestions
+
+
+def test_answers_do_not_wait_for_background_grading(fake_server, tmp_path):
+    graded = []
+    chatbot = make_chatbot(tmp_path, grading="background", on_grade=graded.append)
+    chatbot.structured_llm_hallucination_grader = grader = SlowGrader()
+
+    async def main():
+        answer, _ = await chatbot.arun_once("How is bone cancer treated?")
+        turn = chatbot.last_turn
+        assert answer and turn.grade is None and not graded
+
+        stream = chatbot.astream_once("Which tests find bone cancer?")
+        kinds = []
+        while not kinds or kinds[-1] != "metrics":
+            kinds.append((await stream.__anext__()).kind)
+        assert "grade" not in kinds
+        grader.release.set()
+        event = await stream.__anext__()
+        return turn, event
+
+    turn, event = asyncio.run(main())
+    assert event.kind == "grade" and event.data.binary_score == "yes"
+    turn.grade_future.result(timeout=30)
+    assert turn.grade.binary_score == "yes"
+    # on_grade runs before the stream is handed the grade
+    assert graded[-1] is chatbot.last_turn
+
+
+@pytest.mark.parametrize("grading", ["background", "blocking"])
+def test_grading_failures_are_contained(fake_server, tmp_path, grading):
+    graded = []
+    chatbot = make_chatbot(tmp_path, grading=grading, on_grade=graded.append)
+    chatbot.structured_llm_hallucination_grader = FailingGrader()
+
+    async def main():
+        response = await chatbot.arun_once("How is bone cancer treated?")
+        events = [event async for event in chatbot.astream_once("What is a biopsy?")]
+        return response, events
+
+    (answer, suggestions), events = asyncio.run(main())
+    assert answer and suggestions
+    assert [event.kind for event in events][-2:] == ["suggestions", "metrics"]
+    assert answer_of(events)
+    chatbot.last_turn.grade_future.exception(timeout=30)
+    assert chatbot.last_turn.grade is None
+    assert not graded
+
+
+def test_turns_are_instrumented(fake_server, tmp_path):
+    chatbot = make_chatbot(tmp_path)
+    questions = ["How is bone cancer treated?", "What are the side effects?"]
+
+    async def main():
+        for question in questions + questions[:1]:
+            await chatbot.arun_once(question)
+
+    asyncio.run(main())
+    summary = chatbot.instrumentation.summary()
+    stages = summary["stages"]
+    assert stages["route"]["count"] == 2
+    assert stages["route"]["prompt_tokens"] > 0
+    assert stages["suggest"]["completion_tokens"] > 0
+    answers = [stages.get(stage, {}) for stage in ("answer_simple", "answer_complex")]
+    assert sum(answer.get("count", 0) for answer in answers) == 2
+    assert all(answer.get("prompt_tokens", 1) > 0 for answer in answers)
+
+    caches = summary["caches"]
+    assert caches["response"] == {
+        "hit": 1,
+        "miss": 2,
+        "coalesced": 0,
+        "hit_rate": pytest.approx(1 / 3),
+    }
+    # the index build embeds every chunk once, then the questions are looked up
+    embedding = chatbot.embeddings.stats
+    assert caches["embedding"]["miss"] == embedding["misses"] > 0
+    assert (
+        caches["embedding"]["hit"] == embedding["memory_hits"] + embedding["disk_hits"]
+    )
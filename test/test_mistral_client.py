@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from fake_mistral_server import fake_embedding, FakeMistralServer
+from mistral_client import MistralAPIError, MistralClient
+
+
+def test_connections_are_reused():
+    with FakeMistralServer(reply_words=3) as server:
+        client = MistralClient(api_key="fake", base_url=server.url)
+        replies = [client.chat(f"question {i}") for i in range(5)]
+
+        async def achat():
+            try:
+                return await client.achat_many(["a", "b", "c", "d"], max_concurrency=2)
+            finally:
+                await client.aclose()
+
+        async_replies = asyncio.run(achat())
+        client.close()
+    assert all(len(reply.split()) == 3 for reply in replies + async_replies)
+    assert server.completions == 9
+    # one kept-alive connection for the sync calls, two for the async ones
+    assert server.connections == 3
+
+
+def test_rate_limits_are_retried_and_embeddings_batched():
+    texts = [f"chunk {i}" for i in range(10)]
+    with FakeMistralServer(dim=8, rate_limit=5) as server:
+        client = MistralClient(api_key="fake", base_url=server.url, max_batch_size=4)
+        vectors = [client.embed(texts) for _ in range(3)]
+    assert server.rate_limited > 0
+    assert client.retries == server.rate_limited
+    assert server.embedded == 30
+    assert server.requests - server.rate_limited == 9
+    assert vectors[-1] == [pytest.approx(fake_embedding(text, 8)) for text in texts]
+
+
+def test_errors_are_raised_after_the_retries():
+    with FakeMistralServer(fail_after=0) as server:
+        client = MistralClient(
+            api_key="fake", base_url=server.url, max_retries=2, backoff=0.001
+        )
+        with pytest.raises(MistralAPIError) as error:
+            client.chat("question")
+    assert error.value.status_code == 503
+    assert server.requests == 3
@@ -0,0 +1,32 @@
+from langchain_core.embeddings import Embeddings
+from query_router import EmbeddingRouter
+
+
+class KeywordEmbeddings(Embeddings):
+    """Embeds a text by counting a few keywords."""
+
+    keywords = ["appointment", "medication", "treatment", "guideline"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(text.count(word)) for word in self.keywords]
+
+
+def test_nearest_centroid_routing():
+    router = EmbeddingRouter(KeywordEmbeddings(), threshold=0.1).fit(
+        [
+            "when is my appointment",
+            "what medication am i on",
+            "treatment options in the guideline",
+            "which treatment does the guideline recommend",
+        ],
+        ["simple", "simple", "complex", "complex"],
+    )
+    assert router.route("my next appointment") == "simple"
+    assert router.route("guideline for this treatment") == "complex"
+    # equally close to both centroids: escalate to the LLM router
+    label, confidence = router.predict("appointment about my treatment")
+    assert confidence < 0.1
+    assert router.route("appointment about my treatment") is None
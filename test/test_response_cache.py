@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from response_cache import response_key, ResponseCache
+
+
+def test_key_normalizes_question():
+    key = response_key("What is hormone therapy?", "ehr", "index", {"model": "m"})
+    assert key == response_key(
+        "  what is  hormone therapy ", "ehr", "index", {"model": "m"}
+    )
+    assert key != response_key(
+        "What is hormone therapy?", "other", "index", {"model": "m"}
+    )
+
+
+def test_ttl_and_size_bound():
+    cache = ResponseCache(max_items=2, ttl=0.05)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 2
+
+
+def test_concurrent_threads_are_coalesced():
+    cache = ResponseCache()
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "answer"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        first = executor.submit(cache.get_or_compute, "q", compute)
+        started.wait()
+        others = [executor.submit(cache.get_or_compute, "q", compute) for _ in range(7)]
+        results = [first.result()] + [f.result() for f in others]
+    assert results == ["answer"] * 8
+    assert len(calls) == 1
+    assert cache.stats["coalesced"] == 7
+
+
+def test_concurrent_coroutines_are_coalesced():
+    cache = ResponseCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def burst():
+        return await asyncio.gather(
+            *[cache.aget_or_compute("q", compute) for _ in range(5)]
+        )
+
+    assert asyncio.run(burst()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert asyncio.run(cache.aget_or_compute("q", compute)) == "answer"
+    assert cache.stats["hits"] == 1
+
+
+def test_cancelled_owner_does_not_cancel_the_waiters():
+    cache = ResponseCache()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        owner = asyncio.ensure_future(cache.aget_or_compute("q", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.aget_or_compute("q", compute))
+        await asyncio.sleep(0)
+        owner.cancel()
+        return owner, await waiter
+
+    owner, answer = asyncio.run(main())
+    assert owner.cancelled()
+    assert answer == "answer"
+    assert cache.stats["coalesced"] == 1
+    # the answer the owner gave up on is cached all the same
+    assert cache.get("q") == "answer"
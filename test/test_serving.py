@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from fake_mistral_server import FakeMistralServer
+from langchain_mistralai import ChatMistralAI
+from llm_chatbot import RouteQuery, StreamEvent
+from serving import ChatServer, Overloaded
+
+
+class SlowChatbot:
+    """
+    Stands in for ``MistralChatbot``, a turn takes ``seconds``.
+    """
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.patients = []
+
+    def new_memory(self):
+        return []
+
+    async def astream_once(self, question, patient_id=None, memory=None):
+        self.patients.append(patient_id)
+        memory.append(question)
+        await asyncio.sleep(self.seconds)
+        yield StreamEvent("token", f"answer to {question}")
+        yield StreamEvent("metrics", {"total": self.seconds})
+
+    async def arun_once(self, question, patient_id=None, memory=None):
+        memory.append(question)
+        await asyncio.sleep(self.seconds)
+        return f"answer to {question}", "suggestions"
+
+
+def test_overload_is_rejected_right_away():
+    server = ChatServer(SlowChatbot(), max_concurrency=2, max_queue=1)
+
+    async def turn(i):
+        try:
+            return await server.arun(f"session-{i}", "question")
+        except Overloaded:
+            return None
+
+    async def main():
+        return await asyncio.gather(*(turn(i) for i in range(5)))
+
+    responses = asyncio.run(main())
+    assert sum(response is not None for response in responses) == 3
+    assert server.stats == {
+        "active": 0,
+        "waiting": 0,
+        "admitted": 3,
+        "rejected": 2,
+        "sessions": 5,
+    }
+
+
+def test_sessions_are_separate_and_bounded():
+    chatbot = SlowChatbot(seconds=0.0)
+    server = ChatServer(chatbot, max_sessions=2)
+
+    async def main():
+        for session_id, patient_id in [("a", "p1"), ("b", "p2"), ("a", None)]:
+            async for event in server.astream(session_id, "question", patient_id):
+                pass
+        await server.arun("c", "question")
+
+    asyncio.run(main())
+    assert chatbot.patients == ["p1", "p2", "p1"]
+    assert list(server.sessions) == ["a", "c"]
+    assert server.sessions["a"].turns == 2
+    assert server.sessions["a"].memory == ["question", "question"]
+    assert server.sessions["a"].last_timings == {"total": 0.0}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_fake_chat_completions(stream):
+    with FakeMistralServer(reply_words=5) as server:
+        llm = ChatMistralAI(base_url=server.url, api_key="fake", temperature=0.0)
+        if stream:
+            answer = "".join(chunk.content for chunk in llm.stream("question"))
+        else:
+            answer = llm.invoke("question").content
+        route = llm.with_structured_output(RouteQuery).invoke("question")
+
+    assert len(answer.split()) == 5
+    assert route.datasource in ("simple", "complex")
+    assert server.completions == 2
@@ -0,0 +1,156 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from corpus_io import iter_corpus_documents
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from sharded_index import detect_topics, ShardedIndex, source_topic
+
+
+def split_documents(documents):
+    return [
+        Document(page_content=sentence, metadata=document.metadata)
+        for document in documents
+        for sentence in document.page_content.split(". ")
+    ]
+
+
+def write_corpus(path, texts):
+    data = {
+        name: {"url": f"pdf_data/{name}", "text": text} for name, text in texts.items()
+    }
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_topics():
+    assert source_topic("pdf_data/inflammatory-breast-patient.pdf") == "breast"
+    assert source_topic("pdf_data/colon.pdf") == "colon"
+    assert source_topic("pdf_data/survivorship.pdf") == "general"
+    assert detect_topics("Is colorectal surgery painful?") == ["colon"]
+    assert detect_topics("What is chemotherapy?") == []
+
+
+def test_only_matching_shards_are_loaded(tmp_path):
+    patient = write_corpus(
+        tmp_path / "patient.json",
+        {
+            "bone-patient.pdf": "bone pain. bone surgery",
+            "colon-patient.pdf": "colon polyps. colon surgery",
+            "survivorship.pdf": "life after cancer",
+        },
+    )
+    doctor = write_corpus(
+        tmp_path / "doctor.json", {"bone.pdf": "osteosarcoma staging"}
+    )
+
+    def make_index():
+        return ShardedIndex(
+            str(tmp_path / "index"),
+            "key",
+            DeterministicFakeEmbedding(size=16),
+            corpora={"patient": patient, "doctor": doctor},
+            load_documents=iter_corpus_documents,
+            split_documents=split_documents,
+        )
+
+    index = make_index()
+    assert index.topics("patient") == ["bone", "colon", "general"]
+    assert index.loaded_shards == []
+
+    docs = index.search("colon surgery", "patient", ["colon"], k=10)
+    assert {doc.metadata["source"] for doc in docs} == {
+        "pdf_data/colon-patient.pdf",
+        "pdf_data/survivorship.pdf",
+    }
+    assert index.loaded_shards == [("patient", "colon"), ("patient", "general")]
+
+    # unknown topics search every shard of the audience
+    assert len(index.search("staging", "doctor", ["breast"])) == 1
+
+    # the catalogs and shards are reused on the next start
+    version = index.version
+    index = make_index()
+    assert index.version == version
+    assert index.shard("patient", "colon").info["topic"] == "colon"
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    queries: int = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def test_retrieval_modes(tmp_path):
+    sentences = [f"chemotherapy side effect number {i}" for i in range(200)]
+    sentences.append("ondansetron prevents the nausea of chemotherapy")
+    patient = write_corpus(
+        tmp_path / "patient.json", {"breast.pdf": ". ".join(sentences)}
+    )
+    embedding = CountingEmbedding(size=16)
+    index = ShardedIndex(
+        str(tmp_path / "index"),
+        "key",
+        embedding,
+        corpora={"patient": patient},
+        load_documents=iter_corpus_documents,
+        split_documents=split_documents,
+    )
+
+    # a rare term is answered by BM25 alone, without embedding the query
+    docs = index.search("What is ondansetron?", "patient", mode="auto")
+    assert docs[0].page_content.startswith("ondansetron")
+    assert embedding.queries == 0
+
+    # common terms fall back to fusing BM25 and vector results
+    assert len(index.search("chemotherapy side effect", "patient", mode="auto")) == 4
+    assert embedding.queries == 1
+
+    assert index.search("hair loss", "patient", mode="bm25") == []
+    assert len(index.search("hair loss", "patient", mode="hybrid")) == 4
+    stats = index.stats
+    assert stats["auto"]["queries"] == 2 and stats["auto"]["hit_rate"] == 0.5
+    assert stats["bm25"]["hit_rate"] == 0.0
+    assert stats["vector"]["queries"] == 0
+
+
+def test_building_a_shard_does_not_block_the_others(tmp_path):
+    patient = write_corpus(
+        tmp_path / "patient.json",
+        {
+            "bone-patient.pdf": "bone pain. bone surgery",
+            "colon-patient.pdf": "colon surgery",
+        },
+    )
+    building, release = threading.Event(), threading.Event()
+
+    def slow_split(documents):
+        documents = list(documents)
+        if any("bone" in document.metadata["source"] for document in documents):
+            building.set()
+            assert release.wait(timeout=30)
+        return split_documents(documents)
+
+    index = ShardedIndex(
+        str(tmp_path / "index"),
+        "key",
+        DeterministicFakeEmbedding(size=16),
+        corpora={"patient": patient},
+        load_documents=iter_corpus_documents,
+        split_documents=slow_split,
+    )
+    index.shard("patient", "colon")
+    with ThreadPoolExecutor(3) as pool:
+        bone = [pool.submit(index.shard, "patient", "bone") for _ in range(2)]
+        assert building.wait(timeout=30)
+        colon = pool.submit(
+            index.search, "colon surgery", "patient", ["colon"], mode="bm25"
+        )
+        assert len(colon.result(timeout=5)) == 1
+        assert not any(future.done() for future in bone)
+        release.set()
+        assert bone[0].result() is bone[1].result()
+    assert index.loaded_shards == [("patient", "bone"), ("patient", "colon")]
@@ -0,0 +1,74 @@
+import random
+import re
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from token_splitter import TokenOffsetSplitter
+
+
+GPT2_PATTERN = (
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+)
+
+
+def word_encoding(text):
+    """
+    A GPT-2 style encoding whose tokens are the bytes and the prefixes of the
+    words of ``text``, since the real encodings need a download.
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in set(re.findall(r" ?[a-z]+", text)):
+        word = word.encode()
+        for end in range(2, len(word) + 1):
+            ranks.setdefault(word[:end], len(ranks))
+    return tiktoken.Encoding(
+        name="words", pat_str=GPT2_PATTERN, mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+def random_document(rng):
+    words = ["cancer", "chemotherapy", "the", "of", "patients", "dose", "é", "12"]
+    paragraphs = []
+    for _ in range(rng.randint(5, 15)):
+        lines = [
+            " ".join(rng.choice(words) for _ in range(rng.randint(1, 40)))
+            for _ in range(rng.randint(1, 4))
+        ]
+        paragraphs.append("\n".join(lines))
+    # a long run without separators is split character by character
+    paragraphs.insert(2, "7" * 300)
+    return "\n\n".join(paragraphs)
+
+
+def test_chunks_match_the_langchain_splitter():
+    rng = random.Random(0)
+    documents = [
+        Document(page_content=random_document(rng), metadata={"source": str(i)})
+        for i in range(4)
+    ]
+    encoding = word_encoding(" ".join(doc.page_content for doc in documents))
+    reference = RecursiveCharacterTextSplitter(
+        chunk_size=50,
+        chunk_overlap=10,
+        length_function=lambda text: len(encoding.encode(text)),
+    )
+    splitter = TokenOffsetSplitter(
+        chunk_size=50,
+        chunk_overlap=10,
+        encoding_name=None,
+        encoding=encoding,
+        add_start_index=True,
+        workers=2,
+        min_parallel_chars=0,
+    )
+
+    expected = reference.split_documents(documents)
+    chunks = splitter.split_documents(documents)
+    assert [chunk.page_content for chunk in chunks] == [
+        chunk.page_content for chunk in expected
+    ]
+    texts = {doc.metadata["source"]: doc.page_content for doc in documents}
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert texts[chunk.metadata["source"]][start:].startswith(chunk.page_content)
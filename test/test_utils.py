@@ -1,6 +1,15 @@
 import os
+import random
+import re
 
-from utils import download_pdf, pdf2dataset, post_process_scraped_pdf
+from utils import (
+    clean_text,
+    download_pdf,
+    pdf2dataset,
+    post_process_scraped_pdf,
+    to_be_removed,
+    to_be_replaced,
+)
 
 
 def test_pdf_scrap():
@@ -29,3 +38,32 @@ def test_pdf_download():
     assert os.path.exists(path + "/" + filename)
     # Delete the file
     os.remove(path + "/" + filename)
+
+
+def _clean_text_replace_loop(text):
+    for char in to_be_removed:
+        text = text.replace(char, "")
+    for char, replacement in to_be_replaced.items():
+        text = text.replace(char, replacement)
+    text = re.sub(r"\.([^ ])", r". \1", text)
+    text = re.sub(r"([a-zà-öø-ÿ])([A-ZÀ-ÖØ-Þ])", r"\1 \2", text)
+    text = text.replace(" ,", ",")
+    text = text.replace(" .", ".")
+    text = text.replace(" -", "-")
+    text = text.replace("- ", "-")
+    while "  " in text:
+        text = text.replace("  ", " ")
+    return text
+
+
+def test_clean_text_matches_replace_loop():
+    rng = random.Random(0)
+    alphabet = (
+        list("aZéÉßÞÿ÷.,- \n") + to_be_removed + list(to_be_replaced) + ["   ", "..."]
+    )
+    samples = ["", " ", "aB", "a  ,b", "x - y", "1.5mg.Next", "àÀ øØ"] + [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 60)))
+        for _ in range(2000)
+    ]
+    for sample in samples:
+        assert clean_text(sample) == _clean_text_replace_loop(sample), sample
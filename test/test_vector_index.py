@@ -0,0 +1,156 @@
+import json
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from vector_index import index_key, NumpyVectorStore, sync_index
+
+
+def test_save_load_roundtrip(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    texts = ["bone cancer", "colon cancer", "breast cancer"]
+    vs = NumpyVectorStore.from_texts(
+        texts, embedding, metadatas=[{"i": i} for i in range(3)]
+    )
+    vs.save(str(tmp_path / "index"))
+
+    loaded = NumpyVectorStore.load(str(tmp_path / "index"), embedding)
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.vectors.dtype == np.float32
+    doc = loaded.similarity_search("colon cancer", k=1)[0]
+    assert doc.page_content == "colon cancer"
+    assert doc.metadata["i"] == 1
+
+
+def test_ivf_backend_is_saved_with_the_index(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    texts = [f"chunk {i}" for i in range(200)]
+    vs = NumpyVectorStore.from_texts(
+        texts, embedding, search_backend="ivf", search_params={"n_probe": 1000}
+    )
+    # probing every list is an exact search
+    assert vs.similarity_search("chunk 42", k=1)[0].page_content == "chunk 42"
+    vs.save(str(tmp_path / "index"))
+    assert (tmp_path / "index" / "ivf.npz").exists()
+
+    loaded = NumpyVectorStore.load(
+        str(tmp_path / "index"),
+        embedding,
+        search_backend="ivf",
+        search_params={"n_probe": 2},
+    )
+    assert loaded._backend is not None and loaded._backend.n_probe == 2
+    assert len(loaded.similarity_search("chunk 7", k=3)) == 3
+
+
+@pytest.mark.parametrize("backend", ["int8", "binary"])
+def test_quantized_backends_rescore_from_the_mapped_vectors(tmp_path, backend):
+    embedding = DeterministicFakeEmbedding(size=64)
+    texts = [f"chunk {i}" for i in range(300)]
+    NumpyVectorStore.from_texts(texts, embedding, search_backend=backend).save(
+        str(tmp_path / "index")
+    )
+    assert (tmp_path / "index" / f"{backend}.npz").exists()
+
+    loaded = NumpyVectorStore.load(
+        str(tmp_path / "index"), embedding, search_backend=backend
+    )
+    assert loaded._backend is not None
+    results = loaded.similarity_search_with_score("chunk 42", k=2)
+    # rescored with the full-precision vectors
+    assert results[0][0].page_content == "chunk 42"
+    assert results[0][1] == pytest.approx(0.0, abs=1e-5)
+
+
+class Corpus:
+    """A JSON corpus that records which documents got split."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.split = []
+
+    def write(self, data):
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+
+    def load_documents(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        return [
+            Document(page_content=text, metadata={"source": source})
+            for source, text in data.items()
+        ]
+
+    def split_documents(self, documents):
+        self.split.extend(document.metadata["source"] for document in documents)
+        return [
+            Document(page_content=word, metadata=document.metadata)
+            for document in documents
+            for word in document.page_content.split()
+        ]
+
+
+def test_index_is_updated_with_deltas(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    corpus = Corpus(tmp_path / "corpus.json")
+    key = index_key(1000, 200, "mistral-embed")
+
+    def sync():
+        return sync_index(
+            str(tmp_path / "index"),
+            "patient",
+            key,
+            embedding,
+            corpus.path,
+            corpus.load_documents,
+            corpus.split_documents,
+        )
+
+    corpus.write({"bone.pdf": "bone marrow", "colon.pdf": "colon polyp"})
+    vs, status = sync()
+    assert status == "built" and len(vs) == 4
+
+    vs, status = sync()
+    assert status == "loaded" and corpus.split == ["bone.pdf", "colon.pdf"]
+
+    corpus.write({"colon.pdf": "colon polyp", "breast.pdf": "breast lump mass"})
+    vs, status = sync()
+    assert status == "updated"
+    assert corpus.split == ["bone.pdf", "colon.pdf", "breast.pdf"]
+    assert sorted(vs._texts) == ["breast", "colon", "lump", "mass", "polyp"]
+    assert set(vs.info["sources"]) == {"colon.pdf", "breast.pdf"}
+
+    # a new embedding model is a different index
+    assert index_key(1000, 200, "other-embed") != key
+
+
+def test_sources_with_the_same_text_keep_their_own_chunks(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    corpus = Corpus(tmp_path / "corpus.json")
+    key = index_key(1000, 200, "mistral-embed")
+
+    def sync():
+        return sync_index(
+            str(tmp_path / "index"),
+            "patient",
+            key,
+            embedding,
+            corpus.path,
+            corpus.load_documents,
+            corpus.split_documents,
+        )
+
+    corpus.write({"bone.pdf": "bone marrow", "copy.pdf": "bone marrow"})
+    vs, status = sync()
+    assert len(vs) == 4 and len(set(vs._ids)) == 4
+
+    # updating then deleting one source leaves the chunks of the other
+    corpus.write({"bone.pdf": "bone marrow", "copy.pdf": "bone"})
+    vs, status = sync()
+    assert status == "updated"
+    assert sorted(vs._texts) == ["bone", "bone", "marrow"]
+    corpus.write({"bone.pdf": "bone marrow"})
+    vs, status = sync()
+    assert sorted(vs._texts) == ["bone", "marrow"]
+    assert {metadata["source"] for metadata in vs._metadatas} == {"bone.pdf"}
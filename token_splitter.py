@@ -0,0 +1,228 @@
+"""
+Recursive text splitter measuring lengths with precomputed token offsets.
+
+``RecursiveCharacterTextSplitter.from_tiktoken_encoder`` re-encodes every
+piece of text it considers, at every level of the recursion and again while
+merging. ``TokenOffsetSplitter`` runs the same algorithm on character ranges of
+the document instead: the document is encoded once, and the token lengths of
+the pieces of a range are the numbers of tokens starting in them, found for
+all pieces at once with ``np.searchsorted`` on the token offsets. Chunks are
+the same as LangChain's as long as pieces start on the tokenizer's pre-token
+boundaries, which the whitespace separators give with GPT-2 style encodings;
+pieces of the last, character level separator are encoded on their own as
+LangChain does.
+
+Multi-document corpora are split across a process pool.
+"""
+
+import copy
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# splitter of a worker process, sent once when the worker starts
+_worker_splitter = None
+
+
+def _init_worker(splitter):
+    global _worker_splitter
+    _worker_splitter = splitter
+
+
+def _split_in_worker(text):
+    return _worker_splitter.split_ranges(text)
+
+
+class TokenOffsetSplitter:
+    """
+    Drop-in for ``RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+    chunk_size=..., chunk_overlap=..., add_start_index=...)`` with the default
+    separators, ``keep_separator=True`` and ``strip_whitespace=True``.
+
+    ``encoding`` is a tiktoken encoding, by default ``encoding_name`` loaded on
+    first use (and in every worker process).
+    """
+
+    def __init__(
+        self,
+        chunk_size=1000,
+        chunk_overlap=200,
+        encoding_name="gpt2",
+        encoding=None,
+        separators=None,
+        add_start_index=False,
+        workers=None,
+        min_parallel_chars=1_000_000,
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size})"
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding_name = encoding_name
+        self._encoding = encoding
+        # number of bytes of every token of the encoding
+        self._token_bytes = None
+        self.separators = separators or DEFAULT_SEPARATORS
+        self.add_start_index = add_start_index
+        # a pool only pays off for corpora of at least min_parallel_chars
+        self.workers = workers
+        self.min_parallel_chars = min_parallel_chars
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.encoding_name is not None:
+            # workers load the encoding by name instead of unpickling it
+            state["_encoding"] = None
+            state["_token_bytes"] = None
+        return state
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def _count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _token_offsets(self, text):
+        """
+        Returns the character offset of every token of ``text``, as
+        ``Encoding.decode_with_offsets`` does, but computed with numpy.
+        """
+        if self._token_bytes is None:
+            token_bytes = np.zeros(self.encoding.n_vocab, dtype=np.int64)
+            for token in range(self.encoding.n_vocab):
+                try:
+                    token_bytes[token] = len(
+                        self.encoding.decode_single_token_bytes(token)
+                    )
+                except KeyError:
+                    # unassigned id of the encoding
+                    pass
+            self._token_bytes = token_bytes
+        tokens = np.array(
+            self.encoding.encode(text, disallowed_special=()), dtype=np.int64
+        )
+        byte_offsets = np.cumsum(self._token_bytes[tokens]) - self._token_bytes[tokens]
+        data = np.frombuffer(text.encode(), dtype=np.uint8)
+        # index of the character every byte belongs to
+        char_of_byte = np.cumsum((data & 0xC0) != 0x80) - 1
+        return char_of_byte[byte_offsets]
+
+    def split_ranges(self, text):
+        """
+        Returns the ``(start, end)`` character ranges of the chunks of ``text``.
+        """
+        chunks = []
+        if text:
+            offsets = self._token_offsets(text)
+            self._split(text, 0, len(text), self.separators, offsets, chunks)
+        return chunks
+
+    def _split(self, text, start, end, separators, offsets, chunks):
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, remaining = candidate, separators[i + 1 :]
+                break
+
+        if separator:
+            # the separator starts the piece that follows it (keep_separator)
+            matches = re.compile(re.escape(separator)).finditer(text, start, end)
+            bounds = [start] + [match.start() for match in matches] + [end]
+            # tokens starting in every piece
+            lengths = np.diff(np.searchsorted(offsets, bounds)).tolist()
+            pieces = [
+                (a, b, n) for a, b, n in zip(bounds, bounds[1:], lengths) if a < b
+            ]
+        else:
+            pieces = [(i, i + 1, self._count(text[i])) for i in range(start, end)]
+
+        good = []
+        for piece in pieces:
+            if piece[2] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, chunks)
+                good = []
+            if not remaining:
+                self._append(text, piece[0], piece[1], chunks)
+            else:
+                self._split(text, piece[0], piece[1], remaining, offsets, chunks)
+        if good:
+            self._merge(text, good, chunks)
+
+    @staticmethod
+    def _append(text, start, end, chunks):
+        """
+        Appends the stripped range ``[start, end)`` unless it is blank.
+        """
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            chunks.append((start, end))
+
+    def _merge(self, text, pieces, chunks):
+        # same as TextSplitter._merge_splits, with an empty separator
+        current, first, total = [], 0, 0
+        for piece in pieces:
+            length = piece[2]
+            if total + length > self.chunk_size:
+                if first < len(current):
+                    self._append(text, current[first][0], current[-1][1], chunks)
+                    while total > self.chunk_overlap or (
+                        total + length > self.chunk_size and total > 0
+                    ):
+                        total -= current[first][2]
+                        first += 1
+            current.append(piece)
+            total += length
+        if first < len(current):
+            self._append(text, current[first][0], current[-1][1], chunks)
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.split_ranges(text)]
+
+    def _use_pool(self, texts):
+        return (
+            (self.workers or os.cpu_count() or 1) > 1
+            and len(texts) > 1
+            and sum(len(text) for text in texts) >= self.min_parallel_chars
+        )
+
+    def split_documents(self, documents):
+        documents = list(documents)
+        texts = [document.page_content for document in documents]
+        if self._use_pool(texts):
+            with ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self,)
+            ) as executor:
+                all_ranges = list(executor.map(_split_in_worker, texts))
+        else:
+            all_ranges = [self.split_ranges(text) for text in texts]
+
+        chunks = []
+        for document, text, ranges in zip(documents, texts, all_ranges):
+            for start, end in ranges:
+                metadata = copy.deepcopy(document.metadata)
+                if self.add_start_index:
+                    metadata["start_index"] = start
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
@@ -4,15 +4,23 @@ Code adapted from HF https://huggingface.co/spaces/pdf2dataset/pdf2dataset/blob/
 """
 
 import getpass
+import hashlib
+import itertools
 import json
 import os
 import re
+import sys
+import time
 import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import gradio as gr
 from cleantext import clean as cl
+from corpus_io import CorpusWriter, is_jsonl_corpus, iter_corpus_records
 from datasets import Dataset
 from pypdf import PdfReader
+from vector_index import file_sha256
 
 
 def _set_env(var: str):
@@ -55,25 +63,53 @@ to_be_replaced = {
 }
 
 
-def clean_text(text):
-    # Remove all the unwanted characters
-    for char in to_be_removed:
-        text = text.replace(char, "")
+# Every removal and replacement above is a single character and no replacement
+# produces a character that is itself removed or replaced, so all of them are
+# applied in one pass of a precompiled character class.
+_substitutions = {**{char: "" for char in to_be_removed}, **to_be_replaced}
+_special_chars = re.compile("[" + re.escape("".join(_substitutions)) + "]")
+_period_without_space = re.compile(r"\.([^ ])")
+_uppercase = re.compile(r"[A-ZÀ-ÖØ-Þ]")
+_lowercase = frozenset(
+    [chr(c) for c in range(ord("a"), ord("z") + 1)]
+    + [chr(c) for c in range(ord("à"), ord("ö") + 1)]
+    + [chr(c) for c in range(ord("ø"), ord("ÿ") + 1)]
+)
+_space_runs = re.compile("  +")
+
+
+def _space_lower_upper(text):
+    """
+    Same as re.sub(r"([a-zà-öø-ÿ])([A-ZÀ-ÖØ-Þ])", r"\1 \2", text), but only
+    looks at the (rare) uppercase characters instead of at every position.
+    """
+    pieces = []
+    last = 0
+    for match in _uppercase.finditer(text):
+        position = match.start()
+        if position and text[position - 1] in _lowercase:
+            pieces.append(text[last:position])
+            last = position
+    if not pieces:
+        return text
+    pieces.append(text[last:])
+    return " ".join(pieces)
+
 
-    # Replace all the characters that need to be replaced
-    for char, replacement in to_be_replaced.items():
-        text = text.replace(char, replacement)
+def clean_text(text):
+    # Remove the unwanted characters and replace the ones that need to be
+    text = _special_chars.sub(lambda match: _substitutions[match.group()], text)
 
     # For all \n, if the next line doesn't start
     #  with a capital letter, remove the \n
     # text = re.sub(r"\n([^A-ZÀ-ÖØ-Þ])", r" \1", text)
 
     # Make sure that every "." is followed by a space
-    text = re.sub(r"\.([^ ])", r". \1", text)
+    text = _period_without_space.sub(r". \1", text)
 
     # Add a space between a lowercase followed by
     # an uppercase "aA" -> "a A" (include accents)
-    text = re.sub(r"([a-zà-öø-ÿ])([A-ZÀ-ÖØ-Þ])", r"\1 \2", text)
+    text = _space_lower_upper(text)
 
     # Make sure that there is no space before
     # a comma, a period, or a hyphen
@@ -82,9 +118,9 @@ def clean_text(text):
     text = text.replace(" -", "-")
     text = text.replace("- ", "-")
 
-    while "  " in text:
-        text = text.replace("  ", " ")
-
+    # Collapse runs of spaces, as repeatedly replacing "  " with " " would
+    if "  " in text:
+        text = _space_runs.sub(" ", text)
     return text
 
 
@@ -105,57 +141,315 @@ def pdf2dataset(path: str, progress=gr.Progress()):
     return dataset
 
 
+def clean_page(text_sample):
+    return cl(
+        str(text_sample),
+        fix_unicode=True,
+        to_ascii=True,
+        lower=True,
+        no_line_breaks=False,
+        no_urls=False,
+        no_emails=False,
+        no_phone_numbers=False,
+        no_numbers=False,
+        no_digits=False,
+        no_currency_symbols=False,
+        no_punct=False,
+        replace_with_punct="",
+        replace_with_url="<URL>",
+        replace_with_email="<EMAIL>",
+        replace_with_phone_number="<PHONE>",
+        replace_with_number="<NUMBER>",
+        replace_with_digit="0",
+        replace_with_currency_symbol="<CUR>",
+        lang="en",  # set to 'de' for German special handling
+    )
+
+
 def post_process_scraped_pdf(data: Dataset, limit=20, urlprefix="") -> Dataset:
     """
     This function return a dictionary with the key
     'url_pdf' and the value being the pdf's content.
     """
     filtered_test = [
-        cl(
-            str(text_sample),
-            fix_unicode=True,
-            to_ascii=True,
-            lower=True,
-            no_line_breaks=False,
-            no_urls=False,
-            no_emails=False,
-            no_phone_numbers=False,
-            no_numbers=False,
-            no_digits=False,
-            no_currency_symbols=False,
-            no_punct=False,
-            replace_with_punct="",
-            replace_with_url="<URL>",
-            replace_with_email="<EMAIL>",
-            replace_with_phone_number="<PHONE>",
-            replace_with_number="<NUMBER>",
-            replace_with_digit="0",
-            replace_with_currency_symbol="<CUR>",
-            lang="en",  # set to 'de' for German special handling
-        )
+        clean_page(text_sample)
         for text_sample in data["text"]
         if len(text_sample) >= limit
     ]
     return urlprefix + data["source"][0], " ".join(filtered_test)
 
 
-def create_json_file_dataset(list_of_pdf, json_filename):
-    list_of_texts, list_of_urls = [], []
-    list_of_pdf = list_of_pdf.split(",")
+def extract_page_range(path, start, stop, limit=20):
+    """
+    Extracts and cleans the pages ``[start, stop)`` of a PDF, dropping pages
+    shorter than ``limit`` characters as ``post_process_scraped_pdf`` does.
+    Runs in the ingestion worker processes.
+    """
+    reader = PdfReader(path)
+    page_texts = []
+    for page_number in range(start, stop):
+        page_text = clean_text(reader.pages[page_number].extract_text())
+        if len(page_text) >= limit:
+            page_texts.append(clean_page(page_text))
+    return page_texts
+
+
+def iter_cleaned_pages(list_of_pdf, workers=None, pages_per_task=16, limit=20):
+    """
+    Yields ``(pdf, page_texts)`` for consecutive page ranges of every PDF, in
+    document and page order whatever the number of workers.
+
+    Page ranges are extracted by a pool of ``workers`` processes (all cores by
+    default, in-process when ``workers=1``) and at most ``2 * workers`` ranges
+    are in flight, which bounds memory to a few ranges of pages.
+    """
+    tasks = []
     for pdf in list_of_pdf:
-        dataset = pdf2dataset(pdf)
-        url, text = post_process_scraped_pdf(dataset)
-        list_of_texts.append(text)
-        list_of_urls.append(url)
-
-    # Create the data dictionary
-    data = {}
-    for url, text in zip(list_of_urls, list_of_texts):
-        data[url.split("/")[-1]] = {"url": url, "text": list_of_texts[0]}
-
-    # Convert to JSON
-    json_data = json.dumps(data, indent=2)
-
-    # Optionally, save to a file
-    with open(json_filename, "w") as f:
-        f.write(json_data)
+        n_pages = len(PdfReader(pdf).pages)
+        # a PDF without pages still yields one (empty) range
+        for start in range(0, max(n_pages, 1), pages_per_task):
+            tasks.append((pdf, start, min(start + pages_per_task, n_pages)))
+
+    total_pages = sum(stop - start for _, start, stop in tasks)
+    done_pages = 0
+    start_time = time.perf_counter()
+
+    def report(pdf, start, stop):
+        nonlocal done_pages
+        done_pages += stop - start
+        rate = done_pages / max(time.perf_counter() - start_time, 1e-9)
+        print(
+            f"\r{done_pages}/{total_pages} pages ({rate:.1f} pages/s) {pdf}",
+            end="" if done_pages < total_pages else "\n",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for pdf, start, stop in tasks:
+            page_texts = extract_page_range(pdf, start, stop, limit)
+            report(pdf, start, stop)
+            yield pdf, page_texts
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        tasks = iter(tasks)
+        for task in itertools.islice(tasks, 2 * workers):
+            in_flight.append((task, executor.submit(extract_page_range, *task, limit)))
+        while in_flight:
+            (pdf, start, stop), future = in_flight.popleft()
+            page_texts = future.result()
+            for task in itertools.islice(tasks, 1):
+                in_flight.append(
+                    (task, executor.submit(extract_page_range, *task, limit))
+                )
+            report(pdf, start, stop)
+            yield pdf, page_texts
+
+
+# Bump when the extraction or the cleaning changes, to invalidate the manifests
+EXTRACTION_VERSION = 1
+
+
+def default_manifest_path(json_filename):
+    stem = json_filename
+    for suffix in (".gz", ".zst", ".jsonl", ".json"):
+        if stem.endswith(suffix):
+            stem = stem[: -len(suffix)]
+    return stem + ".manifest.json"
+
+
+def load_manifest(manifest_path, output):
+    """
+    Returns the manifest of a previous build of ``output``, mapping every
+    source PDF to its file hash, the extraction settings, its key in the
+    dataset and the hash of its extracted text.
+    """
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {"output": output, "pdfs": {}}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("output") != output:
+        # e.g. the same PDFs were extracted to another format
+        return {"output": output, "pdfs": {}}
+    return manifest
+
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _write_pages(page_texts, write_page):
+    """
+    Writes the pages of one PDF with ``write_page(n, text)`` and returns the
+    sha256 of its text, i.e. of its pages joined with spaces.
+    """
+    text_hash = hashlib.sha256()
+    for n, page_text in enumerate(page_texts):
+        if n:
+            text_hash.update(b" ")
+        text_hash.update(page_text.encode())
+        write_page(n, page_text)
+    return text_hash.hexdigest()
+
+
+def _write_json_dataset(json_filename, list_of_pdf, reusable, extracted):
+    """
+    Writes the legacy JSON dataset, PDFs in ``list_of_pdf`` order. The text of
+    the ``reusable`` PDFs is copied from the previous dataset.
+    """
+    previous = {}
+    if reusable and os.path.exists(json_filename):
+        with open(json_filename) as f:
+            previous = json.load(f)
+    reused = {
+        pdf: previous[key]["text"] for pdf, key in reusable.items() if key in previous
+    }
+    del previous
+
+    text_hashes = {}
+    tmp_filename = json_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        f.write("{" if list_of_pdf else "{}")
+        for n, pdf in enumerate(list_of_pdf):
+            f.write("," if n else "")
+            f.write(f"\n  {json.dumps(pdf.split('/')[-1])}: {{")
+            f.write(f'\n    "url": {json.dumps(pdf)},')
+            f.write('\n    "text": "')
+            if pdf in reused:
+                page_texts = [reused.pop(pdf)]
+            else:
+                page_texts = extracted(pdf)
+
+            def write_page(n, page_text):
+                # the page text without its surrounding quotes
+                f.write((" " if n else "") + json.dumps(page_text)[1:-1])
+
+            text_hashes[pdf] = _write_pages(page_texts, write_page)
+            f.write('"\n  }')
+        if list_of_pdf:
+            f.write("\n}")
+    os.replace(tmp_filename, json_filename)
+    return text_hashes
+
+
+def _write_jsonl_corpus(corpus_filename, list_of_pdf, reusable, extracted):
+    """
+    Writes a JSONL corpus (see ``corpus_io``). The pages of the ``reusable``
+    PDFs are streamed from the previous corpus first, in their previous
+    order, followed by the other PDFs in ``list_of_pdf`` order.
+    """
+    text_hashes = {}
+    tmp_filename = (
+        corpus_filename + ".tmp" + corpus_filename[corpus_filename.rindex(".") :]
+    )
+    with CorpusWriter(tmp_filename) as writer:
+        if reusable and os.path.exists(corpus_filename):
+            records = iter_corpus_records(corpus_filename)
+            for source, pages in itertools.groupby(records, key=lambda r: r["source"]):
+                if source not in reusable:
+                    continue
+                text_hashes[source] = _write_pages(
+                    (record["text"] for record in pages),
+                    lambda n, text: writer.write(source, n, text),
+                )
+        for pdf in list_of_pdf:
+            if pdf not in text_hashes:
+                text_hashes[pdf] = _write_pages(
+                    extracted(pdf),
+                    lambda n, text: writer.write(pdf, n, text),
+                )
+    os.replace(tmp_filename, corpus_filename)
+    return text_hashes
+
+
+def create_json_file_dataset(
+    list_of_pdf,
+    json_filename,
+    workers=None,
+    pages_per_task=16,
+    limit=20,
+    manifest_path="default",
+):
+    """
+    Extracts the comma-separated ``list_of_pdf`` into ``json_filename``. With
+    a ``.jsonl``, ``.jsonl.gz`` or ``.jsonl.zst`` file name the output is a
+    page-level JSONL corpus (see ``corpus_io``), otherwise the legacy JSON
+    object mapping each PDF file name to its url and cleaned text, the same as
+    ``json.dumps(data, indent=2)`` of that dataset.
+
+    Pages are extracted in parallel (see ``iter_cleaned_pages``) and written
+    to the file as they come instead of building the dataset in memory.
+
+    The manifest (``<json_filename without extension>.manifest.json`` by
+    default, ``None`` to disable it) records the hash of every PDF, so a
+    rebuild only extracts the PDFs that were added or changed and copies the
+    others from the previous ``json_filename``. PDFs that are not listed
+    anymore are dropped.
+    """
+    # a PDF listed twice would be a duplicate key
+    list_of_pdf = list(dict.fromkeys(list_of_pdf.split(",")))
+    if manifest_path == "default":
+        manifest_path = default_manifest_path(json_filename)
+
+    settings = {"limit": limit, "version": EXTRACTION_VERSION}
+    output = os.path.basename(json_filename)
+    manifest = load_manifest(manifest_path, output)
+    hashes = {pdf: file_sha256(pdf) for pdf in list_of_pdf}
+    # unchanged PDFs, by their key in the previous dataset
+    reusable = {
+        pdf: manifest["pdfs"][pdf]["key"]
+        for pdf in list_of_pdf
+        if manifest["pdfs"].get(pdf, {}).get("sha256") == hashes[pdf]
+        and manifest["pdfs"][pdf].get("settings") == settings
+        and os.path.exists(json_filename)
+    }
+    to_extract = [pdf for pdf in list_of_pdf if pdf not in reusable]
+    print(
+        f"{len(reusable)} unchanged PDFs, extracting {len(to_extract)}, "
+        f"dropping {len(set(manifest['pdfs']) - set(list_of_pdf))}",
+        file=sys.stderr,
+    )
+
+    groups = itertools.groupby(
+        iter_cleaned_pages(to_extract, workers, pages_per_task, limit),
+        key=lambda item: item[0],
+    )
+
+    def extracted(pdf):
+        """
+        Pages of ``pdf``, which has to be the next PDF of ``to_extract``.
+        """
+        if pdf in reusable:
+            # unchanged but missing from the previous dataset
+            ranges = iter_cleaned_pages([pdf], workers, pages_per_task, limit)
+            return (text for _, texts in ranges for text in texts)
+        extracted_pdf, ranges = next(groups)
+        assert extracted_pdf == pdf
+        return (text for _, texts in ranges for text in texts)
+
+    if is_jsonl_corpus(json_filename):
+        text_hashes = _write_jsonl_corpus(
+            json_filename, list_of_pdf, reusable, extracted
+        )
+    else:
+        text_hashes = _write_json_dataset(
+            json_filename, list_of_pdf, reusable, extracted
+        )
+
+    if manifest_path is not None:
+        pdfs = {
+            pdf: {
+                "sha256": hashes[pdf],
+                "settings": settings,
+                "key": pdf.split("/")[-1],
+                "text_sha256": text_hashes[pdf],
+            }
+            for pdf in list_of_pdf
+        }
+        save_manifest({"output": output, "pdfs": pdfs}, manifest_path)
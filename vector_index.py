@@ -0,0 +1,474 @@
+"""
+Persistent vector index used by the RAG retriever.
+
+An index is a directory holding
+    - ``embeddings.npy``: float32 (n_chunks, dim) matrix of L2-normalised
+      embeddings, memory-mapped when loaded,
+    - ``chunks.jsonl``: one ``{"id", "text", "metadata"}`` record per row,
+    - ``index.json``: format version, the inputs the index was built from and
+      the hash and chunk ids of every source document,
+    - ``bm25.npz``: the BM25 inverted index of the chunks (see ``bm25_index``),
+      and the fitted search backend if it has a state.
+
+Indexes are addressed by a key derived from the splitter settings and the
+embedding model. When the corpus file is unchanged a warm start only has to
+map the matrix and read the chunk texts back; otherwise only the chunks of
+added, changed or removed source documents are updated.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from ann_index import SEARCH_BACKENDS
+from bm25_index import BM25Index
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+INDEX_FORMAT_VERSION = 3
+
+DEFAULT_K = 4
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Returns the sha256 hex digest of a file, read by blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def index_key(chunk_size, chunk_overlap, embedding_model, splitter=None):
+    """
+    Returns the key identifying an index built with these settings. Any change
+    of splitter settings or embedding model changes the key and requires a
+    full rebuild; corpus changes are applied to the index in place.
+    ``splitter`` names the splitter when it is not LangChain's recursive one.
+    """
+    inputs = {
+        "version": INDEX_FORMAT_VERSION,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": embedding_model,
+    }
+    if splitter is not None:
+        inputs["splitter"] = splitter
+    payload = json.dumps(inputs, sort_keys=True).encode()
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact cosine-similarity vector store over a (possibly memory-mapped)
+    float32 matrix. Scores are cosine distances, as with ``SKLearnVectorStore``.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        vectors: Optional[np.ndarray] = None,
+        texts: Optional[List[str]] = None,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        search_backend: str = "exact",
+        search_params: Optional[dict] = None,
+    ) -> None:
+        self._embedding_function = embedding
+        self.search_backend = search_backend
+        self.search_params = search_params or {}
+        # fitted lazily, and again whenever the vectors change
+        self._backend = None
+        self._bm25 = None
+        self._texts = list(texts or [])
+        self._metadatas = list(metadatas or [{} for _ in self._texts])
+        self._ids = list(ids or [str(uuid.uuid4()) for _ in self._texts])
+        if vectors is None:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        self._vectors = vectors
+        # blocks added since the matrix was last assembled
+        self._pending = []
+        # header of the index it was loaded from
+        self.info = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self._pending.append(
+            _normalize(self._embedding_function.embed_documents(texts))
+        )
+        self._backend = None
+        self._bm25 = None
+        self._texts.extend(texts)
+        self._metadatas.extend(metadatas)
+        self._ids.extend(ids)
+        return ids
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        The (n_chunks, dim) embedding matrix. Blocks added one at a time are
+        only concatenated when the matrix is needed, so building an index
+        document by document does not copy the matrix every time.
+        """
+        if self._pending:
+            blocks = self._pending
+            if len(self._vectors):
+                blocks = [self._vectors] + blocks
+            # this copies, so a memory-mapped matrix becomes an in-memory one
+            self._vectors = np.vstack(blocks)
+            self._pending = []
+        return self._vectors
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool:
+        ids = set(ids or [])
+        keep = [i for i, id_ in enumerate(self._ids) if id_ not in ids]
+        if len(keep) == len(self._ids):
+            return False
+        # fancy indexing copies, so a memory-mapped matrix becomes an in-memory one
+        self._vectors = self.vectors[keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._ids = [self._ids[i] for i in keep]
+        self._backend = None
+        self._bm25 = None
+        return True
+
+    @property
+    def backend(self):
+        """
+        The search backend (see ``ann_index``), fitted on the current vectors.
+        """
+        if self._backend is None or self._backend.n_vectors != len(self):
+            backend_class = SEARCH_BACKENDS[self.search_backend]
+            self._backend = backend_class(**self.search_params).fit(self.vectors)
+        return self._backend
+
+    @property
+    def bm25(self):
+        """
+        The BM25 index (see ``bm25_index``) of the current chunk texts.
+        """
+        if self._bm25 is None or self._bm25.n_docs != len(self):
+            self._bm25 = BM25Index().fit(self._texts)
+        return self._bm25
+
+    def keyword_search_with_score(
+        self, query: str, k: int = DEFAULT_K
+    ) -> List[Tuple[Document, float]]:
+        """
+        BM25 search, the scores are BM25 scores (higher is better).
+        """
+        indices, scores = self.bm25.search(query, k)
+        return [
+            (self._document(int(idx)), float(score))
+            for idx, score in zip(indices, scores)
+        ]
+
+    def _search_by_vector(self, query_vector, k) -> List[Tuple[int, float]]:
+        if not len(self._texts):
+            return []
+        query = _normalize(query_vector)
+        indices, similarities = self.backend.search(self.vectors, query, k)
+        return [
+            (int(idx), float(1.0 - similarity))
+            for idx, similarity in zip(indices, similarities)
+        ]
+
+    def _document(self, idx) -> Document:
+        return Document(
+            page_content=self._texts[idx],
+            metadata={"id": self._ids[idx], **self._metadatas[idx]},
+        )
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = DEFAULT_K, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return [
+            (self._document(idx), dist)
+            for idx, dist in self._search_by_vector(embedding, k)
+        ]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = DEFAULT_K, **kwargs: Any
+    ) -> List[Document]:
+        docs_scores = self.similarity_search_by_vector_with_score(embedding, k=k)
+        return [doc for doc, _ in docs_scores]
+
+    def similarity_search_with_score(
+        self, query: str, *, k: int = DEFAULT_K, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        query_embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(query_embedding, k=k)
+
+    def similarity_search(
+        self, query: str, k: int = DEFAULT_K, **kwargs: Any
+    ) -> List[Document]:
+        docs_scores = self.similarity_search_with_score(query, k=k, **kwargs)
+        return [doc for doc, _ in docs_scores]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        search_backend: str = "exact",
+        search_params: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        vs = cls(embedding, search_backend=search_backend, search_params=search_params)
+        vs.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vs
+
+    def save(self, path, info=None):
+        """
+        Writes the index to the directory ``path``. The directory is written
+        next to its final location and swapped in, so readers never see a
+        partially written index.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix=".tmp-index-")
+        try:
+            np.save(
+                os.path.join(tmp_path, "embeddings.npy"),
+                np.ascontiguousarray(self.vectors, dtype=np.float32),
+            )
+            with open(os.path.join(tmp_path, "chunks.jsonl"), "w") as f:
+                for id_, text, metadata in zip(self._ids, self._texts, self._metadatas):
+                    record = {"id": id_, "text": text, "metadata": metadata}
+                    f.write(json.dumps(record) + "\n")
+            if len(self):
+                self.backend.save(tmp_path)
+                self.bm25.save(tmp_path)
+            with open(os.path.join(tmp_path, "index.json"), "w") as f:
+                header = {"version": INDEX_FORMAT_VERSION, "n_chunks": len(self)}
+                header.update(info or {})
+                json.dump(header, f, indent=2)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(
+        cls,
+        path,
+        embedding: Embeddings,
+        mmap=True,
+        search_backend="exact",
+        search_params=None,
+    ) -> "NumpyVectorStore":
+        """
+        Loads an index written by ``save``. With ``mmap=True`` the embedding
+        matrix is mapped read-only instead of being read into memory. The
+        search backend is loaded from the index when it was saved with it.
+        """
+        header = read_index_header(path)
+        if header.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(
+                f"Index at {path} has format version {header.get('version')}, "
+                f"expected {INDEX_FORMAT_VERSION}"
+            )
+        vectors = np.load(
+            os.path.join(path, "embeddings.npy"), mmap_mode="r" if mmap else None
+        )
+        texts, metadatas, ids = [], [], []
+        with open(os.path.join(path, "chunks.jsonl")) as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                texts.append(record["text"])
+                metadatas.append(record["metadata"])
+        vs = cls(
+            embedding,
+            vectors=vectors,
+            texts=texts,
+            metadatas=metadatas,
+            ids=ids,
+            search_backend=search_backend,
+            search_params=search_params,
+        )
+        vs._backend = SEARCH_BACKENDS[search_backend].load(path, **vs.search_params)
+        vs._bm25 = BM25Index.load(path)
+        vs.info = header
+        return vs
+
+
+def is_index(path):
+    return os.path.exists(os.path.join(path, "index.json"))
+
+
+def read_index_header(path):
+    with open(os.path.join(path, "index.json")) as f:
+        return json.load(f)
+
+
+def sync_index(
+    index_root,
+    name,
+    key,
+    embedding,
+    corpus_path,
+    load_documents,
+    split_documents,
+    info=None,
+    mmap=True,
+    search_backend="exact",
+    search_params=None,
+    split_batch_size=16,
+):
+    """
+    Brings the index ``<index_root>/<name>-<key>`` up to date with the corpus
+    file ``corpus_path``, whose source documents are yielded one at a time by
+    ``load_documents()`` and chunked by ``split_documents(documents)``, which
+    gets up to ``split_batch_size`` changed documents at once.
+
+        - If the corpus file is unchanged the index is loaded as is.
+        - Otherwise the chunks of removed or changed source documents are
+          deleted and only added or changed documents are split and embedded.
+        - Without an index for this key it is built from scratch, and indexes
+          with the same name but another key are removed.
+
+    The store searches with ``search_backend`` (see ``ann_index``), whose
+    fitted state is saved with the index.
+
+    Returns the vector store and one of ``"loaded"``, ``"updated"``, ``"built"``.
+    """
+    backend = {"search_backend": search_backend, "search_params": search_params}
+    path = os.path.join(index_root, f"{name}-{key}")
+    corpus_hash = file_sha256(corpus_path)
+
+    if is_index(path):
+        header = read_index_header(path)
+        if header.get("version") == INDEX_FORMAT_VERSION:
+            if header["corpus_hash"] == corpus_hash:
+                vectorstore = NumpyVectorStore.load(
+                    path, embedding, mmap=mmap, **backend
+                )
+                if vectorstore._backend is None and len(vectorstore):
+                    # first start with this backend: fit it once and keep it
+                    vectorstore.backend.save(path)
+                if vectorstore._bm25 is None and len(vectorstore):
+                    # index saved before it had a BM25 index
+                    vectorstore.bm25.save(path)
+                return vectorstore, "loaded"
+            vectorstore = NumpyVectorStore.load(path, embedding, mmap=False, **backend)
+            sources = header["sources"]
+            status = "updated"
+        else:
+            vectorstore, sources, status = (
+                NumpyVectorStore(embedding, **backend),
+                {},
+                "built",
+            )
+    else:
+        vectorstore, sources, status = (
+            NumpyVectorStore(embedding, **backend),
+            {},
+            "built",
+        )
+
+    def add(changed):
+        chunks_by_source = {}
+        for chunk in split_documents([document for document, _ in changed]):
+            chunks_by_source.setdefault(chunk.metadata["source"], []).append(chunk)
+        all_chunks, all_ids = [], []
+        for document, text_hash in changed:
+            source = document.metadata["source"]
+            if source in sources:
+                vectorstore.delete(sources.pop(source)["chunk_ids"])
+            chunks = chunks_by_source.get(source, [])
+            # several sources can have the same text, so the source is part
+            # of the ids of its chunks
+            source_hash = text_sha256(source)[:8]
+            chunk_ids = [
+                f"{source_hash}-{text_hash[:16]}-{n}" for n in range(len(chunks))
+            ]
+            sources[source] = {"sha256": text_hash, "chunk_ids": chunk_ids}
+            all_chunks += chunks
+            all_ids += chunk_ids
+        vectorstore.add_documents(all_chunks, ids=all_ids)
+
+    # documents are streamed, only new or changed ones are split and embedded,
+    # a batch at a time so they can be split in parallel and embedded together
+    current, changed = {}, []
+    for document in load_documents():
+        source = document.metadata["source"]
+        text_hash = current[source] = text_sha256(document.page_content)
+        if sources.get(source, {}).get("sha256") == text_hash:
+            continue
+        changed.append((document, text_hash))
+        if len(changed) == split_batch_size:
+            add(changed)
+            changed = []
+    if changed:
+        add(changed)
+
+    removed = [source for source in sources if source not in current]
+    vectorstore.delete(
+        [id_ for source in removed for id_ in sources[source]["chunk_ids"]]
+    )
+    for source in removed:
+        del sources[source]
+
+    vectorstore.save(
+        path,
+        info={
+            "key": key,
+            **(info or {}),
+            "corpus_hash": corpus_hash,
+            "sources": sources,
+        },
+    )
+    if status == "built":
+        for entry in os.listdir(index_root):
+            other = os.path.join(index_root, entry)
+            if entry.startswith(f"{name}-") and other != path and is_index(other):
+                shutil.rmtree(other, ignore_errors=True)
+
+    # reload so the index is served memory-mapped as on warm starts
+    return NumpyVectorStore.load(path, embedding, mmap=mmap, **backend), status